@@ -1,3 +1,4 @@
+import os
 from flask import Flask, jsonify
 from flask_cors import CORS
 
@@ -6,13 +7,18 @@ from routes.folders import folders_bp
 from routes.study import study_bp
 from routes.flashcards import flashcards_bp
 from routes.ai import ai_bp
+from schema import bootstrap_indexes
+from metrics import init_metrics
+from json_provider import MongoJSONProvider
 from dotenv import load_dotenv
 
 load_dotenv()
 
 def create_app():
     app = Flask(__name__)
+    app.json = MongoJSONProvider(app)
     CORS(app)
+    init_metrics(app)
 
     app.register_blueprint(auth_bp)
     app.register_blueprint(folders_bp)
@@ -20,6 +26,10 @@ def create_app():
     app.register_blueprint(flashcards_bp)
     app.register_blueprint(ai_bp)
 
+    if os.getenv("MONGO_ENSURE_INDEXES", "1") == "1":
+        bootstrap_indexes()
+
+    # /metrics è registrato da init_metrics
     @app.route("/health")
     def health():
         return jsonify({"status": "ok"})
@@ -0,0 +1,71 @@
+# ============================================================
+# bench_json.py — serialize_doc + jsonify vs MongoJSONProvider
+# ============================================================
+# python bench_json.py [numero_card]   (default 10000, nessun DB richiesto)
+# ============================================================
+import sys
+import timeit
+from datetime import datetime
+from bson import ObjectId
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+from json_provider import MongoJSONProvider
+
+
+# Vecchio helper di routes/folders.py, tenuto qui solo come riferimento
+def serialize_doc(doc):
+    if isinstance(doc, list):
+        return [serialize_doc(d) for d in doc]
+    elif isinstance(doc, dict):
+        return {
+            k: (str(v) if isinstance(v, ObjectId) else serialize_doc(v))
+            for k, v in doc.items()
+        }
+    return doc
+
+
+def make_cards(n):
+    folder_oid = ObjectId()
+    return [
+        {
+            "_id": ObjectId(),
+            "folderId": folder_oid,
+            "front": f"Domanda numero {i}: cos'è il concetto {i}?",
+            "back": "Risposta di lunghezza media " * 4,
+            "createdAt": datetime.now(),
+            "aiGenerated": i % 2 == 0,
+        }
+        for i in range(n)
+    ]
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    cards = make_cards(n)
+
+    old_app = Flask("old")
+    old_app.json = DefaultJSONProvider(old_app)
+    new_app = Flask("new")
+    new_app.json = MongoJSONProvider(new_app)
+
+    def old():
+        with old_app.app_context():
+            return old_app.json.response(serialize_doc(cards)).get_data()
+
+    def new():
+        with new_app.app_context():
+            return new_app.json.response(cards).get_data()
+
+    assert old() == new(), "output diverso tra i due metodi"
+
+    runs = 10
+    t_old = min(timeit.repeat(old, number=1, repeat=runs))
+    t_new = min(timeit.repeat(new, number=1, repeat=runs))
+    print(f"{n} card, migliore di {runs} esecuzioni")
+    print(f"  serialize_doc + jsonify : {t_old * 1000:8.1f} ms")
+    print(f"  MongoJSONProvider       : {t_new * 1000:8.1f} ms  ({t_old / t_new:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,75 @@
+# ============================================================
+# db.py — MongoClient gestito, uno per processo
+# ============================================================
+# Il client viene creato al primo uso nel processo corrente: con
+# gunicorn --preload ogni worker ne apre uno suo dopo il fork invece
+# di ereditare quello del master (vedi gunicorn.conf.py).
+#
+# Variabili d'ambiente (opzionali, default di pymongo se assenti):
+#   MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE, MONGO_WAIT_QUEUE_TIMEOUT_MS,
+#   MONGO_SERVER_SELECTION_TIMEOUT_MS, MONGO_COMPRESSORS (es. "zstd,zlib"),
+#   MONGO_READ_PREFERENCE (es. "primaryPreferred")
+# ============================================================
 from pymongo import MongoClient
 import os
+import threading
 
 MONGO_URI = os.getenv("MONGO_URI")
-client = MongoClient(MONGO_URI)
-db = client.flashcards
\ No newline at end of file
+DB_NAME   = "flashcards"
+
+_INT_OPTIONS = {
+    "maxPoolSize":              "MONGO_MAX_POOL_SIZE",
+    "minPoolSize":              "MONGO_MIN_POOL_SIZE",
+    "waitQueueTimeoutMS":       "MONGO_WAIT_QUEUE_TIMEOUT_MS",
+    "serverSelectionTimeoutMS": "MONGO_SERVER_SELECTION_TIMEOUT_MS",
+}
+
+_client = None
+_pid    = None
+_lock   = threading.Lock()
+
+
+def client_options():
+    options = {
+        name: int(os.environ[env]) for name, env in _INT_OPTIONS.items() if os.getenv(env)
+    }
+    if os.getenv("MONGO_COMPRESSORS"):
+        options["compressors"] = os.environ["MONGO_COMPRESSORS"]
+    if os.getenv("MONGO_READ_PREFERENCE"):
+        options["readPreference"] = os.environ["MONGO_READ_PREFERENCE"]
+    return options
+
+
+def get_client():
+    """Client del processo corrente; dopo un fork ne crea uno nuovo."""
+    global _client, _pid
+    pid = os.getpid()
+    if _client is None or _pid != pid:
+        with _lock:
+            if _client is None or _pid != pid:
+                # Il client ereditato dal padre non va usato né chiuso qui
+                _client = MongoClient(MONGO_URI, connect=False, **client_options())
+                _pid    = pid
+    return _client
+
+
+def close_client():
+    """Chiude il client del processo corrente (uscita del worker)."""
+    global _client, _pid
+    with _lock:
+        if _client is not None and _pid == os.getpid():
+            _client.close()
+        _client, _pid = None, None
+
+
+class _LazyDatabase:
+    """Proxy di client.flashcards: risolve il client a ogni accesso."""
+
+    def __getattr__(self, name):
+        return getattr(get_client()[DB_NAME], name)
+
+    def __getitem__(self, name):
+        return get_client()[DB_NAME][name]
+
+
+db = _LazyDatabase()
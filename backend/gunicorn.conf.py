@@ -0,0 +1,49 @@
+# ============================================================
+# gunicorn.conf.py — gunicorn -c gunicorn.conf.py app:app
+# ============================================================
+import os
+import glob
+import tempfile
+
+bind        = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers     = int(os.getenv("WEB_CONCURRENCY", 2))
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+
+# Più richieste per processo: i pool limitati (bcrypt, AI) occupano al
+# massimo una parte dei thread e, quando sono pieni, le altre richieste
+# ricevono 503 invece di restare in coda. Con il worker sync (una
+# richiesta per processo) quel limite non verrebbe mai raggiunto.
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+threads      = int(os.getenv("GUNICORN_THREADS", 8))
+# Letta dall'app per dimensionare i pool (services/passwords.py)
+os.environ["GUNICORN_THREADS"] = str(threads)
+
+# /metrics somma i contatori di tutti i worker tramite questa cartella
+# (vedi metrics.py); impostata qui, prima che l'app venga importata
+os.environ.setdefault(
+    "METRICS_DIR", os.path.join(tempfile.gettempdir(), f"flashcards-metrics-{os.getpid()}")
+)
+
+
+def on_starting(server):
+    # I contatori ripartono da zero a ogni avvio del master
+    directory = os.environ["METRICS_DIR"]
+    os.makedirs(directory, exist_ok=True)
+    for path in glob.glob(os.path.join(directory, "*.json")):
+        os.remove(path)
+
+
+def when_ready(server):
+    # Il master ha caricato l'app (e creato gli indici): chiude il suo
+    # client prima del fork, ogni worker aprirà il proprio
+    from db import close_client
+    close_client()
+
+
+def worker_exit(server, worker):
+    from db import close_client
+    from metrics import dump
+    from services.result_buffer import buffer
+    buffer.flush()
+    dump()
+    close_client()
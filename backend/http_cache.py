@@ -0,0 +1,30 @@
+# ============================================================
+# http_cache.py — ETag e GET condizionali
+# ============================================================
+# Gli ETag derivano dal campo "version" delle cartelle, incrementato
+# a ogni modifica di card o membri (services/folder_events.py).
+# Cache-Control "private, no-cache" fa sì che il browser conservi la
+# risposta e la riconvalidi con If-None-Match a ogni richiesta.
+# ============================================================
+import hashlib
+from flask import request, Response
+
+
+def make_etag(*parts):
+    return hashlib.sha1("|".join(str(p) for p in parts).encode()).hexdigest()[:20]
+
+
+def is_fresh(etag):
+    """True se il client ha già la versione corrente (If-None-Match)."""
+    return request.if_none_match.contains_weak(etag)
+
+
+def not_modified(etag):
+    response = Response(status=304)
+    return with_etag(response, etag)
+
+
+def with_etag(response, etag):
+    response.set_etag(etag, weak=True)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
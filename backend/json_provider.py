@@ -0,0 +1,18 @@
+# ============================================================
+# json_provider.py — Serializzazione JSON dei documenti MongoDB
+# ============================================================
+# Sostituisce serialize_doc: ObjectId e datetime vengono convertiti
+# dall'encoder durante l'unico passaggio di jsonify, a qualsiasi
+# profondità, senza copiare i documenti.
+# ============================================================
+from bson import ObjectId
+from flask.json.provider import DefaultJSONProvider
+
+
+class MongoJSONProvider(DefaultJSONProvider):
+    @staticmethod
+    def default(o):
+        if isinstance(o, ObjectId):
+            return str(o)
+        # datetime, date, UUID, dataclass…: come il provider di Flask
+        return DefaultJSONProvider.default(o)
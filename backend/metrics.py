@@ -0,0 +1,291 @@
+# ============================================================
+# metrics.py — Contatori richieste / comandi MongoDB e /metrics
+# ============================================================
+# Un CommandListener di pymongo conta comandi e tempi per collezione,
+# gli hook Flask attribuiscono i comandi all'endpoint che li ha eseguiti.
+# Esposizione in formato testo Prometheus su GET /metrics.
+#
+# Con più worker gunicorn ogni processo ha il proprio registry: se
+# METRICS_DIR è impostata (gunicorn.conf.py la imposta di default) ogni
+# worker salva periodicamente i suoi contatori in un file della cartella
+# e /metrics li somma, così lo scrape non dipende dal worker che risponde.
+# I file dei worker terminati restano, quindi i contatori non calano;
+# la cartella viene svuotata all'avvio del master.
+#
+# Variabili d'ambiente (opzionali):
+#   METRICS_SERVER_TIMING=1   aggiunge l'header Server-Timing alle risposte
+#   METRICS_DIR               cartella condivisa tra i worker
+#   METRICS_FLUSH_INTERVAL    secondi tra un salvataggio e l'altro (default 5)
+# ============================================================
+import os
+import json
+import glob
+import time
+import uuid
+import threading
+import traceback
+from bisect import bisect_left
+from flask import request, Response
+from pymongo import monitoring
+
+SERVER_TIMING  = os.getenv("METRICS_SERVER_TIMING", "0") == "1"
+METRICS_DIR    = os.getenv("METRICS_DIR")
+FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", 5))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS   = (0, 1, 2, 3, 5, 10, 20, 50, 100, 500, 1000)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts  = [0] * (len(buckets) + 1)   # ultimo = +Inf
+        self.sum     = 0.0
+        self.count   = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum   += value
+        self.count += 1
+
+    def merge(self, counts, total, count):
+        for i, c in enumerate(counts):
+            self.counts[i] += c
+        self.sum   += total
+        self.count += count
+
+
+class Registry:
+    """Contatori e istogrammi etichettati, protetti da un solo lock."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.pid        = os.getpid()
+        self.file_name  = f"{self.pid}-{uuid.uuid4().hex[:8]}.json"
+        self.counters   = {}   # (nome, labels) → valore
+        self.histograms = {}   # (nome, labels) → Histogram
+
+    def _check_fork(self):
+        # Un worker non eredita i contatori del master (gunicorn --preload)
+        if self.pid != os.getpid():
+            self._reset()
+
+    def inc(self, name, labels, value=1):
+        key = (name, labels)
+        with self.lock:
+            self._check_fork()
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, value, buckets=LATENCY_BUCKETS):
+        key = (name, labels)
+        with self.lock:
+            self._check_fork()
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = Histogram(buckets)
+            hist.observe(value)
+
+    # ── Aggregazione tra processi ────────────────────────────
+    def snapshot(self):
+        """Stato serializzabile in JSON (labels come liste di coppie)."""
+        with self.lock:
+            self._check_fork()
+            return {
+                "counters": [[n, labels, v] for (n, labels), v in self.counters.items()],
+                "histograms": [
+                    [n, labels, list(h.buckets), list(h.counts), h.sum, h.count]
+                    for (n, labels), h in self.histograms.items()
+                ],
+            }
+
+    def merge(self, snapshot):
+        with self.lock:
+            for n, labels, v in snapshot["counters"]:
+                key = (n, tuple(tuple(p) for p in labels))
+                self.counters[key] = self.counters.get(key, 0) + v
+            for n, labels, buckets, counts, total, count in snapshot["histograms"]:
+                key = (n, tuple(tuple(p) for p in labels))
+                hist = self.histograms.get(key)
+                if hist is None:
+                    hist = self.histograms[key] = Histogram(tuple(buckets))
+                hist.merge(counts, total, count)
+
+    def dump(self, directory):
+        """Scrive lo snapshot del processo in directory (rename atomico)."""
+        snapshot = self.snapshot()
+        path = os.path.join(directory, self.file_name)
+        tmp  = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp, path)
+
+    def render(self):
+        def fmt(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+        lines = []
+        with self.lock:
+            for name in sorted({n for n, _ in self.counters}):
+                lines.append(f"# TYPE {name} counter")
+                for (n, labels), value in self.counters.items():
+                    if n == name:
+                        lines.append(f"{name}{fmt(labels)} {value}")
+            for name in sorted({n for n, _ in self.histograms}):
+                lines.append(f"# TYPE {name} histogram")
+                for (n, labels), hist in self.histograms.items():
+                    if n != name:
+                        continue
+                    cumulative = 0
+                    for le, c in zip(hist.buckets, hist.counts):
+                        cumulative += c
+                        lines.append(f"{name}_bucket{fmt(labels, [('le', le)])} {cumulative}")
+                    lines.append(f"{name}_bucket{fmt(labels, [('le', '+Inf')])} {hist.count}")
+                    lines.append(f"{name}_sum{fmt(labels)} {hist.sum:.6f}")
+                    lines.append(f"{name}_count{fmt(labels)} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def collect():
+    """
+    Registry da esporre: quello del processo più, con METRICS_DIR, gli
+    ultimi snapshot salvati dagli altri worker (anche terminati).
+    """
+    if not METRICS_DIR:
+        return registry
+    merged = Registry()
+    merged.merge(registry.snapshot())
+    own = registry.file_name
+    for path in glob.glob(os.path.join(METRICS_DIR, "*.json")):
+        if os.path.basename(path) == own:
+            continue
+        try:
+            with open(path) as f:
+                merged.merge(json.load(f))
+        except (OSError, ValueError):
+            continue   # file di un worker in scrittura o rimosso
+    return merged
+
+
+def dump():
+    """Salva i contatori del processo (anche all'uscita del worker)."""
+    if METRICS_DIR:
+        registry.dump(METRICS_DIR)
+
+
+class Dumper:
+    def __init__(self, interval=FLUSH_INTERVAL):
+        self.interval = interval
+        self.lock     = threading.Lock()
+        self.thread   = None
+
+    def ensure_thread(self):
+        # Avviato alla prima richiesta, quindi nel worker e non nel master
+        if self.thread is None or not self.thread.is_alive():
+            with self.lock:
+                if self.thread is None or not self.thread.is_alive():
+                    self.thread = threading.Thread(target=self._run, daemon=True)
+                    self.thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                dump()
+            except Exception:
+                traceback.print_exc()
+
+
+dumper = Dumper()
+_listener = None
+
+# Stato della richiesta corrente: pymongo chiama il listener nello
+# stesso thread che esegue il comando
+_local = threading.local()
+
+
+class CommandMetrics(monitoring.CommandListener):
+    def __init__(self):
+        self.collections = {}   # request_id → collezione
+
+    def started(self, event):
+        coll = event.command.get(event.command_name)
+        self.collections[event.request_id] = coll if isinstance(coll, str) else ""
+
+    def _finish(self, event, status):
+        coll    = self.collections.pop(event.request_id, "")
+        seconds = event.duration_micros / 1e6
+        labels  = (("command", event.command_name), ("collection", coll))
+        registry.inc("mongo_commands_total", labels + (("status", status),))
+        registry.observe("mongo_command_duration_seconds", labels, seconds)
+
+        req = getattr(_local, "request", None)
+        if req is not None:
+            req["commands"] += 1
+            req["db_seconds"] += seconds
+
+    def succeeded(self, event):
+        self._finish(event, "ok")
+
+    def failed(self, event):
+        self._finish(event, "error")
+
+
+def _before_request():
+    if METRICS_DIR:
+        dumper.ensure_thread()
+    _local.request = {"start": time.perf_counter(), "commands": 0, "db_seconds": 0.0}
+
+
+def _after_request(response):
+    req = getattr(_local, "request", None)
+    if req is None:
+        return response
+    elapsed  = time.perf_counter() - req["start"]
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+
+    registry.inc("http_requests_total", (
+        ("endpoint", endpoint), ("method", request.method), ("status", response.status_code),
+    ))
+    registry.observe("http_request_duration_seconds", (("endpoint", endpoint),), elapsed)
+    registry.observe("mongo_commands_per_request", (("endpoint", endpoint),),
+                     req["commands"], buckets=COUNT_BUCKETS)
+    registry.observe("mongo_time_per_request_seconds", (("endpoint", endpoint),),
+                     req["db_seconds"])
+
+    if SERVER_TIMING:
+        response.headers["Server-Timing"] = (
+            f'db;dur={req["db_seconds"] * 1000:.1f};desc="{req["commands"]} cmd", '
+            f"app;dur={elapsed * 1000:.1f}"
+        )
+    return response
+
+
+def _teardown_request(exc):
+    _local.request = None
+
+
+def init_metrics(app):
+    """
+    Registra il listener (prima della creazione del client MongoDB),
+    gli hook di richiesta e l'endpoint /metrics.
+    """
+    global _listener
+    if _listener is None:
+        _listener = CommandMetrics()
+        monitoring.register(_listener)
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+
+    @app.route("/metrics")
+    def metrics():
+        return Response(collect().render(), mimetype="text/plain; version=0.0.4")
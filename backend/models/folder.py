@@ -4,20 +4,40 @@
 import random
 import string
 from datetime import datetime
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 from db import db
+from schema import unique_index_ready
+
+JOIN_CODE_ATTEMPTS = 5
 
 
 def generate_join_code(length=7):
     """
-    Genera un codice univoco alfanumerico maiuscolo (es. "A3K9XWZ").
-    Controlla il DB finché non trova un codice non ancora usato.
+    Genera un codice alfanumerico maiuscolo (es. "A3K9XWZ").
+    L'unicità è garantita dall'indice unique su joinCode: vedi insert_folder.
     """
     chars = string.ascii_uppercase + string.digits
-    while True:
-        code = "".join(random.choices(chars, k=length))
-        # Garantisce unicità nel database
-        if not db.folders.find_one({"joinCode": code}):
-            return code
+    return "".join(random.choices(chars, k=length))
+
+
+def insert_folder(folder):
+    """
+    Inserisce la cartella; se il joinCode è già usato ne genera
+    un altro e riprova, senza find preventivo. Se l'indice unique su
+    joinCode manca, il codice viene controllato con una find.
+    """
+    if not unique_index_ready("joinCode_unique"):
+        while db.folders.find_one({"joinCode": folder["joinCode"]}, {"_id": 1}):
+            folder["joinCode"] = generate_join_code()
+        return db.folders.insert_one(folder)
+
+    for _ in range(JOIN_CODE_ATTEMPTS - 1):
+        try:
+            return db.folders.insert_one(folder)
+        except DuplicateKeyError:
+            folder["joinCode"] = generate_join_code()
+    return db.folders.insert_one(folder)
 
 
 def create_folder(name, owner_id):
@@ -27,6 +47,9 @@ def create_folder(name, owner_id):
       - ownerId     : ObjectId del creatore
       - joinCode    : codice univoco per unirsi
       - members     : lista membri [{ userId, role }]
+      - version     : contatore delle modifiche (card e membri), per gli ETag
+      - cardCount   : numero di card, aggiornato insieme a version
+      - signaturesIndexed : tutte le card hanno la firma dei quasi-duplicati
       - createdAt   : timestamp
     """
     return {
@@ -39,5 +62,65 @@ def create_folder(name, owner_id):
                 "role": "owner",
             }
         ],
+        "version": 0,
+        "cardCount": 0,
+        "signaturesIndexed": True,
         "createdAt": datetime.now(),
-    }
\ No newline at end of file
+    }
+
+
+def touch_folder(folder_oid, cards=0):
+    """
+    Incrementa atomicamente la versione della cartella e la restituisce.
+    cards è la variazione del numero di card, applicata nello stesso
+    update; sulle cartelle senza cardCount (precedenti al contatore)
+    $add su un campo mancante dà null e il contatore resta assente.
+    """
+    folder = db.folders.find_one_and_update(
+        {"_id": folder_oid},
+        [{"$set": {
+            "version":   {"$add": [{"$ifNull": ["$version", 0]}, 1]},
+            "cardCount": {"$add": ["$cardCount", cards]},
+        }}],
+        projection={"version": 1}, return_document=ReturnDocument.AFTER,
+    )
+    return folder["version"] if folder else None
+
+
+def folder_version(folder_oid):
+    folder = db.folders.find_one({"_id": folder_oid}, {"version": 1})
+    return folder.get("version", 0) if folder else None
+
+
+def folder_counters(folder_oid):
+    """
+    (versione, numero di card) della cartella, (None, None) se non esiste.
+    Le cartelle non ancora migrate (python -m services.scheduler) vengono
+    contate a ogni chiamata.
+    """
+    folder = db.folders.find_one({"_id": folder_oid}, {"version": 1, "cardCount": 1})
+    if folder is None:
+        return None, None
+    count = folder.get("cardCount")
+    if count is None:
+        count = db.flashcards.count_documents({"folderId": folder_oid})
+    return folder.get("version", 0), count
+
+
+def recount_cards():
+    """
+    Migrazione: ricalcola cardCount di tutte le cartelle con
+    un'aggregazione sull'indice (folderId, _id). Va eseguita a scritture
+    ferme, perché non è atomica rispetto agli insert concorrenti.
+    Restituisce il numero di cartelle aggiornate.
+    """
+    counts = {
+        row["_id"]: row["n"]
+        for row in db.flashcards.aggregate([{"$group": {"_id": "$folderId", "n": {"$sum": 1}}}])
+    }
+    updated = 0
+    for folder in db.folders.find({}, {"_id": 1}):
+        updated += db.folders.update_one(
+            {"_id": folder["_id"]}, {"$set": {"cardCount": counts.get(folder["_id"], 0)}}
+        ).modified_count
+    return updated
@@ -0,0 +1,85 @@
+# ============================================================
+# models/progress.py — Card già viste per (utente, cartella)
+# ============================================================
+# Un documento studyProgress { userId, folderId, seen, answers } per
+# coppia. seen conta le righe flashcardStats con nextDue dell'utente nella
+# cartella, così lo scheduler conosce le card mai viste (cardCount - seen)
+# senza contare.
+#   +1  quando un risultato crea la riga stats (upsert in scheduler.py)
+#   -1  quando il reaper elimina la riga (services/reaper.py)
+# Nel dubbio il contatore sbaglia per difetto: le card mai viste vengono
+# sovrastimate e lo scheduler le cerca comunque.
+# I contatori esistenti si ricalcolano con python -m services.scheduler.
+#
+# answers conta i risultati scritti per (utente, cartella), in qualsiasi
+# worker: le sessioni di studio in cache (services/study_session.py) lo
+# usano per accorgersi dei risultati registrati altrove.
+# ============================================================
+from collections import Counter
+
+from pymongo import UpdateOne
+
+from db import db
+
+
+def seen_count(user_oid, folder_oid):
+    progress = db.studyProgress.find_one(
+        {"userId": user_oid, "folderId": folder_oid}, {"seen": 1}
+    )
+    return max(0, progress.get("seen", 0)) if progress else 0
+
+
+def answer_count(user_oid, folder_oid):
+    progress = db.studyProgress.find_one(
+        {"userId": user_oid, "folderId": folder_oid}, {"answers": 1}
+    )
+    return progress.get("answers", 0) if progress else 0
+
+
+def add_seen(counts, answers=None):
+    """
+    counts: {(user_oid, folder_oid): variazione di seen}
+    answers: {(user_oid, folder_oid): risultati scritti}
+    Le variazioni nulle vengono ignorate.
+    """
+    answers = answers or {}
+    ops = []
+    for key in set(counts) | set(answers):
+        user_oid, folder_oid = key
+        inc = {"seen": counts.get(key, 0), "answers": answers.get(key, 0)}
+        inc = {k: v for k, v in inc.items() if v}
+        if inc and folder_oid is not None:
+            ops.append(UpdateOne({"userId": user_oid, "folderId": folder_oid},
+                                 {"$inc": inc}, upsert=any(v > 0 for v in inc.values())))
+    if ops:
+        db.studyProgress.bulk_write(ops, ordered=False)
+
+
+def forget_stats(rows):
+    """Dopo la cancellazione di righe stats (con userId, folderId, nextDue)."""
+    seen = Counter(
+        (s["userId"], s.get("folderId")) for s in rows if s.get("nextDue") is not None
+    )
+    add_seen({key: -n for key, n in seen.items()})
+
+
+def drop_folder_progress(folder_oid):
+    db.studyProgress.delete_many({"folderId": folder_oid})
+
+
+def recount_progress():
+    """Migrazione: ricalcola tutti i contatori dalle righe stats."""
+    rows = list(db.flashcardStats.aggregate([
+        {"$match": {"nextDue": {"$type": "date"}}},
+        {"$group": {"_id": {"userId": "$userId", "folderId": "$folderId"}, "n": {"$sum": 1}}},
+    ]))
+    ops = [
+        UpdateOne({"userId": row["_id"]["userId"], "folderId": row["_id"]["folderId"]},
+                  {"$set": {"seen": row["n"]}}, upsert=True)
+        for row in rows
+    ]
+    # answers non si ricalcola: solo seen viene azzerato
+    db.studyProgress.update_many({}, {"$set": {"seen": 0}})
+    if ops:
+        db.studyProgress.bulk_write(ops, ordered=False)
+    return len(ops)
@@ -5,16 +5,27 @@
 #   pip install groq
 #   Crea account gratuito su https://console.groq.com
 #   Variabile d'ambiente: GROQ_API_KEY=gsk_...
+#   (LLM_CLIENT=stub per lavorare senza rete, vedi services/llm.py)
+#
+# La generazione gira come job (services/ai_jobs.py):
+#   POST /ai/generate        → 202 { "job_id", "status": "queued" }
+#   GET  /ai/jobs/<job_id>   → { "status": queued|running|done|error, ... }
+# oppure in streaming, con POST /ai/generate?stream=ndjson|sse: ogni card
+# viene salvata e inviata appena il modello ne completa l'oggetto JSON.
+# Lo stream tiene occupato il thread della richiesta: il pannello lo usa
+# solo con VITE_AI_STREAMING=1 (worker gthread, vedi services/ai_jobs.py).
 #
 # Registra in app.py:
 #   from routes.ai import ai_bp
 #   app.register_blueprint(ai_bp)
 # ============================================================
-import os
 import json
+import queue
 import re
-from groq import Groq
-from flask import Blueprint, request, jsonify
+import traceback
+from flask import (
+    Blueprint, request, jsonify, g, url_for, Response, current_app, stream_with_context,
+)
 from bson import ObjectId
 from bson.errors import InvalidId
 from flask_cors import cross_origin
@@ -22,65 +33,23 @@ from datetime import datetime
 
 from db import db
 from routes.auth import get_current_user
-from routes.folders import serialize_doc, get_member_role
+from services.membership import folder_members, member_role
+from models.folder import folder_version
+from services.folder_events import cards_written
+from services.ai_cache import cache as generation_cache, generation_key
+from services.llm import get_llm
+from services.ai_jobs import submit_job, get_job, JobFailed, stream_executor
+from services.executor import ExecutorBusy
+from services.json_stream import ArrayStreamParser
+from services.style_profile import folder_style
+from services.near_dupes import DuplicateFilter, filter_duplicates, DUP_MODE
 
 ai_bp = Blueprint("ai", __name__, url_prefix="/ai")
 
-# Client Groq — legge GROQ_API_KEY dall'ambiente
-groq_client = Groq(api_key=os.environ.get("GROQ_API_KEY"))
-
-# Modello gratuito da usare
-GROQ_MODEL = "llama-3.3-70b-versatile"  # oppure "llama3-70b-8192" per qualità maggiore
-
-
-# ── Helper: rileva lo stile predominante delle flashcard ─────
-def analyze_style(cards):
-    """
-    Analizza le flashcard esistenti e restituisce:
-      style  — tipo di domanda prevalente (stringa)
-      length — lunghezza media delle risposte (per calibrare la difficoltà)
-      sample — fino a 4 esempi da mostrare al modello
-    """
-    if not cards:
-        return {
-            "style": "domanda diretta con risposta concisa",
-            "length": "breve (1-2 righe)",
-            "sample": []
-        }
-
-    fronts = " ".join(c.get("front", "").lower() for c in cards)
-
-    # Rilevamento stile per parole chiave
-    if any(k in fronts for k in ["cos'è", "cosa si intende", "definisci", "definizione di"]):
-        style = "definizione di concetti (Cos'è X? → risposta definitoria)"
-    elif any(k in fronts for k in ["differenza tra", "confronta", " vs ", "versus"]):
-        style = "confronto tra concetti (Differenza tra X e Y? → distinzione chiara)"
-    elif any(k in fronts for k in ["calcola", "risolvi", "quanto vale", "formula", "equazione"]):
-        style = "esercizio numerico o formula (es: Formula di X? → formula con breve spiegazione)"
-    elif any(k in fronts for k in ["vero o falso", "true or false"]):
-        style = "vero o falso (Affermazione → Vero/Falso + motivazione breve)"
-    elif any(k in fronts for k in ["completa", "___", "..."]):
-        style = "completamento di frase (Frase incompleta → parola/frase mancante)"
-    elif any(k in fronts for k in ["perché", "spiega perché", "come funziona", "come mai"]):
-        style = "spiegazione causale (Perché X? → spiegazione concisa)"
-    elif any(k in fronts for k in ["elenca", "quali sono", "nomina", "cita"]):
-        style = "enumerazione (Quali sono X? → lista puntata breve)"
-    else:
-        style = "domanda diretta con risposta concisa"
-
-    # Calibra lunghezza risposta attesa
-    avg = sum(len(c.get("back", "")) for c in cards) / len(cards)
-    if avg < 60:
-        length = "molto breve (max 1 riga)"
-    elif avg < 130:
-        length = "breve (1-2 righe)"
-    else:
-        length = "medio (2-4 righe)"
-
-    # Fino a 4 esempi rappresentativi
-    sample = [{"front": c["front"], "back": c["back"]} for c in cards[:4]]
-
-    return {"style": style, "length": length, "sample": sample}
+SYSTEM_PROMPT = (
+    "Sei un assistente specializzato nella creazione di flashcard didattiche. "
+    "Rispondi SOLO con JSON valido, senza testo aggiuntivo, senza markdown."
+)
 
 
 # ── Helper: costruisce il prompt ─────────────────────────────
@@ -136,6 +105,13 @@ def extract_json(text):
     raise ValueError(f"Nessun JSON valido trovato nella risposta: {text[:200]}")
 
 
+def busy():
+    """503 quando il pool delle generazioni è pieno."""
+    response = jsonify({"error": "troppe generazioni in corso, riprova tra poco"})
+    response.headers["Retry-After"] = "5"
+    return response, 503
+
+
 # ── POST /ai/generate — endpoint principale ──────────────────
 @ai_bp.route("/generate", methods=["POST"])
 @cross_origin(origin="http://localhost:5173")
@@ -147,12 +123,8 @@ def generate_flashcards():
       "count":     5            # opzionale, default 5, max 10
     }
 
-    Risposta: {
-      "generated": [ { "front": "...", "back": "..." }, ... ],
-      "saved":     [ { "_id": "...", "front": "...", "back": "..." }, ... ],
-      "style_detected": "...",
-      "count": 5
-    }
+    Risposta (202): { "job_id": "...", "status": "queued" }
+    Il risultato si legge da GET /ai/jobs/<job_id>.
     """
     user_id = get_current_user(request)
     if not user_id:
@@ -172,78 +144,295 @@ def generate_flashcards():
     except (InvalidId, TypeError):
         return jsonify({"error": "folder_id non valido"}), 400
 
-    folder = db.folders.find_one({"_id": folder_oid})
-    if not folder:
+    members = folder_members(folder_oid, user_id)
+    if members is None:
         return jsonify({"error": "cartella non trovata"}), 404
-    if not get_member_role(folder, user_id):
+    if not member_role(members, user_id):
         return jsonify({"error": "accesso negato"}), 403
 
-    # 1. Carica tutte le flashcard esistenti nella cartella
-    existing_cards = list(db.flashcards.find({"folderId": folder_oid}))
+    stream = request.args.get("stream")
+    if stream in ("ndjson", "sse"):
+        return stream_generation(folder_oid, topic, count, stream)
+    if stream:
+        return jsonify({"error": "stream deve essere ndjson o sse"}), 400
+
+    try:
+        job_id = submit_job("generate", g.user_oid, folder_oid,
+                            run_generation, folder_oid, topic, count)
+    except ExecutorBusy:
+        return busy()
+
+    response = jsonify({"job_id": job_id, "status": "queued"})
+    response.headers["Location"] = url_for("ai.get_generation_job", job_id=str(job_id))
+    return response, 202
 
-    # 2. Analizza stile predominante
-    style_info = analyze_style(existing_cards)
 
-    # 3. Costruisce prompt e chiama Groq
+# ── GET /ai/jobs/<job_id> — stato di una generazione ─────────
+@ai_bp.route("/jobs/<job_id>", methods=["GET"])
+@cross_origin(origin="http://localhost:5173")
+def get_generation_job(job_id):
+    """
+    Risposta: { "job_id", "status" } più, a seconda dello stato,
+      done  → "generated", "count", "style_detected", "duplicates_dropped"
+      error → "error" (ed eventualmente "raw")
+    """
+    user_id = get_current_user(request)
+    if not user_id:
+        return jsonify({"error": "non autorizzato"}), 401
+    if not ObjectId.is_valid(job_id):
+        return jsonify({"error": "job_id non valido"}), 400
+
+    job = get_job(ObjectId(job_id), g.user_oid)
+    if job is None:
+        return jsonify({"error": "job non trovato"}), 404
+
+    body = {"job_id": job["_id"], "status": job["status"]}
+    if job["status"] == "done":
+        body.update(job["result"])
+    elif job["status"] == "error":
+        body["error"] = job["error"]
+        if "raw" in job:
+            body["raw"] = job["raw"]
+    return jsonify(body)
+
+
+# ── Helper: passi comuni a job e streaming ───────────────────
+def prepare_generation(folder_oid, topic, count):
+    """Restituisce (style_info, messaggi per il modello)."""
+    # 1. Stile predominante dal profilo incrementale della cartella
+    style_info = folder_style(folder_oid)
+
+    # 2. Front già presenti da mostrare al modello (build_prompt ne usa 20)
+    existing_cards = list(db.flashcards.find(
+        {"folderId": folder_oid}, {"_id": 0, "front": 1}
+    ).limit(20))
+
+    # 3. Costruisce il prompt
     prompt = build_prompt(topic, style_info, existing_cards, count)
+    return style_info, [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt},
+    ]
+
+
+def card_doc(card, folder_oid):
+    """Documento da salvare, o None se la card non ha front e back."""
+    if not (isinstance(card, dict)
+            and isinstance(card.get("front"), str) and card["front"].strip()
+            and isinstance(card.get("back"), str) and card["back"].strip()):
+        return None
+    return {
+        "folderId":  folder_oid,
+        "front":     card["front"].strip(),
+        "back":      card["back"].strip(),
+        "createdAt": datetime.now(),
+        "aiGenerated": True,   # flag utile per analytics future
+    }
+
+
+# ── Job: prompt → modello → JSON → insert_many ───────────────
+def run_generation(folder_oid, topic, count):
+    """
+    Eseguito sul pool di services/ai_jobs. Restituisce il risultato
+    del job o solleva JobFailed. Richieste identiche sulla stessa
+    versione della cartella riusano il risultato (services/ai_cache.py).
+    """
+    llm = get_llm()
+    key = generation_key(folder_oid, folder_version(folder_oid), topic, count, llm.model)
+    return generation_cache.get_or_compute(
+        key, lambda: generate_and_save(folder_oid, topic, count, llm)
+    )
+
+
+def generate_and_save(folder_oid, topic, count, llm):
+    style_info, messages = prepare_generation(folder_oid, topic, count)
 
     try:
-        response = groq_client.chat.completions.create(
-            model=GROQ_MODEL,
-            messages=[
-                {
-                    "role": "system",
-                    "content": (
-                        "Sei un assistente specializzato nella creazione di flashcard didattiche. "
-                        "Rispondi SOLO con JSON valido, senza testo aggiuntivo, senza markdown."
-                    )
-                },
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,   # creatività moderata
-            max_tokens=1500,
-        )
+        # temperature 0.7: creatività moderata
+        raw = llm.complete(messages, temperature=0.7, max_tokens=1500)
     except Exception as e:
-        return jsonify({"error": f"Errore API Groq: {str(e)}"}), 502
-
-    raw = response.choices[0].message.content
+        raise JobFailed(f"Errore API Groq: {str(e)}")
 
     # 4. Estrae e valida il JSON
     try:
         generated = extract_json(raw)
-    except (json.JSONDecodeError, ValueError) as e:
-        return jsonify({
-            "error": "Il modello non ha restituito JSON valido",
-            "raw": raw[:300]
-        }), 502
+    except (json.JSONDecodeError, ValueError):
+        raise JobFailed("Il modello non ha restituito JSON valido", raw=raw[:300])
 
     # 5. Valida struttura: ogni elemento deve avere front e back
-    valid = [
-        c for c in generated
-        if isinstance(c, dict)
-        and c.get("front", "").strip()
-        and c.get("back", "").strip()
-    ]
-    if not valid:
-        return jsonify({"error": "Nessuna flashcard valida generata", "raw": raw[:300]}), 502
-
-    # 6. Salva nel database
-    docs = [
-        {
-            "folderId":  folder_oid,
-            "front":     c["front"].strip(),
-            "back":      c["back"].strip(),
-            "createdAt": datetime.now(),
-            "aiGenerated": True,   # flag utile per analytics future
-        }
-        for c in valid
-    ]
+    docs = [d for d in (card_doc(c, folder_oid) for c in generated) if d]
+    if not docs:
+        raise JobFailed("Nessuna flashcard valida generata", raw=raw[:300])
+
+    # 6. Scarta (o segnala) i quasi-duplicati delle card già presenti
+    docs, dropped = filter_duplicates(folder_oid, docs)
+    if not docs:
+        raise JobFailed("Le flashcard generate sono già presenti nel mazzo", raw=raw[:300])
+
+    # 7. Salva nel database
     result  = db.flashcards.insert_many(docs)
     for doc, inserted_id in zip(docs, result.inserted_ids):
         doc["_id"] = inserted_id
+    version = cards_written(folder_oid, added=docs)
+    if version is None:
+        raise JobFailed("La cartella è stata eliminata")
+
+    result = {
+        "generated":          docs,
+        "count":              len(docs),
+        "style_detected":     style_info["style"],
+        "duplicates_dropped": dropped,
+    }
+    # Un retry legge la versione successiva all'insert: stesso risultato
+    generation_cache.put(generation_key(folder_oid, version, topic, count, llm.model), result)
+    return result
+
 
-    return jsonify({
-        "generated":      serialize_doc(docs),
-        "count":          len(docs),
-        "style_detected": style_info["style"],
-    }), 201
\ No newline at end of file
+# ── Streaming: una card alla volta ───────────────────────────
+SUMMARY_FIELDS = ("count", "style_detected", "duplicates_dropped")
+
+
+def stream_generation(folder_oid, topic, count, fmt):
+    """
+    La generazione gira su stream_executor (services/ai_jobs.py): salva
+    ogni card appena il suo oggetto JSON è completo e passa gli eventi
+    al thread della richiesta tramite una coda. Eventi:
+      card       {"card": {...}}
+      duplicate  {"card": {front, back}, "duplicate_of": id}   (AI_DUP_MODE=drop)
+      done       {"count": n, "style_detected": "...", "duplicates_dropped": n}
+      error      {"error": "..."}
+    In NDJSON ogni riga è {"type": <evento>, ...}.
+
+    Come i job passa dal single-flight di services/ai_cache.py: se la
+    stessa generazione è già in corso (doppio click, job o stream) si
+    attende quella e se ne rimandano le card, senza chiamare il modello.
+    """
+    dumps = current_app.json.dumps
+
+    def event(kind, payload):
+        if fmt == "sse":
+            return f"event: {kind}\ndata: {dumps(payload)}\n\n"
+        return dumps({"type": kind, **payload}) + "\n"
+
+    llm = get_llm()
+    key = generation_key(folder_oid, folder_version(folder_oid), topic, count, llm.model)
+    cached, flight, leader = generation_cache.join(key)
+    events = queue.Queue()
+    if leader:
+        try:
+            stream_executor.submit(produce_stream, folder_oid, topic, count, llm, key, flight,
+                                   lambda kind, payload: events.put((kind, payload)))
+        except ExecutorBusy:
+            generation_cache.finish(key, flight, error=JobFailed(
+                "troppe generazioni in corso, riprova tra poco"
+            ))
+            return busy()
+
+    def replay(result):
+        for doc in result["generated"]:
+            yield event("card", {"card": doc})
+        yield event("done", {k: result[k] for k in SUMMARY_FIELDS})
+
+    def relay():
+        if cached is not None:
+            yield from replay(cached)
+            return
+        if not leader:
+            try:
+                result = flight.wait()
+            except JobFailed as e:
+                yield event("error", {"error": e.message})
+                return
+            except Exception:
+                yield event("error", {"error": "errore interno durante la generazione"})
+                return
+            yield from replay(result)
+            return
+        # Se il client si disconnette la generazione prosegue sul pool
+        while True:
+            kind, payload = events.get()
+            yield event(kind, payload)
+            if kind in ("done", "error"):
+                return
+
+    mimetype = "text/event-stream" if fmt == "sse" else "application/x-ndjson"
+    response = Response(stream_with_context(relay()), mimetype=mimetype)
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"   # niente buffering nei proxy
+    return response
+
+
+def produce_stream(folder_oid, topic, count, llm, key, flight, emit):
+    """
+    Eseguita sul pool: chiama emit(evento, payload), l'ultimo è done o
+    error, e chiude il single-flight di key con lo stesso esito.
+    """
+    try:
+        result = stream_and_save(folder_oid, topic, count, llm, emit)
+    except JobFailed as e:
+        generation_cache.finish(key, flight, error=e)
+        emit("error", {"error": e.message})
+    except Exception:
+        traceback.print_exc()
+        generation_cache.finish(key, flight, error=JobFailed("errore interno durante la generazione"))
+        emit("error", {"error": "errore interno durante la generazione"})
+    else:
+        generation_cache.finish(key, flight, result=result)
+        emit("done", {k: result[k] for k in SUMMARY_FIELDS})
+
+
+def llm_chunks(llm, messages, **opts):
+    """Pezzi di llm.stream; solo gli errori del client diventano JobFailed."""
+    try:
+        yield from llm.stream(messages, **opts)
+    except Exception as e:
+        raise JobFailed(f"Errore API Groq: {str(e)}")
+
+
+def stream_and_save(folder_oid, topic, count, llm, emit):
+    """Come generate_and_save, ma salva e notifica (emit) una card alla volta."""
+    style_info, messages = prepare_generation(folder_oid, topic, count)
+    parser     = ArrayStreamParser()
+    dup_filter = DuplicateFilter(folder_oid) if DUP_MODE != "off" else None
+
+    docs, dropped = [], 0
+    try:
+        for chunk in llm_chunks(llm, messages, temperature=0.7, max_tokens=1500):
+            for card in parser.feed(chunk):
+                doc = card_doc(card, folder_oid)
+                if doc is None:
+                    continue
+                if dup_filter:
+                    dup_of, _ = dup_filter.match(doc["front"])
+                    if dup_of is not None and DUP_MODE == "drop":
+                        dropped += 1
+                        emit("duplicate", {
+                            "card": {"front": doc["front"], "back": doc["back"]},
+                            "duplicate_of": dup_of,
+                        })
+                        continue
+                    if dup_of is not None:
+                        doc["nearDuplicateOf"] = dup_of
+                doc["_id"] = db.flashcards.insert_one(doc).inserted_id
+                if dup_filter:
+                    dup_filter.accept(doc["front"], doc["_id"])
+                docs.append(doc)
+                emit("card", {"card": doc})
+            if parser.done:
+                break
+    except ValueError:
+        raise JobFailed("Il modello non ha restituito JSON valido")
+    finally:
+        if docs:
+            version = cards_written(folder_oid, added=docs)
+
+    if not docs:
+        raise JobFailed("Le flashcard generate sono già presenti nel mazzo"
+                        if dropped else "Nessuna flashcard valida generata")
+    if version is None:
+        raise JobFailed("La cartella è stata eliminata")
+    result = {"generated": docs, "count": len(docs),
+              "style_detected": style_info["style"], "duplicates_dropped": dropped}
+    # Un retry legge la versione successiva all'insert: stesso risultato
+    generation_cache.put(generation_key(folder_oid, version, topic, count, llm.model), result)
+    return result
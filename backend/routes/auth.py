@@ -1,13 +1,23 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, g
 from datetime import datetime, timedelta
+from collections import OrderedDict
 import jwt
-import bcrypt
+import hashlib
+import threading
+import time
 from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo.errors import DuplicateKeyError
 import os
 
 from db import db
+from schema import unique_index_ready
+from services.passwords import (
+    hash_password, check_password, upgrade_hash, HasherBusy,
+)
 
 SECRET_KEY = os.getenv("SECRET_KEY")
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", 4096))
 
 auth_bp = Blueprint("auth", __name__, url_prefix="/auth")
 
@@ -23,16 +33,78 @@ def generate_token(user_id):
     return token
 
 
-def get_current_user(request):
-    auth = request.headers.get("Authorization")
-    if not auth:
-        return None
+# ── Token verificati: LRU per worker ──────────────────────
+# digest del token → (user_id, user_oid, exp). La chiave è lo SHA-256 per
+# non tenere in memoria i token in chiaro; le voci scadono con il token.
+class TokenCache:
+    def __init__(self, maxsize=TOKEN_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock    = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[2] <= time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+
+token_cache = TokenCache()
+
+
+def verify_token(token):
+    """(user_id, user_oid) se il token è valido, altrimenti (None, None)."""
+    key   = hashlib.sha256(token.encode()).digest()
+    entry = token_cache.get(key)
+    if entry is not None:
+        return entry[0], entry[1]
     try:
-        token = auth.split(" ")[1]
         payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
-        return payload["user_id"]
-    except (jwt.ExpiredSignatureError, jwt.InvalidTokenError):
-        return None
+        user_id = payload["user_id"]
+        user_oid = ObjectId(user_id)
+    except (jwt.ExpiredSignatureError, jwt.InvalidTokenError, KeyError, InvalidId, TypeError):
+        return None, None
+    token_cache.put(key, (user_id, user_oid, payload.get("exp", time.time() + 60)))
+    return user_id, user_oid
+
+
+@auth_bp.before_app_request
+def authenticate():
+    """
+    Verifica il token una volta per richiesta e salva l'utente su g:
+    g.user_id (str) e g.user_oid (ObjectId), None se non autenticato.
+    """
+    auth = request.headers.get("Authorization", "")
+    parts = auth.split(" ")
+    if len(parts) == 2 and parts[1]:
+        g.user_id, g.user_oid = verify_token(parts[1])
+    else:
+        g.user_id = g.user_oid = None
+
+
+def get_current_user(request):
+    # Già calcolato da authenticate(); il parametro resta per compatibilità
+    if "user_id" not in g:
+        authenticate()
+    return g.user_id
+
+
+def busy():
+    response = jsonify({"error": "server occupato, riprova tra poco"})
+    response.headers["Retry-After"] = "1"
+    return response, 503
 
 
 # ---------------- REGISTER ----------------
@@ -45,10 +117,14 @@ def register():
     if not email or not password:
         return jsonify({"error": "campi mancanti"}), 400
 
-    if db.users.find_one({"email": email}):
+    # Senza l'indice unique su email il duplicato va cercato prima
+    if not unique_index_ready("email_unique") and db.users.find_one({"email": email}):
         return jsonify({"error": "utente già esistente"}), 400
 
-    pw_hash = bcrypt.hashpw(password.encode(), bcrypt.gensalt())
+    try:
+        pw_hash = hash_password(password)
+    except HasherBusy:
+        return busy()
 
     user = {
         "email": email,
@@ -56,7 +132,11 @@ def register():
         "createdAt": datetime.utcnow()
     }
 
-    res = db.users.insert_one(user)
+    # L'indice unique su email rifiuta i duplicati
+    try:
+        res = db.users.insert_one(user)
+    except DuplicateKeyError:
+        return jsonify({"error": "utente già esistente"}), 400
 
     token = generate_token(res.inserted_id)
 
@@ -74,8 +154,13 @@ def login():
     if not user:
         return jsonify({"error": "utente non trovato"}), 401
 
-    if not bcrypt.checkpw(password.encode(), user["passwordHash"]):
+    try:
+        valid = check_password(password, user["passwordHash"])
+    except HasherBusy:
+        return busy()
+    if not valid:
         return jsonify({"error": "password errata"}), 401
+    upgrade_hash(user, password)
 
     token = generate_token(user["_id"])
 
@@ -1,18 +1,56 @@
 # ============================================================
 # routes/flashcards.py — GET, PUT, DELETE con membership check
 # ============================================================
-from flask import Blueprint, request, jsonify
+# GET /flashcards/<folder_id> accetta (tutti opzionali):
+#   fields=front,back       proiezione dei campi
+#   limit=N&after=<id>      paginazione keyset su _id →
+#                           { "cards": [...], "next_after": id|null }
+#   stream=ndjson|json      risposta in streaming dal cursore
+# Risponde con un ETag (versione cartella + parametri): con If-None-Match
+# corrispondente restituisce 304 senza leggere le card.
+# ============================================================
+from flask import Blueprint, request, jsonify, Response, current_app, stream_with_context
 from bson import ObjectId
 from bson.errors import InvalidId
+from pymongo import InsertOne, UpdateOne, DeleteOne
+from pymongo.errors import BulkWriteError
 from flask_cors import cross_origin
 from datetime import datetime
 
 from db import db
 from routes.auth import get_current_user
-from routes.folders import serialize_doc, get_member_role
+from routes.folders import member_folder
+from services.membership import folder_members, member_role
+from services.folder_events import cards_written
+from http_cache import make_etag, is_fresh, not_modified, with_etag
 
 flashcards_bp = Blueprint("flashcards", __name__, url_prefix="/flashcards")
 
+# Campi richiedibili con ?fields=front,back
+CARD_FIELDS = {"_id", "folderId", "front", "back", "createdAt", "updatedAt", "aiGenerated"}
+
+PAGE_MAX_LIMIT    = 1000
+STREAM_BATCH_SIZE = 500
+BATCH_MAX_OPS     = 1000
+
+
+# ── Helper: proiezione da ?fields= ──────────────────────────
+def parse_fields(raw):
+    """
+    "front,back" → {"front": 1, "back": 1, "_id": 0}.
+    None se il parametro manca (documento intero); ValueError se
+    contiene campi sconosciuti.
+    """
+    if not raw:
+        return None
+    fields = {f.strip() for f in raw.split(",") if f.strip()}
+    if not fields or not fields <= CARD_FIELDS:
+        raise ValueError(raw)
+    projection = {f: 1 for f in fields}
+    if "_id" not in fields:
+        projection["_id"] = 0
+    return projection
+
 
 # ── GET /flashcards/<folder_id> — lista flashcard ───────────
 @flashcards_bp.route("/<folder_id>", methods=["GET"])
@@ -25,16 +63,85 @@ def get_flashcards(folder_id):
         folder_oid = ObjectId(folder_id)
     except (InvalidId, TypeError):
         return jsonify({"error": "folder_id non valido"}), 400
+    try:
+        projection = parse_fields(request.args.get("fields"))
+    except ValueError:
+        return jsonify({"error": "fields non valido"}), 400
 
-    folder = db.folders.find_one({"_id": folder_oid})
-    if not folder:
+    members = folder_members(folder_oid, user_id)
+    if members is None:
         return jsonify({"error": "cartella non trovata"}), 404
 
-    if not get_member_role(folder, user_id):
+    if not member_role(members, user_id):
         return jsonify({"error": "accesso negato"}), 403
 
-    cards = list(db.flashcards.find({"folderId": folder_oid}))
-    return jsonify(serialize_doc(cards))
+    folder = db.folders.find_one({"_id": folder_oid}, {"version": 1})
+    if not folder:
+        return jsonify({"error": "cartella non trovata"}), 404
+    etag = make_etag(folder_oid, folder.get("version", 0), request.query_string.decode())
+    if is_fresh(etag):
+        return not_modified(etag)
+
+    query = {"folderId": folder_oid}
+    after = request.args.get("after")
+    limit = request.args.get("limit")
+    if after:
+        if not ObjectId.is_valid(after):
+            return jsonify({"error": "after non valido"}), 400
+        query["_id"] = {"$gt": ObjectId(after)}
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            return jsonify({"error": "limit non valido"}), 400
+        if not 1 <= limit <= PAGE_MAX_LIMIT:
+            return jsonify({"error": f"limit deve essere tra 1 e {PAGE_MAX_LIMIT}"}), 400
+        if projection and projection.get("_id") == 0:
+            del projection["_id"]   # serve per il cursore della pagina successiva
+
+    cursor = db.flashcards.find(query, projection)
+    if after or limit:
+        # Paginazione keyset su _id (indice folderId_id)
+        cursor = cursor.sort("_id", 1)
+    if limit:
+        cursor = cursor.limit(limit)
+
+    stream = request.args.get("stream")
+    if stream in ("ndjson", "json"):
+        return with_etag(stream_cards(cursor.batch_size(STREAM_BATCH_SIZE), stream), etag)
+    if stream:
+        return jsonify({"error": "stream deve essere ndjson o json"}), 400
+
+    cards = list(cursor)
+    if limit:
+        next_after = cards[-1]["_id"] if len(cards) == limit else None
+        return with_etag(jsonify({"cards": cards, "next_after": next_after}), etag)
+    return with_etag(jsonify(cards), etag)
+
+
+# ── Helper: risposta in streaming dal cursore ───────────────
+def stream_cards(cursor, fmt):
+    """
+    Scrive le card man mano che arrivano dal cursore: una per riga
+    (ndjson) oppure come array JSON a blocchi (json). La memoria usata
+    non dipende dalla dimensione della cartella.
+    """
+    dumps = current_app.json.dumps
+
+    def generate():
+        if fmt == "ndjson":
+            for card in cursor:
+                yield dumps(card) + "\n"
+            return
+        yield "["
+        first = True
+        for card in cursor:
+            yield dumps(card) if first else "," + dumps(card)
+            first = False
+        yield "]"
+
+    mimetype = "application/x-ndjson" if fmt == "ndjson" else "application/json"
+    return Response(stream_with_context(generate()), mimetype=mimetype)
 
 
 # ── PUT /flashcards/<card_id> — modifica flashcard ──────────
@@ -53,8 +160,7 @@ def update_flashcard(card_id):
     if not card:
         return jsonify({"error": "flashcard non trovata"}), 404
 
-    folder = db.folders.find_one({"_id": card["folderId"]})
-    if not folder or not get_member_role(folder, user_id):
+    if not member_role(folder_members(card["folderId"], user_id), user_id):
         return jsonify({"error": "accesso negato"}), 403
 
     data  = request.get_json() or {}
@@ -67,8 +173,9 @@ def update_flashcard(card_id):
         {"_id": card_oid},
         {"$set": {"front": front, "back": back, "updatedAt": datetime.now()}}
     )
-    card.update({"front": front, "back": back})
-    return jsonify(serialize_doc(card))
+    edited = {**card, "front": front, "back": back}
+    cards_written(card["folderId"], edited=[(card, edited)])
+    return jsonify(edited)
 
 
 # ── DELETE /flashcards/<card_id> — elimina flashcard ────────
@@ -83,13 +190,162 @@ def delete_flashcard(card_id):
     except (InvalidId, TypeError):
         return jsonify({"error": "card_id non valido"}), 400
 
-    card = db.flashcards.find_one({"_id": card_oid})
+    card = db.flashcards.find_one({"_id": card_oid}, {"folderId": 1, "front": 1, "back": 1})
     if not card:
         return jsonify({"error": "flashcard non trovata"}), 404
 
-    folder = db.folders.find_one({"_id": card["folderId"]})
-    if not folder or not get_member_role(folder, user_id):
+    if not member_role(folder_members(card["folderId"], user_id), user_id):
         return jsonify({"error": "accesso negato"}), 403
 
-    db.flashcards.delete_one({"_id": card_oid})
-    return jsonify({"status": "ok"})
\ No newline at end of file
+    # Se un'altra richiesta l'ha già eliminata, contatori e indici sono già aggiornati
+    if db.flashcards.delete_one({"_id": card_oid}).deleted_count:
+        cards_written(card["folderId"], deleted=[card])
+    return jsonify({"status": "ok"})
+
+
+# ── POST /flashcards/<folder_id>/batch — modifiche multiple ─
+# { "operations": [
+#     {"op": "create", "front": "...", "back": "..."},
+#     {"op": "update", "id": "...", "front": "...", "back": "..."},   # anche uno solo dei due
+#     {"op": "delete", "id": "..."} ] }
+# Membership verificata una volta, scritture in un solo bulk_write non
+# ordinato. results[i] riporta l'esito di operations[i].
+@flashcards_bp.route("/<folder_id>/batch", methods=["POST"])
+@cross_origin(origin="http://localhost:5173")
+def batch_flashcards(folder_id):
+    user_id = get_current_user(request)
+    if not user_id:
+        return jsonify({"error": "non autorizzato"}), 401
+    folder_oid, error = member_folder(folder_id, user_id)
+    if error:
+        return error
+
+    operations = (request.get_json(silent=True) or {}).get("operations")
+    if not isinstance(operations, list) or not operations:
+        return jsonify({"error": "operations deve essere una lista non vuota"}), 400
+    if len(operations) > BATCH_MAX_OPS:
+        return jsonify({"error": f"massimo {BATCH_MAX_OPS} operazioni"}), 400
+
+    results = [None] * len(operations)
+    pending = []   # (indice operazione, campi front/back, write op)
+    targets = {}   # card_oid → indice della prima operazione che la usa
+    now     = datetime.now()
+
+    for i, op in enumerate(operations):
+        try:
+            kind, card_oid, fields, write = parse_operation(op, folder_oid, now)
+        except ValueError as e:
+            results[i] = {"status": "error", "error": str(e)}
+            continue
+        if kind == "create":
+            results[i] = {"status": "created", "id": card_oid}
+        else:
+            if card_oid in targets:
+                results[i] = {"status": "error", "error": "card già presente in un'altra operazione"}
+                continue
+            targets[card_oid] = i
+            results[i] = {"status": "updated" if kind == "update" else "deleted", "id": card_oid}
+        pending.append((i, fields, write))
+
+    # Una sola query per le card inesistenti o di un'altra cartella
+    if targets:
+        found = {c["_id"]: c for c in db.flashcards.find(
+            {"_id": {"$in": list(targets)}, "folderId": folder_oid}, {"front": 1, "back": 1}
+        )}
+        for card_oid, i in targets.items():
+            if card_oid not in found:
+                results[i] = {"status": "not_found", "id": card_oid}
+        pending = [p for p in pending if results[p[0]]["status"] != "not_found"]
+
+    if pending:
+        try:
+            res = db.flashcards.bulk_write([w for _, _, w in pending], ordered=False)
+            matched, removed = res.matched_count, res.deleted_count
+        except BulkWriteError as e:
+            for err in e.details.get("writeErrors", []):
+                i = pending[err["index"]][0]
+                results[i] = {"status": "error", "id": results[i].get("id"), "error": err.get("errmsg")}
+            matched, removed = e.details.get("nMatched", 0), e.details.get("nRemoved", 0)
+        lost_since_find(folder_oid, results, pending, matched, removed)
+
+    added, edited, deleted = [], [], []
+    for i, fields, _ in pending:
+        status, card_oid = results[i]["status"], results[i].get("id")
+        if status == "created":
+            added.append({"_id": card_oid, **fields})
+        elif status == "updated":
+            edited.append((found[card_oid], {**found[card_oid], **fields}))
+        elif status == "deleted":
+            deleted.append(found[card_oid])
+    if added or edited or deleted:
+        if cards_written(folder_oid, added=added, edited=edited, deleted=deleted) is None:
+            return jsonify({"error": "cartella non trovata"}), 404
+
+    summary = {}
+    for i, r in enumerate(results):
+        r["index"] = i
+        summary[r["status"]] = summary.get(r["status"], 0) + 1
+    return jsonify({"results": results, "summary": summary})
+
+
+def lost_since_find(folder_oid, results, pending, matched, removed):
+    """
+    Segna not_found le update e delete le cui card sono state eliminate da
+    un'altra richiesta dopo la find di /batch, confrontando i conteggi del
+    bulk_write con le operazioni inviate: quelle card non vanno contate.
+    """
+    ops = [(i, results[i]) for i, _, _ in pending]
+    updates = [(i, r) for i, r in ops if r["status"] == "updated"]
+    deletes = [(i, r) for i, r in ops if r["status"] == "deleted"]
+    if matched < len(updates):
+        existing = {c["_id"] for c in db.flashcards.find(
+            {"_id": {"$in": [r["id"] for _, r in updates]}, "folderId": folder_oid}, {"_id": 1}
+        )}
+        for i, r in updates:
+            if r["id"] not in existing:
+                results[i] = {"status": "not_found", "id": r["id"]}
+    if removed < len(deletes):
+        # bulk_write non dice quali delete non hanno trovato la card: se ne
+        # segnano not_found quante ne mancano, così i contatori restano esatti
+        for i, r in deletes[removed:]:
+            results[i] = {"status": "not_found", "id": r["id"]}
+
+
+def parse_operation(op, folder_oid, now):
+    """
+    Valida un'operazione di /batch → (tipo, _id della card, campi
+    front/back scritti, write op di pymongo).
+    """
+    if not isinstance(op, dict):
+        raise ValueError("operazione non valida")
+    kind  = op.get("op")
+    front = op.get("front")
+    back  = op.get("back")
+    for value in (front, back):
+        if value is not None and not isinstance(value, str):
+            raise ValueError("front e back devono essere stringhe")
+    front = (front or "").strip()
+    back  = (back or "").strip()
+
+    if kind == "create":
+        if not front or not back:
+            raise ValueError("front e back obbligatori")
+        card_oid = ObjectId()
+        return kind, card_oid, {"front": front, "back": back}, InsertOne({
+            "_id": card_oid, "folderId": folder_oid,
+            "front": front, "back": back, "createdAt": now,
+        })
+
+    if kind not in ("update", "delete"):
+        raise ValueError("op deve essere create, update o delete")
+    if not ObjectId.is_valid(op.get("id")):
+        raise ValueError("id non valido")
+    card_oid    = ObjectId(op["id"])
+    card_filter = {"_id": card_oid, "folderId": folder_oid}
+
+    if kind == "delete":
+        return kind, card_oid, {}, DeleteOne(card_filter)
+    changes = {k: v for k, v in (("front", front), ("back", back)) if v}
+    if not changes:
+        raise ValueError("serve front o back")
+    return kind, card_oid, changes, UpdateOne(card_filter, {"$set": {**changes, "updatedAt": now}})
@@ -1,36 +1,31 @@
 # ============================================================
 # routes/folders.py — Versione completa con collaborazione
 # ============================================================
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, g, Response, stream_with_context
 from bson import ObjectId
 from bson.errors import InvalidId
 from flask_cors import cross_origin
 from datetime import datetime
 
 from db import db
-from models.folder import create_folder
+from models.folder import create_folder, insert_folder
 from routes.auth import get_current_user
+from services.membership import folder_members, member_role
+from services.folder_events import cards_written, members_changed, folder_deleted
+from services.card_io import FORMATS, guess_format, import_cards, export_rows
+from http_cache import make_etag, is_fresh, not_modified, with_etag
 
 folders_bp = Blueprint("folders", __name__, url_prefix="/folders")
 
-
-# ── Helper: serializza ObjectId ricorsivamente ───────────────
-def serialize_doc(doc):
-    if isinstance(doc, list):
-        return [serialize_doc(d) for d in doc]
-    elif isinstance(doc, dict):
-        return {
-            k: (str(v) if isinstance(v, ObjectId) else serialize_doc(v))
-            for k, v in doc.items()
-        }
-    return doc
+EXPORT_BATCH_SIZE = 500
 
 
 # ── Helper: verifica membership ─────────────────────────────
 def get_member_role(folder, user_id_str):
     """
     Restituisce il ruolo dell'utente nella cartella ("owner", "member")
-    oppure None se non è membro.
+    oppure None se non è membro. Da usare quando il documento della
+    cartella è già caricato; altrimenti services.membership.folder_members.
     """
     for m in folder.get("members", []):
         if str(m["userId"]) == user_id_str:
@@ -46,8 +41,14 @@ def get_folders():
     if not user_id:
         return jsonify({"error": "non autorizzato"}), 401
     try:
-        folders = list(db.folders.find({"members.userId": ObjectId(user_id)}))
-        return jsonify(serialize_doc(folders))
+        query = {"members.userId": g.user_oid}
+        # ETag dalle sole versioni: se nulla è cambiato niente documenti completi
+        versions = db.folders.find(query, {"version": 1}).sort("_id", 1)
+        etag = make_etag(user_id, *(f"{f['_id']}:{f.get('version', 0)}" for f in versions))
+        if is_fresh(etag):
+            return not_modified(etag)
+        folders = list(db.folders.find(query))
+        return with_etag(jsonify(folders), etag)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -65,10 +66,10 @@ def create_new_folder():
         return jsonify({"error": "nome cartella mancante"}), 400
 
     try:
-        folder = create_folder(data["name"].strip(), ObjectId(user_id))
-        res = db.folders.insert_one(folder)
+        folder = create_folder(data["name"].strip(), g.user_oid)
+        res = insert_folder(folder)
         folder["_id"] = res.inserted_id
-        return jsonify(serialize_doc(folder)), 201
+        return jsonify(folder), 201
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -92,7 +93,10 @@ def get_folder(folder_id):
     if not get_member_role(folder, user_id):
         return jsonify({"error": "accesso negato"}), 403
 
-    return jsonify(serialize_doc(folder))
+    etag = make_etag(folder["_id"], folder.get("version", 0))
+    if is_fresh(etag):
+        return not_modified(etag)
+    return with_etag(jsonify(folder), etag)
 
 
 # ── POST /folders/join — unirsi con joinCode ────────────────
@@ -114,15 +118,16 @@ def join_folder():
 
     # Se è già membro non fa nulla, restituisce la cartella
     if get_member_role(folder, user_id):
-        return jsonify({"message": "già membro", "folder": serialize_doc(folder)})
+        return jsonify({"message": "già membro", "folder": folder})
 
     # Aggiunge come membro con ruolo "member"
     db.folders.update_one(
         {"_id": folder["_id"]},
-        {"$push": {"members": {"userId": ObjectId(user_id), "role": "member"}}}
+        {"$push": {"members": {"userId": g.user_oid, "role": "member"}}}
     )
-    folder["members"].append({"userId": ObjectId(user_id), "role": "member"})
-    return jsonify({"message": "unito con successo", "folder": serialize_doc(folder)}), 200
+    members_changed(folder["_id"])
+    folder["members"].append({"userId": g.user_oid, "role": "member"})
+    return jsonify({"message": "unito con successo", "folder": folder}), 200
 
 
 # ── DELETE /folders/<id> — elimina cartella (solo owner) ────
@@ -144,8 +149,11 @@ def delete_folder(folder_id):
     if get_member_role(folder, user_id) != "owner":
         return jsonify({"error": "solo il proprietario può eliminare"}), 403
 
-    db.flashcards.delete_many({"folderId": folder_oid})
+    # Prima la cartella: una card inserita dopo trova la cartella mancante
+    # in cards_written e viene eliminata, una inserita prima va via qui sotto
     db.folders.delete_one({"_id": folder_oid})
+    db.flashcards.delete_many({"folderId": folder_oid})
+    folder_deleted(folder_oid)
     return jsonify({"status": "ok"})
 
 
@@ -170,12 +178,12 @@ def add_flashcard():
     except (InvalidId, TypeError):
         return jsonify({"error": "folder_id non valido"}), 400
 
-    folder = db.folders.find_one({"_id": folder_oid})
-    if not folder:
+    members = folder_members(folder_oid, user_id)
+    if members is None:
         return jsonify({"error": "cartella non trovata"}), 404
 
     # Qualsiasi membro può aggiungere flashcard
-    if not get_member_role(folder, user_id):
+    if not member_role(members, user_id):
         return jsonify({"error": "accesso negato"}), 403
 
     card = {
@@ -186,4 +194,70 @@ def add_flashcard():
     }
     res = db.flashcards.insert_one(card)
     card["_id"] = res.inserted_id
-    return jsonify(serialize_doc(card)), 201
\ No newline at end of file
+    if cards_written(folder_oid, added=[card]) is None:
+        return jsonify({"error": "cartella non trovata"}), 404
+    return jsonify(card), 201
+
+
+# ── Helper: cartella di cui l'utente è membro ───────────────
+def member_folder(folder_id, user_id):
+    """(folder_oid, None) se l'utente è membro, altrimenti (None, risposta di errore)."""
+    try:
+        folder_oid = ObjectId(folder_id)
+    except (InvalidId, TypeError):
+        return None, (jsonify({"error": "folder_id non valido"}), 400)
+    members = folder_members(folder_oid, user_id)
+    if members is None:
+        return None, (jsonify({"error": "cartella non trovata"}), 404)
+    if not member_role(members, user_id):
+        return None, (jsonify({"error": "accesso negato"}), 403)
+    return folder_oid, None
+
+
+# ── POST /folders/<id>/import — import CSV / TSV / JSONL ────
+# File come multipart (campo "file") oppure come corpo della richiesta;
+# formato da ?format= o dall'estensione del file.
+@folders_bp.route("/<folder_id>/import", methods=["POST"])
+@cross_origin(origin="http://localhost:5173")
+def import_flashcards(folder_id):
+    user_id = get_current_user(request)
+    if not user_id:
+        return jsonify({"error": "non autorizzato"}), 401
+    folder_oid, error = member_folder(folder_id, user_id)
+    if error:
+        return error
+
+    upload = request.files.get("file")
+    fmt = request.args.get("format") or guess_format(upload.filename if upload else None)
+    if fmt not in FORMATS:
+        return jsonify({"error": f"format deve essere uno tra {', '.join(FORMATS)}"}), 400
+
+    stream = upload.stream if upload else request.stream
+    report = import_cards(stream, fmt, folder_oid)
+    if report is None:
+        return jsonify({"error": "cartella non trovata"}), 404
+    return jsonify(report), 201 if report["inserted"] else 200
+
+
+# ── GET /folders/<id>/export — export in streaming ──────────
+@folders_bp.route("/<folder_id>/export", methods=["GET"])
+@cross_origin(origin="http://localhost:5173")
+def export_flashcards(folder_id):
+    user_id = get_current_user(request)
+    if not user_id:
+        return jsonify({"error": "non autorizzato"}), 401
+    folder_oid, error = member_folder(folder_id, user_id)
+    if error:
+        return error
+
+    fmt = request.args.get("format", "csv")
+    if fmt not in FORMATS:
+        return jsonify({"error": f"format deve essere uno tra {', '.join(FORMATS)}"}), 400
+
+    cursor = db.flashcards.find(
+        {"folderId": folder_oid}, {"_id": 0, "front": 1, "back": 1}
+    ).sort("_id", 1).batch_size(EXPORT_BATCH_SIZE)
+    response = Response(stream_with_context(export_rows(cursor, fmt)),
+                        mimetype=FORMATS[fmt])
+    response.headers["Content-Disposition"] = f'attachment; filename="flashcards-{folder_id}.{fmt}"'
+    return response
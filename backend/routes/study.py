@@ -1,10 +1,34 @@
-from flask import Blueprint, jsonify, request
+from datetime import datetime
+from flask import Blueprint, jsonify, request, g
 from flask_cors import cross_origin
+from bson import ObjectId
 from routes.auth import get_current_user
-from services.scheduler import pick_flashcard, mark_fail, mark_success
+from services.scheduler import pick_flashcard, pick_flashcards, mark_fail, mark_success
+from services.study_session import pick_from_session, record_result as update_session
+from services.result_buffer import WRITE_BEHIND, submit_results
 
 study_bp = Blueprint("study", __name__, url_prefix="/study")
 
+QUEUE_MAX_COUNT   = 20
+RESULTS_MAX_BATCH = 500
+
+
+def parse_answered_at(value, now):
+    """
+    answeredAt del client: ISO 8601 o millisecondi epoch.
+    Restituisce un datetime locale naive (come datetime.now()), mai nel futuro.
+    """
+    try:
+        if isinstance(value, (int, float)):
+            dt = datetime.fromtimestamp(value / 1000)
+        else:
+            dt = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+            if dt.tzinfo is not None:
+                dt = dt.astimezone().replace(tzinfo=None)
+    except (TypeError, ValueError, OverflowError, OSError):
+        return now
+    return min(dt, now)
+
 
 @study_bp.route("/next", methods=["POST"])
 @cross_origin(origin="http://localhost:5173")
@@ -21,17 +45,52 @@ def next_card():
     if not folder_id:
         return jsonify({"error": "folder_id mancante"}), 400
 
-    card = pick_flashcard(user_id, folder_id, recent_ids=recent, learned_ids=learned)
+    # Il pool della cartella resta in cache per tutta la sessione;
+    # le cartelle molto grandi usano la coda nextDue indicizzata
+    cards = pick_from_session(g.user_oid, folder_id, 1, recent_ids=recent, learned_ids=learned)
+    if cards is not None:
+        card = cards[0] if cards else None
+    else:
+        card = pick_flashcard(g.user_oid, folder_id, recent_ids=recent, learned_ids=learned)
 
     if card is None:
         # Tutte le card sono state imparate
         return jsonify({"finished": True}), 200
 
-    card["_id"]      = str(card["_id"])
-    card["folderId"] = str(card["folderId"])
     return jsonify(card)
 
 
+@study_bp.route("/queue", methods=["POST"])
+@cross_origin(origin="http://localhost:5173")
+def card_queue():
+    """
+    Come /study/next ma restituisce le prossime `count` card in ordine,
+    così il client può tenere una coda locale e ricaricarla in background.
+    Body: { "folder_id", "count", "recent_ids", "learned_ids" }
+    """
+    user_id = get_current_user(request)
+    if not user_id:
+        return jsonify({"error": "non autorizzato"}), 401
+
+    data      = request.get_json() or {}
+    folder_id = data.get("folder_id")
+    recent    = data.get("recent_ids", [])
+    learned   = data.get("learned_ids", [])
+    try:
+        count = max(1, min(int(data.get("count", 10)), QUEUE_MAX_COUNT))
+    except (TypeError, ValueError):
+        return jsonify({"error": "count non valido"}), 400
+
+    if not folder_id:
+        return jsonify({"error": "folder_id mancante"}), 400
+
+    cards = pick_from_session(g.user_oid, folder_id, count, recent_ids=recent, learned_ids=learned)
+    if cards is None:
+        cards = pick_flashcards(g.user_oid, folder_id, count, recent_ids=recent, learned_ids=learned)
+
+    return jsonify({"cards": cards, "finished": not cards})
+
+
 @study_bp.route("/result", methods=["POST"])
 @cross_origin(origin="http://localhost:5173")
 def record_result():
@@ -43,12 +102,52 @@ def record_result():
     card_id = data.get("flashcard_id")
     result  = data.get("result")
 
-    if not card_id or result not in ("success", "fail"):
+    if not card_id or not ObjectId.is_valid(str(card_id)) or result not in ("success", "fail"):
         return jsonify({"error": "parametri mancanti o non validi"}), 400
 
-    if result == "success":
-        mark_success(user_id, card_id)
+    folder_id = update_session(g.user_oid, card_id, result)
+    if WRITE_BEHIND:
+        submit_results([(g.user_oid, card_id, result, datetime.now(), folder_id)])
+    elif result == "success":
+        mark_success(g.user_oid, card_id, folder_id)
     else:
-        mark_fail(user_id, card_id)
+        mark_fail(g.user_oid, card_id, folder_id)
+
+    return jsonify({"status": "ok"})
+
+
+@study_bp.route("/results", methods=["POST"])
+@cross_origin(origin="http://localhost:5173")
+def record_results_batch():
+    """
+    Body: [ { "flashcard_id", "result", "answeredAt" }, ... ]
+      oppure { "results": [ ... ] }
+    Tutti i risultati vengono scritti con un solo bulk_write.
+    """
+    user_id = get_current_user(request)
+    if not user_id:
+        return jsonify({"error": "non autorizzato"}), 401
+
+    data    = request.get_json()
+    results = data.get("results") if isinstance(data, dict) else data
+    if not isinstance(results, list) or not results:
+        return jsonify({"error": "results mancante"}), 400
+    if len(results) > RESULTS_MAX_BATCH:
+        return jsonify({"error": f"massimo {RESULTS_MAX_BATCH} risultati per richiesta"}), 400
+
+    now     = datetime.now()
+    entries = []
+    for i, item in enumerate(results):
+        card_id = item.get("flashcard_id") if isinstance(item, dict) else None
+        result  = item.get("result") if isinstance(item, dict) else None
+        if not card_id or not ObjectId.is_valid(str(card_id)) or result not in ("success", "fail"):
+            return jsonify({"error": f"risultato {i} non valido"}), 400
+        entries.append((card_id, result, parse_answered_at(item.get("answeredAt"), now)))
+
+    batch = []
+    for card_id, result, answered_at in entries:
+        folder_id = update_session(g.user_oid, card_id, result, answered_at)
+        batch.append((g.user_oid, card_id, result, answered_at, folder_id))
+    submit_results(batch)
 
-    return jsonify({"status": "ok"})
\ No newline at end of file
+    return jsonify({"status": "ok", "count": len(batch)})
\ No newline at end of file
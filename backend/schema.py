@@ -0,0 +1,155 @@
+# ============================================================
+# schema.py — Indici richiesti da tutte le collezioni
+# ============================================================
+# Applicati all'avvio da create_app (idempotente) oppure a mano:
+#   python schema.py           crea gli indici mancanti
+#   python schema.py --check   elenca gli indici mancanti (exit 1 se ce ne sono)
+#
+# register e insert_folder affidano l'unicità di email e joinCode agli
+# indici unique: finché unique_index_ready() non li trova (creazione
+# fallita, MONGO_ENSURE_INDEXES=0, DB irraggiungibile all'avvio) tornano
+# a controllare i duplicati con una find prima dell'insert.
+# ============================================================
+import sys
+import threading
+from pymongo import ASCENDING
+from pymongo.errors import PyMongoError
+
+from db import db
+
+INDEXES = [
+    # Login e registrazione: una sola utenza per email
+    {"collection": "users", "keys": [("email", ASCENDING)],
+     "name": "email_unique", "unique": True},
+
+    # Join con codice e lista cartelle dell'utente
+    {"collection": "folders", "keys": [("joinCode", ASCENDING)],
+     "name": "joinCode_unique", "unique": True},
+    {"collection": "folders", "keys": [("members.userId", ASCENDING)],
+     "name": "members_userId"},
+
+    # Card di una cartella (anche ordinate per _id)
+    {"collection": "flashcards", "keys": [("folderId", ASCENDING), ("_id", ASCENDING)],
+     "name": "folderId_id"},
+
+    # Una riga stats per (utente, card) + coda nextDue dello scheduler
+    {"collection": "flashcardStats", "keys": [("userId", ASCENDING), ("flashcardId", ASCENDING)],
+     "name": "userId_flashcardId_unique", "unique": True},
+    {"collection": "flashcardStats",
+     "keys": [("userId", ASCENDING), ("folderId", ASCENDING), ("nextDue", ASCENDING)],
+     "name": "userId_folderId_nextDue"},
+    # Pulizia delle stats dopo la cancellazione di cartelle e card (services/reaper.py)
+    {"collection": "flashcardStats", "keys": [("folderId", ASCENDING)],
+     "name": "folderId"},
+    {"collection": "flashcardStats", "keys": [("flashcardId", ASCENDING)],
+     "name": "flashcardId"},
+
+    # Card già viste per (utente, cartella), vedi models/progress.py
+    {"collection": "studyProgress", "keys": [("userId", ASCENDING), ("folderId", ASCENDING)],
+     "name": "userId_folderId_unique", "unique": True},
+
+    # Ricerca LSH dei quasi-duplicati (services/near_dupes.py)
+    {"collection": "cardSignatures", "keys": [("folderId", ASCENDING), ("bands", ASCENDING)],
+     "name": "folderId_bands"},
+
+    # Job di generazione AI: eliminati un giorno dopo la creazione
+    {"collection": "aiJobs", "keys": [("createdAt", ASCENDING)],
+     "name": "createdAt_ttl", "expireAfterSeconds": 86400},
+]
+
+
+def _existing_keys(collection):
+    return {
+        tuple((k, v) for k, v in info["key"]): info
+        for info in db[collection].index_information().values()
+    }
+
+
+def missing_indexes():
+    """Indici di INDEXES non ancora presenti nel database."""
+    missing = []
+    cache = {}
+    for spec in INDEXES:
+        coll = spec["collection"]
+        if coll not in cache:
+            cache[coll] = _existing_keys(coll)
+        info = cache[coll].get(tuple(spec["keys"]))
+        if info is None or bool(info.get("unique")) != spec.get("unique", False):
+            missing.append(spec)
+    return missing
+
+
+def ensure_indexes():
+    """
+    Crea gli indici mancanti. Non interrompe l'avvio se uno fallisce
+    (es. duplicati che impediscono un indice unique): restituisce
+    (creati, falliti) con falliti = [(spec, errore)].
+    """
+    created, failed = [], []
+    for spec in missing_indexes():
+        try:
+            db[spec["collection"]].create_index(
+                spec["keys"], name=spec["name"], unique=spec.get("unique", False),
+                **({"expireAfterSeconds": spec["expireAfterSeconds"]}
+                   if "expireAfterSeconds" in spec else {}),
+            )
+            created.append(spec)
+        except PyMongoError as e:
+            failed.append((spec, e))
+    for spec, e in failed:
+        print(f"[schema] indice {spec['collection']}.{spec['name']} non creato: {e}")
+    return created, failed
+
+
+def bootstrap_indexes():
+    """
+    ensure_indexes all'avvio del worker: un DB irraggiungibile non deve
+    impedire l'avvio (/health risponde comunque), viene solo segnalato.
+    """
+    try:
+        return ensure_indexes()
+    except PyMongoError as e:
+        print(f"[schema] indici non verificati all'avvio: {e}")
+        return [], []
+
+
+# ── Indici unique da cui dipendono le scritture ─────────────
+_unique_ready = set()   # nomi verificati in questo processo
+_unique_lock  = threading.Lock()
+
+
+def unique_index_ready(name):
+    """
+    True se l'indice unique `name` di INDEXES esiste. Il risultato
+    positivo resta in cache per il processo; finché manca viene
+    ricontrollato a ogni chiamata e segnalato.
+    """
+    if name in _unique_ready:
+        return True
+    spec = next(s for s in INDEXES if s["name"] == name)
+    try:
+        info = _existing_keys(spec["collection"]).get(tuple(spec["keys"]))
+    except PyMongoError:
+        info = None
+    if info is None or not info.get("unique"):
+        print(f"[schema] indice unique {spec['collection']}.{name} assente: "
+              "controllo dei duplicati con find (python schema.py per crearlo)")
+        return False
+    with _unique_lock:
+        _unique_ready.add(name)
+    return True
+
+
+if __name__ == "__main__":
+    if "--check" in sys.argv:
+        missing = missing_indexes()
+        for spec in missing:
+            print(f"mancante: {spec['collection']}.{spec['name']}")
+        print("Tutti gli indici presenti ✅" if not missing else f"{len(missing)} indici mancanti")
+        sys.exit(1 if missing else 0)
+
+    created, failed = ensure_indexes()
+    for spec in created:
+        print(f"creato: {spec['collection']}.{spec['name']}")
+    print(f"{len(created)} creati, {len(failed)} falliti")
+    sys.exit(1 if failed else 0)
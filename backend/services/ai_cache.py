@@ -0,0 +1,130 @@
+# ============================================================
+# services/ai_cache.py — Cache e coalescenza delle generazioni AI
+# ============================================================
+# Chiave: (versione della cartella, topic normalizzato, count, modello).
+# Il valore è il risultato GIÀ SALVATO della generazione: un hit
+# restituisce le card inserite la prima volta invece di richiamare il
+# modello e inserirne di nuove (doppio click, retry dello stesso topic).
+# Dopo l'insert il risultato viene registrato anche sotto la nuova
+# versione della cartella, che è quella letta dal retry successivo;
+# qualsiasi altra modifica alla cartella cambia versione e invalida.
+#
+# Richieste identiche contemporanee nello stesso worker condividono
+# un'unica chiamata al modello (single-flight), che arrivino come job o
+# in streaming: chi arriva dopo attende il primo e ne riusa il risultato.
+#
+# Variabili d'ambiente (opzionali):
+#   AI_CACHE_TTL    secondi di validità di un risultato
+#   AI_CACHE_SIZE   numero massimo di risultati per worker
+# ============================================================
+import os
+import re
+import time
+import threading
+import unicodedata
+from collections import OrderedDict
+
+AI_CACHE_TTL  = int(os.getenv("AI_CACHE_TTL", 600))
+AI_CACHE_SIZE = int(os.getenv("AI_CACHE_SIZE", 256))
+
+
+def normalize_topic(topic):
+    topic = unicodedata.normalize("NFKC", topic).casefold()
+    return re.sub(r"\s+", " ", topic).strip(" .?!")
+
+
+def generation_key(folder_oid, version, topic, count, model):
+    return (str(folder_oid), version, normalize_topic(topic), count, model)
+
+
+class _Flight:
+    def __init__(self):
+        self.done   = threading.Event()
+        self.result = None
+        self.error  = None
+
+    def wait(self):
+        """Risultato della richiesta che sta calcolando; ne rilancia l'errore."""
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class GenerationCache:
+    def __init__(self, maxsize=AI_CACHE_SIZE, ttl=AI_CACHE_TTL):
+        self.maxsize  = maxsize
+        self.ttl      = ttl
+        self.entries  = OrderedDict()   # chiave → (scadenza, risultato)
+        self.inflight = {}              # chiave → _Flight
+        self.lock     = threading.Lock()
+
+    def _get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry[1]
+
+    def get(self, key):
+        with self.lock:
+            return self._get(key)
+
+    def put(self, key, result):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, result)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def join(self, key):
+        """
+        Registra una richiesta per key. Restituisce (risultato, flight, leader):
+          risultato in cache              → (risultato, None, False)
+          nessuno la sta calcolando       → (None, flight, True): chi chiama
+                                            calcola e poi chiama finish()
+          un'altra richiesta la calcola   → (None, flight, False): flight.wait()
+        """
+        with self.lock:
+            result = self._get(key)
+            if result is not None:
+                return result, None, False
+            flight = self.inflight.get(key)
+            if flight is not None:
+                return None, flight, False
+            flight = self.inflight[key] = _Flight()
+            return None, flight, True
+
+    def finish(self, key, flight, result=None, error=None):
+        """Chiude il calcolo del leader: risultato in cache, oppure errore agli in attesa."""
+        if error is None:
+            self.put(key, result)
+        flight.result, flight.error = result, error
+        with self.lock:
+            del self.inflight[key]
+        flight.done.set()
+
+    def get_or_compute(self, key, compute):
+        """
+        Risultato in cache, oppure quello di compute() — eseguita una sola
+        volta anche se più thread chiedono la stessa chiave insieme. Gli
+        errori non vengono messi in cache e arrivano a tutti gli in attesa.
+        """
+        result, flight, leader = self.join(key)
+        if result is not None:
+            return result
+        if not leader:
+            return flight.wait()
+        try:
+            result = compute()
+        except Exception as e:
+            self.finish(key, flight, error=e)
+            raise
+        self.finish(key, flight, result=result)
+        return result
+
+
+cache = GenerationCache()
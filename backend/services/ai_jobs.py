@@ -0,0 +1,99 @@
+# ============================================================
+# services/ai_jobs.py — Coda dei job di generazione AI
+# ============================================================
+# La chiamata al modello dura secondi: la route crea un job e risponde
+# subito, il lavoro gira su un pool limitato del worker. Lo stato sta
+# nella collezione aiJobs, così GET /ai/jobs/<id> funziona da qualsiasi
+# worker gunicorn; i documenti scadono con un indice TTL (schema.py).
+#
+# Variabili d'ambiente (opzionali):
+#   AI_JOB_WORKERS   chiamate al modello in parallelo per worker
+#   AI_JOB_QUEUE     job in attesa oltre a quelli in esecuzione
+#   AI_JOB_TIMEOUT   secondi dopo i quali un job non concluso (es. worker
+#                    riavviato) viene riportato come fallito
+#   AI_STREAM_WORKERS  generazioni in streaming in parallelo per worker
+#
+# Anche le generazioni in streaming girano su un pool (stream_executor),
+# senza coda: il thread della richiesta inoltra gli eventi finché il
+# modello non ha finito, quindi oltre AI_STREAM_WORKERS stream si
+# risponde 503. Serve il worker gthread di gunicorn.conf.py, con
+# GUNICORN_THREADS maggiore di AI_STREAM_WORKERS.
+# ============================================================
+import os
+import traceback
+from datetime import datetime, timedelta
+from bson import ObjectId
+
+from db import db
+from services.executor import BoundedExecutor, ExecutorBusy
+
+AI_JOB_WORKERS = int(os.getenv("AI_JOB_WORKERS", 2))
+AI_JOB_QUEUE   = int(os.getenv("AI_JOB_QUEUE", 8))
+AI_JOB_TIMEOUT = int(os.getenv("AI_JOB_TIMEOUT", 300))
+AI_STREAM_WORKERS = int(os.getenv("AI_STREAM_WORKERS", 2))
+
+executor        = BoundedExecutor(AI_JOB_WORKERS, AI_JOB_QUEUE, name="ai-job")
+stream_executor = BoundedExecutor(AI_STREAM_WORKERS, 0, name="ai-stream")
+
+
+class JobFailed(Exception):
+    """Errore previsto del job: message e campi extra finiscono nello stato."""
+
+    def __init__(self, message, **extra):
+        super().__init__(message)
+        self.message = message
+        self.extra   = extra
+
+
+def _update(job_id, fields):
+    fields["updatedAt"] = datetime.now()
+    db.aiJobs.update_one({"_id": job_id}, {"$set": fields})
+
+
+def _run(job_id, fn, args):
+    _update(job_id, {"status": "running"})
+    try:
+        result = fn(*args)
+    except JobFailed as e:
+        _update(job_id, {"status": "error", "error": e.message, **e.extra})
+    except Exception:
+        traceback.print_exc()
+        _update(job_id, {"status": "error", "error": "errore interno durante la generazione"})
+    else:
+        _update(job_id, {"status": "done", "result": result})
+
+
+def submit_job(kind, user_oid, folder_oid, fn, *args):
+    """
+    Registra il job e lo accoda. Restituisce l'_id del job; ExecutorBusy
+    se la coda del worker è piena (il job non viene creato).
+    """
+    now = datetime.now()
+    job = {
+        "_id":       ObjectId(),
+        "kind":      kind,
+        "userId":    user_oid,
+        "folderId":  folder_oid,
+        "status":    "queued",
+        "createdAt": now,
+        "updatedAt": now,
+    }
+    db.aiJobs.insert_one(job)
+    try:
+        executor.submit(_run, job["_id"], fn, args)
+    except ExecutorBusy:
+        db.aiJobs.delete_one({"_id": job["_id"]})
+        raise
+    return job["_id"]
+
+
+def get_job(job_id, user_oid):
+    """Stato del job dell'utente, o None se non esiste (o è di un altro utente)."""
+    job = db.aiJobs.find_one({"_id": job_id, "userId": user_oid})
+    if job is None:
+        return None
+    stale = datetime.now() - timedelta(seconds=AI_JOB_TIMEOUT)
+    if job["status"] in ("queued", "running") and job["updatedAt"] < stale:
+        job["status"] = "error"
+        job["error"]  = "job interrotto, riprova"
+    return job
@@ -0,0 +1,156 @@
+# ============================================================
+# services/card_io.py — Import / export di flashcard in streaming
+# ============================================================
+# Formati (una card per riga):
+#   csv    front,back        intestazione "front,back" opzionale
+#   tsv    front<TAB>back    come gli export "testo semplice" di Anki;
+#                            le righe che iniziano con # sono ignorate
+#   jsonl  {"front": ..., "back": ...}
+# Il file viene letto riga per riga e inserito a blocchi: la memoria
+# usata non dipende dalla sua dimensione.
+#
+# Variabili d'ambiente (opzionali):
+#   IMPORT_BATCH_SIZE   card per insert_many
+#   IMPORT_MAX_ERRORS   errori di riga riportati nella risposta
+# ============================================================
+import io
+import os
+import csv
+import json
+from datetime import datetime
+
+from db import db
+from services.folder_events import cards_written
+
+FORMATS = {"csv": "text/csv", "tsv": "text/tab-separated-values", "jsonl": "application/x-ndjson"}
+
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", 500))
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", 100))
+
+
+class RowError(ValueError):
+    pass
+
+
+def guess_format(filename):
+    ext = (filename or "").rsplit(".", 1)[-1].lower()
+    return {"txt": "tsv", "ndjson": "jsonl"}.get(ext, ext) if ext else None
+
+
+# ── Lettura ─────────────────────────────────────────────────
+def _card(front, back):
+    front = (front or "").strip()
+    back  = (back or "").strip()
+    if not front or not back:
+        raise RowError("front o back mancanti")
+    return front, back
+
+
+def _csv_rows(text, delimiter):
+    reader = csv.reader(text, delimiter=delimiter)
+    for row in reader:
+        # reader.line_num conta le righe fisiche (anche dentro le virgolette)
+        line = reader.line_num
+        if not row or (delimiter == "\t" and row[0].startswith("#")):
+            continue
+        if line == 1 and [c.strip().lower() for c in row[:2]] == ["front", "back"]:
+            continue
+        try:
+            if len(row) < 2:
+                raise RowError("servono due colonne: front e back")
+            yield line, _card(row[0], row[1])
+        except RowError as e:
+            yield line, e
+
+
+def _jsonl_rows(text):
+    for line, raw in enumerate(text, 1):
+        if not raw.strip():
+            continue
+        try:
+            obj = json.loads(raw)
+            if not isinstance(obj, dict):
+                raise RowError("atteso un oggetto JSON")
+            front, back = obj.get("front"), obj.get("back")
+            if not isinstance(front, str) or not isinstance(back, str):
+                raise RowError("front e back devono essere stringhe")
+            yield line, _card(front, back)
+        except (RowError, ValueError) as e:
+            yield line, RowError(str(e))
+
+
+def read_rows(stream, fmt):
+    """
+    Genera (numero riga, (front, back)) oppure (numero riga, RowError)
+    leggendo lo stream binario un po' alla volta.
+    """
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", errors="replace", newline="")
+    if fmt == "jsonl":
+        return _jsonl_rows(text)
+    return _csv_rows(text, "\t" if fmt == "tsv" else ",")
+
+
+def import_cards(stream, fmt, folder_oid, batch_size=IMPORT_BATCH_SIZE):
+    """
+    Inserisce le righe valide a blocchi (ogni blocco aggiorna versione e
+    profilo di stile della cartella). Restituisce
+    {"inserted", "failed", "errors": [{"row", "error"}]} con al più
+    IMPORT_MAX_ERRORS errori dettagliati, oppure None se la cartella è
+    stata eliminata durante l'import.
+    """
+    inserted, failed, errors = 0, 0, []
+    batch = []
+
+    def flush():
+        """False se la cartella non esiste più (le card del blocco sono già rimosse)."""
+        nonlocal inserted, batch
+        if batch:
+            inserted += len(db.flashcards.insert_many(batch, ordered=False).inserted_ids)
+            if cards_written(folder_oid, added=batch) is None:
+                return False
+            batch = []
+        return True
+
+    for line, row in read_rows(stream, fmt):
+        if isinstance(row, RowError):
+            failed += 1
+            if len(errors) < IMPORT_MAX_ERRORS:
+                errors.append({"row": line, "error": str(row)})
+            continue
+        batch.append({
+            "folderId":  folder_oid,
+            "front":     row[0],
+            "back":      row[1],
+            "createdAt": datetime.now(),
+        })
+        if len(batch) >= batch_size and not flush():
+            return None
+    if not flush():
+        return None
+    return {"inserted": inserted, "failed": failed, "errors": errors}
+
+
+# ── Scrittura ───────────────────────────────────────────────
+def export_rows(cursor, fmt):
+    """Genera le righe del file, una card alla volta dal cursore."""
+    if fmt == "jsonl":
+        for card in cursor:
+            yield json.dumps({"front": card["front"], "back": card["back"]}, ensure_ascii=False) + "\n"
+        return
+
+    buf    = io.StringIO()
+    writer = csv.writer(buf, delimiter="\t" if fmt == "tsv" else ",", lineterminator="\n")
+    def take():
+        row = buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+        return row
+
+    if fmt == "tsv":
+        yield "#separator:tab\n"
+    else:
+        writer.writerow(["front", "back"])
+        yield take()
+    for card in cursor:
+        writer.writerow([card["front"], card["back"]])
+        yield take()
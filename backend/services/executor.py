@@ -0,0 +1,53 @@
+# ============================================================
+# services/executor.py — Pool di thread con coda limitata
+# ============================================================
+# Per il lavoro lento che non deve occupare i worker web (hash bcrypt,
+# chiamate al modello AI). Oltre workers + queue task in corso submit()
+# fallisce subito con ExecutorBusy: la route risponde 503 invece di
+# accodare all'infinito.
+# ============================================================
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+
+class ExecutorBusy(Exception):
+    """Coda piena o risultato non arrivato in tempo: rispondere 503."""
+
+
+class BoundedExecutor:
+    def __init__(self, workers, queue, name="pool"):
+        self.workers = workers
+        self.name    = name
+        self.slots   = threading.BoundedSemaphore(workers + queue)
+        self.pool    = None
+        self.lock    = threading.Lock()
+        self.pid     = None
+
+    def _executor(self):
+        # Creato nel worker, dopo il fork di gunicorn
+        with self.lock:
+            if self.pool is None or self.pid != os.getpid():
+                self.pool = ThreadPoolExecutor(self.workers, thread_name_prefix=self.name)
+                self.pid  = os.getpid()
+            return self.pool
+
+    def submit(self, fn, *args):
+        """Future del task, o ExecutorBusy se la coda è piena."""
+        if not self.slots.acquire(blocking=False):
+            raise ExecutorBusy()
+        try:
+            future = self._executor().submit(fn, *args)
+        except Exception:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
+
+    def run(self, fn, *args, timeout=None):
+        """Esegue fn sul pool e ne attende il risultato."""
+        future = self.submit(fn, *args)
+        try:
+            return future.result(timeout)
+        except FutureTimeout:
+            raise ExecutorBusy()
@@ -0,0 +1,59 @@
+# ============================================================
+# services/folder_events.py — Effetti di una modifica alle cartelle
+# ============================================================
+# Ogni route che inserisce, modifica o elimina card (o cambia i membri)
+# passa da qui, così versione della cartella e cache restano allineate.
+#
+# La cache dei membri di un worker può autorizzare per qualche secondo
+# una scrittura in una cartella appena eliminata da un altro: cards_written
+# aggiorna la cartella per prima e, se non esiste più, elimina le card
+# appena inserite invece di indicizzarle.
+# ============================================================
+from db import db
+from models.folder import touch_folder
+from models.progress import drop_folder_progress
+from services.study_session import invalidate_folder
+from services.membership import invalidate_members
+from services.reaper import reap_folder, reap_cards
+from services.style_profile import add_cards, edit_cards, remove_cards, drop_profile
+from services.near_dupes import index_cards, unindex_cards, drop_folder_index
+
+
+def cards_written(folder_oid, added=(), edited=(), deleted=()):
+    """
+    Dopo scritture di card con contenuto noto (_id, front, back):
+      added    card inserite
+      edited   coppie (card prima, card dopo)
+      deleted  card eliminate: le loro stats vengono rimosse in background
+    Aggiorna profilo di stile e indice dei quasi-duplicati e restituisce
+    la nuova versione, o None se la cartella non esiste più.
+    """
+    version = touch_folder(folder_oid, len(added) - len(deleted))
+    if version is None:
+        if added:
+            db.flashcards.delete_many({"_id": {"$in": [c["_id"] for c in added]}})
+        return None
+    add_cards(folder_oid, added)
+    edit_cards(folder_oid, edited)
+    remove_cards(folder_oid, deleted)
+    index_cards(folder_oid, list(added) + [new for old, new in edited if old["front"] != new["front"]])
+    if deleted:
+        unindex_cards([c["_id"] for c in deleted])
+        reap_cards([c["_id"] for c in deleted])
+    invalidate_folder(folder_oid)
+    return version
+
+
+def members_changed(folder_oid):
+    """Dopo un join (o un'altra modifica ai membri)."""
+    touch_folder(folder_oid)
+    invalidate_members(folder_oid)
+
+
+def folder_deleted(folder_oid):
+    invalidate_folder(folder_oid)
+    invalidate_members(folder_oid)
+    reap_folder(folder_oid)
+    drop_folder_progress(folder_oid)
+    drop_profile(folder_oid)
+    drop_folder_index(folder_oid)
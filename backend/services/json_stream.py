@@ -0,0 +1,58 @@
+# ============================================================
+# services/json_stream.py — Parser incrementale di un array JSON
+# ============================================================
+# Il modello produce "[ {...}, {...} ]" un token alla volta. feed()
+# riceve i pezzi di testo man mano e restituisce gli oggetti del primo
+# array appena la loro parentesi graffa si chiude, senza attendere la
+# fine della risposta. Il testo prima dell'array (es. ```json) e dopo
+# la sua chiusura viene ignorato.
+# ============================================================
+import json
+
+
+class ArrayStreamParser:
+    def __init__(self):
+        self.depth     = 0       # 0 = fuori dall'array, 1 = dentro l'array
+        self.in_string = False
+        self.escape    = False
+        self.buffer    = []      # caratteri dell'elemento corrente
+        self.done      = False   # array chiuso
+
+    def feed(self, text):
+        """Elementi completati da questo pezzo di testo (JSON non valido → ValueError)."""
+        items = []
+        for ch in text:
+            if self.done:
+                break
+            if self.depth == 0:
+                if ch == "[":
+                    self.depth = 1
+                continue
+
+            if self.depth > 1:
+                self.buffer.append(ch)
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+                continue
+
+            if ch == '"':
+                if self.depth == 1:
+                    raise ValueError("atteso un oggetto nell'array")
+                self.in_string = True
+            elif ch in "{[":
+                if self.depth == 1:
+                    self.buffer = [ch]
+                self.depth += 1
+            elif ch in "}]":
+                self.depth -= 1
+                if self.depth == 1:
+                    items.append(json.loads("".join(self.buffer)))
+                    self.buffer = []
+                elif self.depth == 0:
+                    self.done = True
+        return items
@@ -0,0 +1,126 @@
+# ============================================================
+# services/llm.py — Client del modello linguistico (intercambiabile)
+# ============================================================
+# LLM_CLIENT sceglie l'implementazione:
+#   groq               (default) Groq + Llama 3, richiede GROQ_API_KEY
+#   stub               modello locale finto, per test e load test offline
+#   modulo:attributo   factory personalizzata, es. "mytests.llm:FakeClient"
+#
+# Un client espone:
+#   model                        nome del modello (entra nelle chiavi di cache)
+#   complete(messages, **opts)   testo completo della risposta
+#   stream(messages, **opts)     pezzi di testo man mano che arrivano
+# ============================================================
+import os
+import re
+import json
+import time
+import hashlib
+import importlib
+import threading
+from collections import Counter
+
+GROQ_MODEL = "llama-3.3-70b-versatile"  # oppure "llama3-70b-8192" per qualità maggiore
+
+
+class GroqClient:
+    def __init__(self, model=GROQ_MODEL):
+        from groq import Groq
+        # Legge GROQ_API_KEY dall'ambiente
+        self.client = Groq(api_key=os.environ.get("GROQ_API_KEY"))
+        self.model  = model
+
+    def complete(self, messages, temperature=0.7, max_tokens=1500):
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+        )
+        return response.choices[0].message.content
+
+    def stream(self, messages, temperature=0.7, max_tokens=1500):
+        chunks = self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True,
+        )
+        for chunk in chunks:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                yield delta
+
+
+class StubClient:
+    """
+    Risponde senza rete con n card nuove sul topic richiesto nel prompt, dopo
+    LLM_STUB_DELAY secondi (latenza simulata). Deterministico: la k-esima
+    chiamata con lo stesso topic restituisce sempre le stesse card.
+    """
+    model = "stub"
+
+    def __init__(self, delay=None):
+        self.delay = float(os.getenv("LLM_STUB_DELAY", 0.5) if delay is None else delay)
+        self.calls = Counter()   # chiamate per topic
+        self.lock  = threading.Lock()
+
+    def _cards(self, messages):
+        prompt = messages[-1]["content"]
+        match  = re.search(r'Genera esattamente (\d+) flashcard sull\'argomento: "(.*)"', prompt)
+        n, topic = (int(match.group(1)), match.group(2)) if match else (5, "argomento")
+        with self.lock:
+            self.calls[topic] += 1
+            call = self.calls[topic]
+        # Codice da (topic, chiamata, indice) nel front: card diverse tra loro
+        # e tra una chiamata e l'altra, così il filtro dei quasi-duplicati
+        # non le scarta
+        cards = []
+        for i in range(n):
+            code = hashlib.sha1(f"{topic}:{call}:{i}".encode()).hexdigest()[:12]
+            cards.append({"front": f"{topic}: concetto {code}?", "back": f"Risposta {i + 1} su {topic}."})
+        return cards
+
+    def complete(self, messages, **opts):
+        time.sleep(self.delay)
+        return json.dumps(self._cards(messages), ensure_ascii=False)
+
+    def stream(self, messages, **opts):
+        # La latenza è distribuita sulle card, a pezzi di 8 caratteri
+        cards = self._cards(messages)
+        yield "["
+        for i, card in enumerate(cards):
+            text = ("," if i else "") + json.dumps(card, ensure_ascii=False)
+            time.sleep(self.delay / len(cards))
+            for j in range(0, len(text), 8):
+                yield text[j:j + 8]
+        yield "]"
+
+
+def _load(name):
+    if name == "groq":
+        return GroqClient()
+    if name == "stub":
+        return StubClient()
+    module, _, attr = name.partition(":")
+    return getattr(importlib.import_module(module), attr)()
+
+
+_client = None
+_lock   = threading.Lock()
+
+
+def get_llm():
+    global _client
+    with _lock:
+        if _client is None:
+            _client = _load(os.getenv("LLM_CLIENT", "groq"))
+        return _client
+
+
+def set_llm(client):
+    """Sostituisce il client (test)."""
+    global _client
+    with _lock:
+        _client = client
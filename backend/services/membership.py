@@ -0,0 +1,82 @@
+# ============================================================
+# services/membership.py — Cache dei membri delle cartelle
+# ============================================================
+# folderId → {userId: role}, per worker, con TTL e rimozione LRU.
+# Un utente presente nella mappa è autorizzato senza query; se manca
+# la mappa viene riletta dal DB prima di negare l'accesso, così un
+# join fatto su un altro worker è visibile subito.
+#
+# Variabili d'ambiente (opzionali):
+#   MEMBERSHIP_CACHE_TTL   secondi di validità di una voce
+#   MEMBERSHIP_CACHE_SIZE  numero massimo di cartelle in cache
+# ============================================================
+import os
+import time
+import threading
+from collections import OrderedDict
+
+from db import db
+
+MEMBERSHIP_TTL        = int(os.getenv("MEMBERSHIP_CACHE_TTL", 60))
+MEMBERSHIP_CACHE_SIZE = int(os.getenv("MEMBERSHIP_CACHE_SIZE", 2048))
+
+
+class MembershipCache:
+    def __init__(self, maxsize=MEMBERSHIP_CACHE_SIZE, ttl=MEMBERSHIP_TTL):
+        self.maxsize = maxsize
+        self.ttl     = ttl
+        self.entries = OrderedDict()   # folderId str → (scadenza, {userId: role})
+        self.lock    = threading.Lock()
+
+    def get(self, folder_id):
+        with self.lock:
+            entry = self.entries.get(folder_id)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self.entries[folder_id]
+                return None
+            self.entries.move_to_end(folder_id)
+            return entry[1]
+
+    def put(self, folder_id, members):
+        with self.lock:
+            self.entries[folder_id] = (time.monotonic() + self.ttl, members)
+            self.entries.move_to_end(folder_id)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, folder_id):
+        with self.lock:
+            self.entries.pop(folder_id, None)
+
+
+cache = MembershipCache()
+
+
+def _load(folder_oid):
+    folder = db.folders.find_one({"_id": folder_oid}, {"members": 1})
+    if not folder:
+        return None
+    members = {str(m["userId"]): m["role"] for m in folder.get("members", [])}
+    cache.put(str(folder_oid), members)
+    return members
+
+
+def folder_members(folder_oid, user_id=None):
+    """
+    Mappa {userId: role} della cartella, o None se la cartella non esiste.
+    Se user_id non compare nella mappa in cache, la rilegge dal DB.
+    """
+    members = cache.get(str(folder_oid))
+    if members is None or (user_id is not None and str(user_id) not in members):
+        members = _load(folder_oid)
+    return members
+
+
+def member_role(members, user_id):
+    return members.get(str(user_id)) if members else None
+
+
+def invalidate_members(folder_oid):
+    cache.invalidate(str(folder_oid))
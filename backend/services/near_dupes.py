@@ -0,0 +1,199 @@
+# ============================================================
+# services/near_dupes.py — Indice MinHash/LSH dei front per cartella
+# ============================================================
+# Ogni card ha in cardSignatures la firma MinHash del front (trigrammi
+# di caratteri) e le chiavi LSH delle sue bande. Per una card generata
+# si cercano solo le card che condividono almeno una banda (indice
+# folderId_bands) e su quelle si stima la similarità di Jaccard: il
+# costo non cresce con la dimensione del mazzo.
+#
+# Con NUM_PERM=64 e 16 bande da 4 righe, due front con similarità 0.7
+# condividono una banda con probabilità ~0.99, con 0.3 ~0.12.
+#
+# Variabili d'ambiente (opzionali):
+#   AI_DUP_THRESHOLD   similarità oltre la quale una card è un duplicato
+#   AI_DUP_MODE        drop (scarta), flag (salva con nearDuplicateOf), off
+#
+# Le card esistenti prima dell'indice vengono indicizzate alla prima
+# generazione nella cartella, oppure tutte insieme con
+#   python -m services.near_dupes
+# Dopo il recupero la cartella ha signaturesIndexed e non viene più
+# riscansionata (le cartelle nuove nascono già marcate).
+# ============================================================
+import os
+import re
+import zlib
+import hashlib
+import unicodedata
+
+import numpy as np
+from bson import ObjectId
+from pymongo import ReplaceOne
+
+from db import db
+
+NUM_PERM = 64
+BANDS    = 16
+ROWS     = NUM_PERM // BANDS
+
+DUP_THRESHOLD = float(os.getenv("AI_DUP_THRESHOLD", 0.7))
+DUP_MODE      = os.getenv("AI_DUP_MODE", "drop")
+
+# Permutazioni h(x) = (a·x + b) mod p, fisse per tutti i processi
+_PRIME = (1 << 31) - 1
+_rng   = np.random.default_rng(20240601)
+_A     = _rng.integers(1, _PRIME, NUM_PERM, dtype=np.int64)
+_B     = _rng.integers(0, _PRIME, NUM_PERM, dtype=np.int64)
+
+
+def normalize(text):
+    text = unicodedata.normalize("NFKC", text or "").casefold()
+    text = re.sub(r"[^\w\s]", " ", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def shingles(text, k=3):
+    text = normalize(text)
+    if len(text) <= k:
+        return {text}
+    return {text[i:i + k] for i in range(len(text) - k + 1)}
+
+
+def signature(text):
+    """Firma MinHash (NUM_PERM interi) del testo."""
+    x = np.fromiter(
+        (zlib.crc32(s.encode()) % _PRIME for s in shingles(text)), dtype=np.int64
+    )
+    return ((_A[:, None] * x[None, :] + _B[:, None]) % _PRIME).min(axis=1)
+
+
+def band_keys(sig):
+    return [
+        f"{b}:{hashlib.md5(sig[b * ROWS:(b + 1) * ROWS].tobytes()).hexdigest()[:12]}"
+        for b in range(BANDS)
+    ]
+
+
+def similarity(sig_a, sig_b):
+    """Stima della similarità di Jaccard tra due firme."""
+    return float(np.mean(np.asarray(sig_a) == np.asarray(sig_b)))
+
+
+# ── Manutenzione (services/folder_events.py) ────────────────
+def _doc(folder_oid, card):
+    sig = signature(card["front"])
+    return {"_id": card["_id"], "folderId": folder_oid,
+            "sig": sig.tolist(), "bands": band_keys(sig)}
+
+
+def index_cards(folder_oid, cards):
+    ops = [ReplaceOne({"_id": c["_id"]}, _doc(folder_oid, c), upsert=True) for c in cards]
+    if ops:
+        db.cardSignatures.bulk_write(ops, ordered=False)
+
+
+def unindex_cards(card_oids):
+    card_oids = list(card_oids)
+    if card_oids:
+        db.cardSignatures.delete_many({"_id": {"$in": card_oids}})
+
+
+def drop_folder_index(folder_oid):
+    db.cardSignatures.delete_many({"folderId": folder_oid})
+
+
+def ensure_indexed(folder_oid, batch_size=500):
+    """
+    Indicizza le card della cartella che non hanno ancora una firma.
+    Basta farlo una volta: da lì in poi cards_written indicizza ogni card
+    scritta, quindi la cartella viene marcata con signaturesIndexed e le
+    chiamate successive costano una sola lettura.
+    """
+    folder = db.folders.find_one({"_id": folder_oid}, {"signaturesIndexed": 1})
+    if folder is None or folder.get("signaturesIndexed"):
+        return 0
+    have   = {s["_id"] for s in db.cardSignatures.find({"folderId": folder_oid}, {"_id": 1})}
+    cursor = db.flashcards.find({"folderId": folder_oid}, {"front": 1}).batch_size(batch_size)
+    batch, added = [], 0
+    for card in cursor:
+        if card["_id"] in have:
+            continue
+        batch.append(card)
+        if len(batch) >= batch_size:
+            index_cards(folder_oid, batch)
+            added += len(batch)
+            batch = []
+    index_cards(folder_oid, batch)
+    db.folders.update_one({"_id": folder_oid}, {"$set": {"signaturesIndexed": True}})
+    return added + len(batch)
+
+
+# ── Ricerca ─────────────────────────────────────────────────
+class DuplicateFilter:
+    """
+    Confronta i front generati con quelli della cartella e con quelli
+    già accettati nella stessa generazione.
+    """
+
+    def __init__(self, folder_oid, threshold=DUP_THRESHOLD):
+        self.folder_oid = folder_oid
+        self.threshold  = threshold
+        self.local      = []   # (firma, bande, _id) dei front accettati
+        ensure_indexed(folder_oid)
+
+    def match(self, front):
+        """(_id della card simile o None, similarità) per il front."""
+        sig, bands = self._sig(front)
+        best, best_sim = None, 0.0
+        for other_sig, other_bands, other_id in self.local:
+            if set(bands) & set(other_bands):
+                sim = similarity(sig, other_sig)
+                if sim > best_sim:
+                    best, best_sim = other_id, sim
+        for cand in db.cardSignatures.find(
+            {"folderId": self.folder_oid, "bands": {"$in": bands}}, {"sig": 1}
+        ):
+            sim = similarity(sig, cand["sig"])
+            if sim > best_sim:
+                best, best_sim = cand["_id"], sim
+        if best_sim >= self.threshold:
+            return best, best_sim
+        return None, best_sim
+
+    def accept(self, front, card_id):
+        sig, bands = self._sig(front)
+        self.local.append((sig, bands, card_id))
+
+    def _sig(self, front):
+        sig = signature(front)
+        return sig, band_keys(sig)
+
+
+def filter_duplicates(folder_oid, docs, mode=DUP_MODE):
+    """
+    Applica AI_DUP_MODE alle card generate (prima dell'insert):
+    restituisce (card da salvare, numero di card scartate). In modalità
+    flag le card simili restano, con nearDuplicateOf = _id della card.
+    """
+    if mode == "off" or not docs:
+        return docs, 0
+    dup_filter = DuplicateFilter(folder_oid)
+    kept, dropped = [], 0
+    for doc in docs:
+        # _id assegnato subito: serve come riferimento tra card della stessa generazione
+        doc.setdefault("_id", ObjectId())
+        dup_of, _ = dup_filter.match(doc["front"])
+        if dup_of is not None:
+            if mode == "drop":
+                dropped += 1
+                continue
+            doc["nearDuplicateOf"] = dup_of
+        dup_filter.accept(doc["front"], doc["_id"])
+        kept.append(doc)
+    return kept, dropped
+
+
+if __name__ == "__main__":
+    # python -m services.near_dupes — indicizza le card di tutte le cartelle
+    total = sum(ensure_indexed(f["_id"]) for f in db.folders.find({}, {"_id": 1}))
+    print("Firme create:", total)
@@ -0,0 +1,86 @@
+# ============================================================
+# services/passwords.py — Hash bcrypt su un pool dedicato e limitato
+# ============================================================
+# bcrypt è volutamente lento: eseguito inline, un picco di login occupa
+# tutti i worker e blocca le altre route. Qui gli hash girano su un
+# pool di thread (bcrypt rilascia il GIL) con una coda limitata
+# (services/executor.py); quando è piena si risponde subito 503.
+#
+# La richiesta attende comunque l'hash, quindi il limite protegge le
+# altre route solo se il processo serve più richieste insieme: serve il
+# worker gthread di gunicorn.conf.py con GUNICORN_THREADS maggiore di
+# PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE (default 8 > 2 + 2).
+#
+# Variabili d'ambiente (opzionali):
+#   BCRYPT_ROUNDS          cost factor dei nuovi hash (default 12)
+#   PASSWORD_HASH_WORKERS  thread dedicati agli hash
+#   PASSWORD_HASH_QUEUE    richieste in attesa oltre ai thread occupati
+#   PASSWORD_HASH_TIMEOUT  secondi massimi di attesa del risultato
+# ============================================================
+import os
+import traceback
+
+import bcrypt
+
+from db import db
+from services.executor import BoundedExecutor, ExecutorBusy as HasherBusy
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+HASH_WORKERS  = int(os.getenv("PASSWORD_HASH_WORKERS", 2))
+HASH_QUEUE    = int(os.getenv("PASSWORD_HASH_QUEUE", 2))
+HASH_TIMEOUT  = float(os.getenv("PASSWORD_HASH_TIMEOUT", 10))
+WEB_THREADS   = int(os.getenv("GUNICORN_THREADS", 1))
+
+if HASH_WORKERS + HASH_QUEUE >= WEB_THREADS > 1:
+    print(f"[passwords] {HASH_WORKERS} + {HASH_QUEUE} slot bcrypt con {WEB_THREADS} "
+          "thread per worker: un picco di login può occuparli tutti")
+
+executor = BoundedExecutor(HASH_WORKERS, HASH_QUEUE, name="bcrypt")
+
+
+def hash_rounds(pw_hash):
+    """Cost factor di un hash bcrypt ("$2b$12$..." → 12)."""
+    try:
+        return int(pw_hash.split(b"$")[2])
+    except (IndexError, ValueError):
+        return None
+
+
+def _hash(password):
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(BCRYPT_ROUNDS))
+
+
+def _check(password, pw_hash):
+    return bcrypt.checkpw(password.encode(), pw_hash)
+
+
+def hash_password(password):
+    return executor.run(_hash, password, timeout=HASH_TIMEOUT)
+
+
+def check_password(password, pw_hash):
+    return executor.run(_check, password, pw_hash, timeout=HASH_TIMEOUT)
+
+
+def _rehash(user_id, password, old_hash):
+    try:
+        db.users.update_one(
+            # Solo se nel frattempo la password non è cambiata
+            {"_id": user_id, "passwordHash": old_hash},
+            {"$set": {"passwordHash": _hash(password)}},
+        )
+    except Exception:
+        traceback.print_exc()
+
+
+def upgrade_hash(user, password):
+    """
+    Dopo un login riuscito: se l'hash ha un cost diverso da BCRYPT_ROUNDS
+    lo ricalcola in background. Con il pool pieno rinvia al prossimo login.
+    """
+    if hash_rounds(user["passwordHash"]) == BCRYPT_ROUNDS:
+        return
+    try:
+        executor.submit(_rehash, user["_id"], password, user["passwordHash"])
+    except HasherBusy:
+        pass
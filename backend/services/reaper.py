@@ -0,0 +1,128 @@
+# ============================================================
+# services/reaper.py — Pulizia delle flashcardStats orfane
+# ============================================================
+# Eliminare una cartella o una card lascia le righe stats degli utenti.
+# Le route accodano qui la cancellazione e un thread in background la
+# esegue a blocchi di REAPER_BATCH_SIZE righe, con una pausa di
+# REAPER_PAUSE secondi tra un blocco e l'altro per non saturare il DB.
+#
+# La coda è in memoria: ciò che si perde (crash, riavvio) e le righe
+# orfane già presenti si recuperano con
+#   python -m services.reaper              elimina le stats orfane
+#   python -m services.reaper --dry-run    le conta soltanto
+# ============================================================
+import os
+import sys
+import time
+import threading
+import traceback
+from collections import deque
+
+import bson
+
+from db import db
+from models.progress import forget_stats
+
+BATCH_SIZE = int(os.getenv("REAPER_BATCH_SIZE", 500))
+PAUSE      = float(os.getenv("REAPER_PAUSE", 0.2))
+
+
+def delete_in_batches(query, batch_size=BATCH_SIZE, pause=PAUSE):
+    """Elimina le stats che soddisfano query, un blocco alla volta."""
+    deleted = 0
+    while True:
+        rows = list(db.flashcardStats.find(
+            query, {"userId": 1, "folderId": 1, "nextDue": 1}
+        ).limit(batch_size))
+        if not rows:
+            return deleted
+        deleted += db.flashcardStats.delete_many({"_id": {"$in": [s["_id"] for s in rows]}}).deleted_count
+        forget_stats(rows)
+        if len(rows) < batch_size:
+            return deleted
+        time.sleep(pause)
+
+
+class Reaper:
+    def __init__(self):
+        self.pending = deque()   # filtri da applicare a flashcardStats
+        self.lock    = threading.Lock()
+        self.wakeup  = threading.Event()
+        self.thread  = None
+
+    def _ensure_thread(self):
+        # Avviato al primo uso, quindi nel worker e non nel master di gunicorn
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def enqueue(self, query):
+        with self.lock:
+            self.pending.append(query)
+            self._ensure_thread()
+        self.wakeup.set()
+
+    def drain(self):
+        while True:
+            with self.lock:
+                if not self.pending:
+                    return
+                query = self.pending.popleft()
+            delete_in_batches(query)
+
+    def _run(self):
+        while True:
+            self.wakeup.wait()
+            self.wakeup.clear()
+            try:
+                self.drain()
+            except Exception:
+                traceback.print_exc()
+
+
+reaper = Reaper()
+
+
+def reap_folder(folder_oid):
+    reaper.enqueue({"folderId": folder_oid})
+
+
+def reap_cards(card_oids):
+    card_oids = list(card_oids)
+    for i in range(0, len(card_oids), BATCH_SIZE):
+        reaper.enqueue({"flashcardId": {"$in": card_oids[i:i + BATCH_SIZE]}})
+
+
+# ── Pulizia una tantum ──────────────────────────────────────
+def sweep_orphans(batch_size=BATCH_SIZE, pause=PAUSE, dry_run=False):
+    """
+    Scorre le stats per _id e rimuove quelle la cui card non esiste più
+    (incluse le righe senza folderId, precedenti alla coda nextDue).
+    Restituisce (documenti, byte BSON) rimossi o, con dry_run, trovati.
+    """
+    documents, size = 0, 0
+    last_id = None
+    while True:
+        query = {"_id": {"$gt": last_id}} if last_id else {}
+        batch = list(db.flashcardStats.find(query).sort("_id", 1).limit(batch_size))
+        if not batch:
+            return documents, size
+        last_id = batch[-1]["_id"]
+
+        card_ids = list({s["flashcardId"] for s in batch})
+        alive = {c["_id"] for c in db.flashcards.find({"_id": {"$in": card_ids}}, {"_id": 1})}
+        orphans = [s for s in batch if s["flashcardId"] not in alive]
+        if orphans:
+            if not dry_run:
+                db.flashcardStats.delete_many({"_id": {"$in": [s["_id"] for s in orphans]}})
+                forget_stats(orphans)
+            documents += len(orphans)
+            size += sum(len(bson.encode(s)) for s in orphans)
+            time.sleep(pause)
+
+
+if __name__ == "__main__":
+    dry_run = "--dry-run" in sys.argv
+    documents, size = sweep_orphans(dry_run=dry_run)
+    verb = "Trovate" if dry_run else "Rimosse"
+    print(f"{verb} {documents} righe stats orfane ({size / 1024:.1f} KiB)")
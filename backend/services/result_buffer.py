@@ -0,0 +1,87 @@
+# ============================================================
+# services/result_buffer.py — Scrittura differita dei risultati di studio
+# ============================================================
+# Con STUDY_WRITE_BEHIND=1 i risultati di /study/result e /study/results
+# vengono accumulati in memoria e scritti con un solo bulk_write quando
+# il buffer supera RESULTS_FLUSH_SIZE, ogni RESULTS_FLUSH_INTERVAL
+# secondi e all'uscita del processo.
+# ============================================================
+import os
+import atexit
+import threading
+import traceback
+
+from services.scheduler import ResultsNotWritten, record_results
+
+WRITE_BEHIND   = os.getenv("STUDY_WRITE_BEHIND", "0") == "1"
+FLUSH_SIZE     = int(os.getenv("RESULTS_FLUSH_SIZE", 200))
+FLUSH_INTERVAL = float(os.getenv("RESULTS_FLUSH_INTERVAL", 2.0))
+
+
+class ResultBuffer:
+    def __init__(self, flush_size=FLUSH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.flush_size     = flush_size
+        self.flush_interval = flush_interval
+        self.pending        = []
+        self.lock           = threading.Lock()
+        # Serializza i flush: i batch arrivano al DB nell'ordine di risposta
+        self.flush_lock     = threading.Lock()
+        self.wakeup         = threading.Event()
+        self.thread         = None
+
+    def _ensure_thread(self):
+        # Avviato al primo uso, quindi nel worker e non nel master di gunicorn
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def add(self, results):
+        with self.lock:
+            self.pending.extend(results)
+            self._ensure_thread()
+            full = len(self.pending) >= self.flush_size
+        if full:
+            self.wakeup.set()
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                batch, self.pending = self.pending, []
+            if not batch:
+                return
+            try:
+                record_results(batch)
+            except ResultsNotWritten as e:
+                # Scrittura parziale: riparte solo quello che non è stato applicato
+                with self.lock:
+                    self.pending[:0] = e.results
+                raise
+            except Exception:
+                # Errore del DB: il batch torna in testa e riparte al prossimo flush
+                with self.lock:
+                    self.pending[:0] = batch
+                raise
+
+    def _run(self):
+        while True:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                traceback.print_exc()
+
+
+buffer = ResultBuffer()
+atexit.register(buffer.flush)
+
+
+def submit_results(results):
+    """
+    results: tuple (user_oid, flashcard_id, result, answered_at, folder_id).
+    Scrive subito o tramite il buffer, a seconda di STUDY_WRITE_BEHIND.
+    """
+    if WRITE_BEHIND:
+        buffer.add(results)
+    else:
+        record_results(results)
@@ -0,0 +1,114 @@
+# ============================================================
+# services/sampler.py — Campionamento pesato dinamico (Fenwick tree)
+# ============================================================
+# Alternativa a random.choices quando il pool resta in memoria:
+#   sample()   O(log n)  estrazione proporzionale al peso
+#   update()   O(log n)  nuovo peso dopo un risultato
+#   exclude()  O(1)      la card viene tolta dall'albero solo quando
+#                        viene estratta la prima volta (costo ammortizzato)
+# ============================================================
+import random
+from contextlib import contextmanager
+
+
+class WeightedSampler:
+    def __init__(self, weights):
+        self._weights  = [float(w) for w in weights]
+        self._n        = len(self._weights)
+        self._excluded = set()   # indici esclusi
+        self._zeroed   = set()   # esclusi già rimossi dall'albero
+        self._in_tree  = list(self._weights)   # pesi effettivi nell'albero
+        self._build()
+
+    def __len__(self):
+        return self._n
+
+    # ── Albero ───────────────────────────────────────────────
+    def _build(self):
+        tree = [0.0] + self._in_tree
+        for i in range(1, self._n + 1):
+            j = i + (i & -i)
+            if j <= self._n:
+                tree[j] += tree[i]
+        self._tree    = tree
+        self._total   = sum(self._in_tree)
+        self._updates = 0
+
+    def _set(self, i, w):
+        delta = w - self._in_tree[i]
+        if not delta:
+            return
+        self._in_tree[i] = w
+        self._total += delta
+        j = i + 1
+        while j <= self._n:
+            self._tree[j] += delta
+            j += j & -j
+        # Ricostruzione periodica contro l'accumulo di errori float
+        self._updates += 1
+        if self._updates > self._n:
+            self._build()
+
+    def _find(self, r):
+        """Primo indice la cui somma prefissa supera r."""
+        pos, step = 0, 1 << self._n.bit_length()
+        while step:
+            nxt = pos + step
+            if nxt <= self._n and self._tree[nxt] <= r:
+                pos = nxt
+                r  -= self._tree[nxt]
+            step >>= 1
+        return min(pos, self._n - 1)
+
+    # ── API ──────────────────────────────────────────────────
+    def weight(self, i):
+        return self._weights[i]
+
+    def update(self, i, weight):
+        self._weights[i] = float(weight)
+        if i not in self._zeroed:
+            self._set(i, self._weights[i])
+
+    def exclude(self, i):
+        self._excluded.add(i)
+
+    def include(self, i):
+        self._excluded.discard(i)
+        if i in self._zeroed:
+            self._zeroed.discard(i)
+            self._set(i, self._weights[i])
+
+    @contextmanager
+    def adjusted(self, overrides):
+        """Pesi temporanei {indice: peso} validi solo dentro il blocco."""
+        saved = {i: self._in_tree[i] for i in overrides}
+        for i, w in overrides.items():
+            if i not in self._zeroed:
+                self._set(i, float(w))
+        try:
+            yield self
+        finally:
+            for i, w in saved.items():
+                if i not in self._zeroed:
+                    self._set(i, w)
+
+    def sample(self, rng=random):
+        """Indice estratto in proporzione al peso, o None se non resta nulla."""
+        while self._total > 0:
+            i = self._find(rng.random() * self._total)
+            if i in self._excluded:
+                self._zeroed.add(i)
+                self._set(i, 0.0)
+                continue
+            if self._in_tree[i] > 0:
+                return i
+            # Errore di arrotondamento su un peso nullo
+            return self._scan(rng)
+        return None
+
+    def _scan(self, rng):
+        self._build()
+        idx = [i for i, w in enumerate(self._in_tree) if w > 0 and i not in self._excluded]
+        if not idx:
+            return None
+        return rng.choices(idx, weights=[self._in_tree[i] for i in idx], k=1)[0]
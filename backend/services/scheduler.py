@@ -1,8 +1,14 @@
 import random
 import hashlib
-from datetime import datetime
+from collections import Counter
+from datetime import datetime, timedelta
+import numpy as np
 from bson import ObjectId
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import BulkWriteError
 from db import db
+from models.folder import folder_counters, recount_cards
+from models.progress import add_seen, seen_count, recount_progress
 from models.stats import create_flashcard_stats
 
 # ── Costanti di tuning ───────────────────────────────────────
@@ -11,6 +17,8 @@ SUCCESS_WEIGHT   = 3.0
 MIN_HOURS_GAP    = 0.1
 UNSEEN_BONUS     = 200.0
 NO_REPEAT_WINDOW = 3
+DUE_TOP_K        = 50   # candidate lette dalla coda per ogni pesca
+UNSEEN_SEEKS     = 4    # posizioni casuali nell'indice per cercare card mai viste
 
 
 def hours_since(dt):
@@ -39,86 +47,416 @@ def compute_weight(stats, card_id, user_id):
     return raw * deterministic_jitter(card_id, user_id)
 
 
-def pick_flashcard(user_id, folder_id, recent_ids=None, learned_ids=None):
+# ── Calcolo vettoriale (tutto il mazzo in un passaggio) ──────
+def jitter_array(card_ids, user_id, salt="study", now=None):
+    """Come deterministic_jitter, ma per una lista di card con un solo strftime."""
+    daily_salt = (now or datetime.now()).strftime("%Y-%m-%d")
+    suffix = f"-{user_id}-{salt}-{daily_salt}".encode()
+    base = np.fromiter(
+        (int.from_bytes(hashlib.md5(str(cid).encode() + suffix).digest()[:4], "big")
+         for cid in card_ids),
+        dtype=np.float64, count=len(card_ids),
+    ) / 0xFFFFFFFF
+    return 0.85 + base * 0.30
+
+
+def compute_weights(stats_list, card_ids, user_id, now=None):
+    """
+    Versione vettoriale di compute_weight: stats_list[i] sono le stats
+    di card_ids[i]. Restituisce (weights, hours) come array NumPy;
+    hours è NaN per le card mai viste.
+    """
+    now = now or datetime.now()
+    n   = len(card_ids)
+
+    last_seen = [s.get("lastSeen") for s in stats_list]
+    hours = np.fromiter(
+        (max(0.0, (now - ls).total_seconds() / 3600) if ls is not None else np.nan
+         for ls in last_seen),
+        dtype=np.float64, count=n,
+    )
+    fails     = np.fromiter((s.get("failCount", 0) for s in stats_list), np.float64, n)
+    successes = np.fromiter((s.get("successCount", 0) for s in stats_list), np.float64, n)
+
+    seen    = ~np.isnan(hours)
+    weights = np.empty(n, dtype=np.float64)
+
+    seen_idx   = np.flatnonzero(seen)
+    unseen_idx = np.flatnonzero(~seen)
+    if seen_idx.size:
+        raw = np.maximum(
+            0.5,
+            hours[seen_idx] + fails[seen_idx] * FAIL_WEIGHT
+            - successes[seen_idx] * SUCCESS_WEIGHT + 1.0,
+        )
+        weights[seen_idx] = raw * jitter_array(
+            [card_ids[i] for i in seen_idx], user_id, now=now
+        )
+    if unseen_idx.size:
+        weights[unseen_idx] = UNSEEN_BONUS * jitter_array(
+            [card_ids[i] for i in unseen_idx], user_id, salt="unseen", now=now
+        )
+    return weights, hours
+
+
+def penalize_recent(weights, card_ids, recent_ids, pool_size):
+    """Riduce al 5% il peso delle card in recent_ids se restano alternative."""
+    weights = weights.copy()
+    if pool_size > NO_REPEAT_WINDOW and recent_ids:
+        recent = set(recent_ids)
+        penalized = np.fromiter((str(c) in recent for c in card_ids), bool, len(card_ids))
+        weights[penalized] *= 0.05
+    return weights
+
+
+# ── Coda "due" indicizzata ───────────────────────────────────
+# Per una card vista il peso grezzo è
+#   hours_since(lastSeen) + failCount*FAIL_WEIGHT - successCount*SUCCESS_WEIGHT + 1
+# cioè le ore trascorse da nextDue = lastSeen - (fail*FW - success*SW + 1)h.
+# nextDue non dipende da "adesso": ordinare per nextDue crescente equivale
+# a ordinare per peso decrescente, quindi basta l'indice
+# (userId, folderId, nextDue) di schema.py per leggere solo le prime
+# DUE_TOP_K card.
+def next_due(stats):
+    last_seen = stats.get("lastSeen")
+    if last_seen is None:
+        return None
+    offset = (stats.get("failCount", 0) * FAIL_WEIGHT
+              - stats.get("successCount", 0) * SUCCESS_WEIGHT + 1.0)
+    return last_seen - timedelta(hours=offset)
+
+
+def backfill_next_due(batch_size=1000):
+    """
+    Aggiunge folderId e nextDue alle righe stats create prima della coda.
+    Restituisce il numero di righe aggiornate.
+    """
+    updated = 0
+    cursor = db.flashcardStats.find(
+        {"lastSeen": {"$ne": None},
+         "$or": [{"nextDue": {"$exists": False}}, {"folderId": {"$exists": False}}]},
+        {"flashcardId": 1, "lastSeen": 1, "failCount": 1, "successCount": 1},
+    ).batch_size(batch_size)
+
+    batch = []
+    for stats in cursor:
+        batch.append(stats)
+        if len(batch) >= batch_size:
+            updated += _backfill_batch(batch)
+            batch = []
+    if batch:
+        updated += _backfill_batch(batch)
+    return updated
+
+
+def _backfill_batch(batch):
+    folders = {
+        c["_id"]: c["folderId"]
+        for c in db.flashcards.find(
+            {"_id": {"$in": [s["flashcardId"] for s in batch]}}, {"folderId": 1}
+        )
+    }
+    ops = [
+        UpdateOne(
+            {"_id": s["_id"]},
+            {"$set": {"folderId": folders[s["flashcardId"]], "nextDue": next_due(s)}},
+        )
+        for s in batch if s["flashcardId"] in folders
+    ]
+    if not ops:
+        return 0
+    return db.flashcardStats.bulk_write(ops, ordered=False).modified_count
+
+
+def _seek_ids(folder_oid, start, limit):
+    """
+    Fino a `limit` _id della cartella a partire dalla posizione `start`
+    nell'ordine di _id, ricominciando dall'inizio quando si arriva in
+    fondo. skip scorre solo le chiavi dell'indice (folderId, _id), senza
+    leggere documenti.
+    """
+    query = {"folderId": folder_oid}
+    ids = [c["_id"] for c in db.flashcards.find(query, {"_id": 1})
+           .sort("_id", ASCENDING).skip(start).limit(limit)]
+    if len(ids) < limit and start:
+        ids += [c["_id"] for c in db.flashcards.find(query, {"_id": 1})
+                .sort("_id", ASCENDING).limit(min(limit - len(ids), start))]
+    return ids
+
+
+def _unseen_candidates(user_oid, folder_oid, total, excluded, limit):
+    """
+    Restituisce (card mai viste, fino a `limit` _id di card mai viste).
+
+    Il numero viene dai contatori (cardCount - studyProgress.seen); il
+    campione da UNSEEN_SEEKS posizioni casuali nell'ordine delle card,
+    ciascuna seguita dalla lettura di `limit` _id. La posizione è scelta
+    per rango e non per valore di _id: gli _id arrivano a blocchi (import,
+    generazioni AI) e un valore uniforme cadrebbe quasi sempre nel vuoto
+    tra due blocchi. Quando le card nuove sono poche una pesca può non
+    trovarne, le successive partono da punti diversi.
+    """
+    unseen_count = total - seen_count(user_oid, folder_oid)
+    if unseen_count <= 0:
+        return 0, []
+
+    found = {}
+    for _ in range(UNSEEN_SEEKS):
+        ids = [i for i in _seek_ids(folder_oid, random.randrange(total), limit)
+               if i not in excluded and i not in found]
+        if ids:
+            seen_ids = {
+                s["flashcardId"] for s in db.flashcardStats.find(
+                    {"userId": user_oid, "flashcardId": {"$in": ids},
+                     "nextDue": {"$type": "date"}},
+                    {"flashcardId": 1},
+                )
+            }
+            found.update(dict.fromkeys(i for i in ids if i not in seen_ids))
+        if len(found) >= limit:
+            break
+    candidates = list(found)
+    return unseen_count, random.sample(candidates, min(limit, len(candidates)))
+
+
+def pick_flashcard(user_oid, folder_id, recent_ids=None, learned_ids=None):
     """
     Seleziona la prossima flashcard escludendo quelle già imparate
     nella sessione corrente (learned_ids) e penalizzando quelle
     viste di recente (recent_ids).
     """
-    user_oid   = ObjectId(user_id)
+    cards = pick_flashcards(user_oid, folder_id, 1, recent_ids, learned_ids)
+    return cards[0] if cards else None
+
+
+def pick_flashcards(user_oid, folder_id, count, recent_ids=None, learned_ids=None):
+    """
+    Estrae fino a `count` card distinte, nell'ordine in cui il client
+    le mostrerebbe: dopo ogni estrazione la card entra nella finestra
+    recent_ids, come farebbe StudyPage.
+
+    Legge solo le prime DUE_TOP_K card della coda nextDue più un
+    campione di card mai viste: i documenti letti non crescono con il
+    mazzo, solo le chiavi d'indice scorse da skip per il campione.
+    user_oid è l'ObjectId dell'utente (g.user_oid).
+    """
     folder_oid = ObjectId(folder_id)
+    _, total   = folder_counters(folder_oid)
+    if not total:
+        return []
     recent_ids  = [str(x) for x in (recent_ids or [])]
-    # learned_ids: set di _id stringa delle card già imparate in sessione
-    learned_ids = set(str(x) for x in (learned_ids or []))
+    # learned_ids: _id delle card già imparate in sessione
+    learned_oids = set(
+        ObjectId(x) for x in (learned_ids or []) if ObjectId.is_valid(str(x))
+    )
 
-    flashcards = list(db.flashcards.find({"folderId": folder_oid}))
-    if not flashcards:
-        return None
+    # ── Card già viste, in ordine di priorità ──
+    # Quelle viste da meno di MIN_HOURS_GAP restano fuori dalla query,
+    # altrimenti dopo molti errori potrebbero occupare tutte le DUE_TOP_K
+    # posizioni e nascondere card più vecchie
+    now    = datetime.now()
+    cutoff = now - timedelta(hours=MIN_HOURS_GAP)
+    due    = {
+        "userId": user_oid,
+        "folderId": folder_oid,
+        "nextDue": {"$type": "date"},
+        "flashcardId": {"$nin": list(learned_oids)},
+    }
+    fields = {"flashcardId": 1, "lastSeen": 1, "failCount": 1, "successCount": 1}
+    seen_stats = list(db.flashcardStats.find(
+        {**due, "lastSeen": {"$lt": cutoff}}, fields
+    ).sort("nextDue", ASCENDING).limit(DUE_TOP_K))
 
-    # ── Esclude completamente le card già imparate in sessione ──
-    remaining = [c for c in flashcards if str(c["_id"]) not in learned_ids]
-    if not remaining:
-        return None   # tutte imparate → sessione finita
+    # ── Card mai viste (campione) ──
+    unseen_count, unseen_ids = _unseen_candidates(
+        user_oid, folder_oid, total, learned_oids, DUE_TOP_K
+    )
 
-    flashcard_ids = [card["_id"] for card in remaining]
+    # Solo se non basta altro: card viste da poco
+    if len(seen_stats) + len(unseen_ids) < count:
+        seen_stats += list(db.flashcardStats.find(
+            {**due, "lastSeen": {"$gte": cutoff}}, fields
+        ).sort("nextDue", ASCENDING).limit(DUE_TOP_K))
 
-    stats_list = list(db.flashcardStats.find({
-        "userId": user_oid,
-        "flashcardId": {"$in": flashcard_ids}
-    }))
-    stats_map = {s["flashcardId"]: s for s in stats_list}
+    card_ids = [s["flashcardId"] for s in seen_stats] + unseen_ids
+    if not card_ids:
+        return []   # cartella vuota o tutte imparate → sessione finita
+    str_ids    = [str(i) for i in card_ids]
+    stats_list = seen_stats + [create_flashcard_stats(user_oid, i) for i in unseen_ids]
 
-    weighted_cards = []
-    now = datetime.now()
+    base, hours = compute_weights(stats_list, str_ids, str(user_oid), now=now)
+    # Il campione di card nuove rappresenta tutte le unseen_count card nuove
+    if unseen_ids:
+        base[len(seen_stats):] *= unseen_count / len(unseen_ids)
+    too_recent = hours < MIN_HOURS_GAP
+    pool_size  = total - len(learned_oids)
 
-    for card in remaining:
-        card_id = card["_id"]
+    taken  = np.zeros(len(card_ids), dtype=bool)
+    chosen = []
+    for _ in range(min(count, len(card_ids))):
+        weights = penalize_recent(base, str_ids, recent_ids, pool_size - len(chosen))
+        available = ~taken & ~too_recent
+        if not available.any():
+            available = ~taken
+        idx = np.flatnonzero(available).tolist()
+        i = random.choices(idx, weights=weights[available].tolist(), k=1)[0]
+        taken[i] = True
+        chosen.append(card_ids[i])
+        recent_ids = (recent_ids + [str_ids[i]])[-NO_REPEAT_WINDOW:]
 
-        if card_id not in stats_map:
-            new_stats = create_flashcard_stats(user_oid, card_id)
-            db.flashcardStats.insert_one(new_stats)
-            stats = new_stats
-        else:
-            stats = stats_map[card_id]
+    cards = {c["_id"]: c for c in db.flashcards.find({"_id": {"$in": chosen}})}
+    return [cards[i] for i in chosen if i in cards]
 
-        weight = compute_weight(stats, str(card_id), str(user_oid))
 
-        # Penalizza card viste troppo di recente nella stessa sessione
-        if str(card_id) in recent_ids:
-            if len(remaining) > NO_REPEAT_WINDOW:
-                weight *= 0.05
+# ── Registrazione risultati ──────────────────────────────────
+class ResultsNotWritten(Exception):
+    """
+    bulk_write parzialmente fallito: results sono solo i risultati non
+    applicati, gli altri sono già nel DB e non vanno riscritti.
+    """
 
-        weighted_cards.append((card, weight))
+    def __init__(self, results):
+        super().__init__(f"{len(results)} risultati non scritti")
+        self.results = results
 
-    # Escludi card viste da meno di MIN_HOURS_GAP se ci sono alternative
-    available = [
-        (c, w) for (c, w) in weighted_cards
-        if not (
-            stats_map.get(c["_id"], {}).get("lastSeen") and
-            (now - stats_map[c["_id"]]["lastSeen"]).total_seconds() / 3600 < MIN_HOURS_GAP
-        )
+
+def _result_update(seen_at, folder_oid, fails=0, successes=0):
+    """
+    Pipeline di update: incrementa i contatori, aggiorna lastSeen e
+    ricalcola nextDue lato server in un'unica operazione atomica.
+    lastSeen non torna mai indietro, quindi l'ordine di applicazione
+    di più risultati della stessa card non conta.
+    """
+    fields = {
+        "failCount":    {"$add": [{"$ifNull": ["$failCount", 0]}, fails]},
+        "successCount": {"$add": [{"$ifNull": ["$successCount", 0]}, successes]},
+        "lastSeen":     {"$max": ["$lastSeen", seen_at]},
+        "folderId":     folder_oid,
+        "createdAt":    {"$ifNull": ["$createdAt", seen_at]},
+    }
+    if successes:
+        fields["consecutiveFails"] = 0
+    offset_hours = {"$add": [
+        {"$multiply": ["$failCount", FAIL_WEIGHT]},
+        {"$multiply": ["$successCount", -SUCCESS_WEIGHT]},
+        1.0,
+    ]}
+    return [
+        {"$set": fields},
+        {"$set": {"nextDue": {"$subtract": [
+            "$lastSeen", {"$multiply": [offset_hours, 3600 * 1000]}
+        ]}}},
     ]
-    if not available:
-        available = weighted_cards
 
-    cards   = [c for (c, _) in available]
-    weights = [w for (_, w) in available]
 
-    return random.choices(cards, weights=weights, k=1)[0]
+def _folder_of(flashcard_oid):
+    card = db.flashcards.find_one({"_id": flashcard_oid}, {"folderId": 1})
+    return card["folderId"] if card else None
 
 
-def mark_fail(user_id, flashcard_id):
-    return db.flashcardStats.update_one(
-        {"userId": ObjectId(user_id), "flashcardId": ObjectId(flashcard_id)},
-        {"$inc": {"failCount": 1}, "$set": {"lastSeen": datetime.now()}}
+def _mark(user_oid, flashcard_id, folder_id, **counts):
+    card_oid   = ObjectId(flashcard_id)
+    folder_oid = ObjectId(folder_id) if folder_id else _folder_of(card_oid)
+    if folder_oid is None:
+        return None   # card inesistente: nessuna riga stats orfana
+    result = db.flashcardStats.update_one(
+        {"userId": user_oid, "flashcardId": card_oid},
+        _result_update(datetime.now(), folder_oid, **counts),
+        upsert=True,
     )
+    key = (user_oid, folder_oid)
+    add_seen({key: 1 if result.upserted_id is not None else 0}, answers={key: 1})
+    return result
+
+
+def mark_fail(user_oid, flashcard_id, folder_id=None):
+    return _mark(user_oid, flashcard_id, folder_id, fails=1)
+
+
+def mark_success(user_oid, flashcard_id, folder_id=None):
+    return _mark(user_oid, flashcard_id, folder_id, successes=1)
+
+
+def record_results(results):
+    """
+    Applica una lista di risultati con un solo bulk_write.
+    results: tuple (user_oid, flashcard_id, result, answered_at, folder_id)
+    in ordine di risposta; folder_id può essere None.
+    I risultati della stessa card vengono fusi in un'unica operazione;
+    quelli di card che non esistono più vengono scartati.
+    Se alcune operazioni falliscono solleva ResultsNotWritten con i soli
+    risultati da riprovare.
+    """
+    merged = {}
+    for item in results:
+        user_oid, flashcard_id, result, answered_at, folder_id = item
+        key = (user_oid, ObjectId(flashcard_id))
+        entry = merged.setdefault(key, {
+            "fails": 0, "successes": 0, "seen_at": answered_at, "folder": folder_id,
+            "results": [],
+        })
+        entry["results"].append(item)
+        if result == "success":
+            entry["successes"] += 1
+        else:
+            entry["fails"] += 1
+        entry["seen_at"] = max(entry["seen_at"], answered_at)
+        entry["folder"]  = entry["folder"] or folder_id
+    if not merged:
+        return None
+
+    # Cartelle mancanti: una sola query per tutto il batch
+    unknown = [card for (_, card), e in merged.items() if not e["folder"]]
+    folders = {
+        c["_id"]: c["folderId"]
+        for c in db.flashcards.find({"_id": {"$in": unknown}}, {"folderId": 1})
+    } if unknown else {}
+
+    ops, keys, sources = [], [], []
+    for (user_oid, card_oid), e in merged.items():
+        folder_oid = ObjectId(e["folder"]) if e["folder"] else folders.get(card_oid)
+        if folder_oid is None:
+            continue   # card inesistente: l'upsert creerebbe una riga orfana
+        ops.append(UpdateOne(
+            {"userId": user_oid, "flashcardId": card_oid},
+            _result_update(e["seen_at"], folder_oid,
+                           fails=e["fails"], successes=e["successes"]),
+            upsert=True,
+        ))
+        keys.append((user_oid, folder_oid))
+        sources.append(e["results"])
+    if not ops:
+        return None
+    try:
+        result = db.flashcardStats.bulk_write(ops, ordered=False)
+    except BulkWriteError as exc:
+        # Con ordered=False le altre operazioni sono già applicate: vanno
+        # contate qui e non riprovate, perché $add non è idempotente
+        details = exc.details
+        failed  = {err["index"] for err in details.get("writeErrors", [])}
+        add_seen(Counter(keys[u["index"]] for u in details.get("upserted", [])),
+                 answers=_answers(keys, sources, skip=failed))
+        raise ResultsNotWritten(
+            [item for i in sorted(failed) for item in sources[i]]
+        ) from exc
+    # Righe stats appena create: card viste per la prima volta
+    add_seen(Counter(keys[i] for i in result.upserted_ids),
+             answers=_answers(keys, sources))
+    return result
+
+
+def _answers(keys, sources, skip=()):
+    """Risultati scritti per (utente, cartella), escluse le operazioni in skip."""
+    answers = Counter()
+    for i, key in enumerate(keys):
+        if i not in skip:
+            answers[key] += len(sources[i])
+    return answers
 
 
-def mark_success(user_id, flashcard_id):
-    return db.flashcardStats.update_one(
-        {"userId": ObjectId(user_id), "flashcardId": ObjectId(flashcard_id)},
-        {
-            "$inc": {"successCount": 1},
-            "$set": {"lastSeen": datetime.now(), "consecutiveFails": 0}
-        }
-    )
\ No newline at end of file
+if __name__ == "__main__":
+    # python -m services.scheduler — migra le stats esistenti alla coda nextDue
+    # e ricalcola i contatori delle card (da eseguire a scritture ferme)
+    print("Righe stats aggiornate:", backfill_next_due())
+    print("Cartelle ricontate:", recount_cards())
+    print("Contatori studyProgress:", recount_progress())
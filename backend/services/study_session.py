@@ -0,0 +1,314 @@
+# ============================================================
+# services/study_session.py — Cache in memoria delle sessioni di studio
+# ============================================================
+# Una sessione carica UNA volta il mazzo (_id delle card + stats
+# dell'utente) e lo tiene nella cache del worker. /study/next pesca dal
+# pool in memoria e legge dal DB solo il testo della card estratta;
+# /study/result aggiorna il pool sul posto.
+#
+# Le modifiche alle card fatte da altri worker arrivano tramite la
+# versione della cartella (models/folder.py), i risultati registrati da
+# altri worker tramite il contatore answers di studyProgress
+# (models/progress.py): a ogni richiesta la sessione in cache viene
+# ricaricata se la versione è cambiata o se nel DB ci sono più risultati
+# di quelli che conosce. Con la scrittura differita i risultati ancora
+# nel buffer tengono il contatore indietro: un risultato arrivato da un
+# altro worker si vede al più dopo il flush successivo.
+#
+# Variabili d'ambiente (opzionali):
+#   STUDY_SESSION_TTL         secondi di inattività prima della scadenza
+#   STUDY_SESSION_CACHE_SIZE  numero massimo di sessioni per worker
+#   STUDY_SESSION_MAX_CARDS   oltre questa soglia si usa la coda nextDue
+# ============================================================
+import os
+import time
+import threading
+import traceback
+from collections import OrderedDict
+from datetime import datetime
+from bson import ObjectId
+
+from db import db
+from models.folder import folder_counters, folder_version
+from models.progress import answer_count
+from models.stats import create_flashcard_stats
+from services.result_buffer import WRITE_BEHIND, buffer
+from services.sampler import WeightedSampler
+from services.scheduler import (
+    compute_weight, compute_weights, MIN_HOURS_GAP, NO_REPEAT_WINDOW
+)
+
+SESSION_TTL        = int(os.getenv("STUDY_SESSION_TTL", 900))
+SESSION_CACHE_SIZE = int(os.getenv("STUDY_SESSION_CACHE_SIZE", 256))
+SESSION_MAX_CARDS  = int(os.getenv("STUDY_SESSION_MAX_CARDS", 5000))
+
+RECENT_PENALTY = 0.05
+
+
+class StudySession:
+    """
+    Pool di card di una coppia (utente, cartella).
+    I pesi base sono calcolati al caricamento e ricalcolati solo per
+    la card di cui si registra il risultato; le estrazioni passano per
+    un WeightedSampler, quindi costano O(log n).
+    """
+
+    def __init__(self, user_oid, folder_id, card_ids, stats_map, version=None, answers=0):
+        self.user_id   = str(user_oid)
+        self.folder_id = str(folder_id)
+        self.version   = version   # versione della cartella al caricamento
+        self.answers   = answers   # risultati nel DB al caricamento
+        self.local     = 0         # risultati registrati qui dopo il caricamento
+        self.stale     = False     # una card estratta non esiste più
+        self.lock      = threading.Lock()
+        self.touched   = time.monotonic()
+
+        self.ids     = [str(c) for c in card_ids]
+        self.index   = {cid: i for i, cid in enumerate(self.ids)}
+        self.stats   = {str(k): v for k, v in stats_map.items()}
+        self.sampler = WeightedSampler(compute_weights(
+            [self.stats[cid] for cid in self.ids], self.ids, self.user_id
+        )[0])
+        self.learned = set()   # indici esclusi nel sampler
+        # card viste da meno di MIN_HOURS_GAP → lastSeen
+        self.recently_seen = {
+            cid: s["lastSeen"] for cid, s in self.stats.items() if s.get("lastSeen")
+        }
+
+    # ── Pesca ────────────────────────────────────────────────
+    def _prune_recently_seen(self, now):
+        for cid, seen in list(self.recently_seen.items()):
+            if (now - seen).total_seconds() / 3600 >= MIN_HOURS_GAP:
+                del self.recently_seen[cid]
+
+    def _sync_learned(self, learned_ids):
+        """Allinea le esclusioni del sampler alla lista learned_ids del client."""
+        wanted = {self.index[cid] for cid in learned_ids if cid in self.index}
+        for i in wanted - self.learned:
+            self.sampler.exclude(i)
+        for i in self.learned - wanted:
+            self.sampler.include(i)
+        self.learned = wanted
+
+    def _pick_index(self, recent_ids):
+        """Indice della prossima card (lock già acquisito), o None."""
+        remaining = len(self.ids) - len(self.learned)
+        if remaining == 0:
+            return None
+
+        self._prune_recently_seen(datetime.now())
+        too_recent = {self.index[cid] for cid in self.recently_seen} - self.learned
+
+        # Pesi temporanei: zero per le card viste da meno di MIN_HOURS_GAP
+        # (se restano alternative), RECENT_PENALTY per quelle in recent_ids
+        overrides = {}
+        if len(too_recent) < remaining:
+            overrides = {i: 0.0 for i in too_recent}
+        if remaining > NO_REPEAT_WINDOW:
+            for cid in recent_ids:
+                i = self.index.get(cid)
+                if i is not None and i not in overrides and i not in self.learned:
+                    overrides[i] = self.sampler.weight(i) * RECENT_PENALTY
+
+        with self.sampler.adjusted(overrides):
+            return self.sampler.sample()
+
+    def pick(self, recent_ids=None, learned_ids=None):
+        """
+        Restituisce la prossima card, o None se tutte le card sono
+        già state imparate nella sessione.
+        """
+        cards = self.pick_many(1, recent_ids, learned_ids)
+        return cards[0] if cards else None
+
+    def pick_many(self, count, recent_ids=None, learned_ids=None):
+        """
+        Fino a `count` card distinte nell'ordine di studio: ogni card
+        estratta entra nella finestra recent_ids per le successive.
+        Il testo viene letto dal DB solo per le card estratte.
+        """
+        recent_ids  = [str(x) for x in (recent_ids or [])]
+        learned_ids = set(str(x) for x in (learned_ids or []))
+
+        with self.lock:
+            self.touched = time.monotonic()
+            self._sync_learned(learned_ids)
+            chosen = []
+            for _ in range(count):
+                i = self._pick_index(recent_ids)
+                if i is None:
+                    break
+                chosen.append(self.ids[i])
+                # Esclusa fino alla prossima richiesta, che riallinea learned_ids
+                self.sampler.exclude(i)
+                self.learned.add(i)
+                recent_ids = (recent_ids + [self.ids[i]])[-NO_REPEAT_WINDOW:]
+
+        if not chosen:
+            return []
+        oids  = [ObjectId(cid) for cid in chosen]
+        cards = {c["_id"]: c for c in db.flashcards.find({"_id": {"$in": oids}})}
+        if len(cards) < len(oids):
+            # Card eliminate senza che la sessione lo sapesse: va ricaricata
+            self.stale = True
+        return [cards[oid] for oid in oids if oid in cards]
+
+    # ── Aggiornamento dopo un risultato ──────────────────────
+    def record(self, flashcard_id, result, seen_at=None):
+        cid = str(flashcard_id)
+        with self.lock:
+            if cid not in self.index:
+                return False
+            stats = self.stats[cid]
+            if result == "success":
+                stats["successCount"] = stats.get("successCount", 0) + 1
+            else:
+                stats["failCount"] = stats.get("failCount", 0) + 1
+            seen_at = seen_at or datetime.now()
+            stats["lastSeen"] = max(stats.get("lastSeen") or seen_at, seen_at)
+            self.recently_seen[cid] = stats["lastSeen"]
+            self.sampler.update(self.index[cid], compute_weight(stats, cid, self.user_id))
+            self.local += 1
+            return True
+
+    def current(self, version, answers):
+        """False se la cartella è cambiata o un altro worker ha registrato risultati."""
+        return (not self.stale and version == self.version
+                and answers <= self.answers + self.local)
+
+
+def load_session(user_oid, folder_id):
+    """
+    Carica card e stats dal DB e costruisce la sessione.
+    Restituisce None per cartelle vuote o troppo grandi da tenere in
+    memoria: in quel caso si usa pick_flashcard sulla coda nextDue.
+    """
+    folder_oid = ObjectId(folder_id)
+
+    # Risultati ancora nel buffer: vanno scritti prima di leggere le stats
+    if WRITE_BEHIND:
+        try:
+            buffer.flush()
+        except Exception:
+            traceback.print_exc()
+
+    # Letti prima di card e stats: una scrittura concorrente fa solo ricaricare
+    version, total = folder_counters(folder_oid)
+    if version is None or total > SESSION_MAX_CARDS:
+        return None
+    answers = answer_count(user_oid, folder_oid)
+
+    # Per il punteggio bastano gli _id: front/back non vengono letti
+    card_ids = [c["_id"] for c in db.flashcards.find({"folderId": folder_oid}, {"_id": 1})]
+    if not card_ids:
+        return None
+
+    stats_map = {
+        s["flashcardId"]: s
+        for s in db.flashcardStats.find(
+            {"userId": user_oid, "flashcardId": {"$in": card_ids}},
+            {"flashcardId": 1, "lastSeen": 1, "failCount": 1, "successCount": 1},
+        )
+    }
+    # Stats di default solo in memoria: nessuna scrittura finché la
+    # card non riceve il primo risultato
+    for cid in card_ids:
+        if cid not in stats_map:
+            stats_map[cid] = create_flashcard_stats(user_oid, cid)
+
+    return StudySession(user_oid, folder_id, card_ids, stats_map, version, answers)
+
+
+# ── Cache per worker (LRU + TTL) ─────────────────────────────
+class SessionCache:
+    def __init__(self, maxsize=SESSION_CACHE_SIZE, ttl=SESSION_TTL):
+        self.maxsize  = maxsize
+        self.ttl      = ttl
+        self.sessions = OrderedDict()
+        self.lock     = threading.Lock()
+
+    def _expired(self, session):
+        return time.monotonic() - session.touched > self.ttl
+
+    def get(self, user_oid, folder_id):
+        key = (str(user_oid), str(folder_id))
+        with self.lock:
+            session = self.sessions.get(key)
+            if session is not None and self._expired(session):
+                del self.sessions[key]
+                session = None
+
+        # Sessione ancora valida solo se nessun altro worker ha modificato
+        # la cartella o registrato risultati
+        if session is not None:
+            folder_oid = ObjectId(folder_id)
+            if session.current(folder_version(folder_oid), answer_count(user_oid, folder_oid)):
+                with self.lock:
+                    if key in self.sessions:
+                        self.sessions.move_to_end(key)
+                return session
+
+        session = load_session(user_oid, folder_id)
+        if session is None:
+            return None
+
+        with self.lock:
+            self.sessions[key] = session
+            self.sessions.move_to_end(key)
+            while len(self.sessions) > self.maxsize:
+                self.sessions.popitem(last=False)
+        return session
+
+    def sessions_of(self, user_id):
+        user_id = str(user_id)
+        with self.lock:
+            return [s for (u, _), s in self.sessions.items() if u == user_id]
+
+    def invalidate_folder(self, folder_id):
+        folder_id = str(folder_id)
+        with self.lock:
+            for key in [k for k in self.sessions if k[1] == folder_id]:
+                del self.sessions[key]
+
+
+sessions = SessionCache()
+
+
+def get_session(user_oid, folder_id):
+    return sessions.get(user_oid, folder_id)
+
+
+def pick_from_session(user_oid, folder_id, count, recent_ids=None, learned_ids=None):
+    """
+    Fino a `count` card dalla sessione in cache, oppure None se la cartella
+    non usa una sessione (vuota o troppo grande: si usa la coda nextDue).
+    Se una card estratta è stata eliminata nel frattempo la sessione viene
+    ricaricata e l'estrazione ripetuta, invece di chiudere lo studio.
+    """
+    session = get_session(user_oid, folder_id)
+    if session is None:
+        return None
+    cards = session.pick_many(count, recent_ids, learned_ids)
+    if session.stale:
+        session = get_session(user_oid, folder_id)
+        if session is None:
+            return None
+        cards = session.pick_many(count, recent_ids, learned_ids)
+    return cards
+
+
+def record_result(user_oid, flashcard_id, result, seen_at=None):
+    """
+    Aggiorna sul posto le sessioni in cache che contengono la card.
+    Restituisce l'id della cartella della card se è in cache, altrimenti None.
+    """
+    folder_id = None
+    for session in sessions.sessions_of(user_oid):
+        if session.record(flashcard_id, result, seen_at):
+            folder_id = session.folder_id
+    return folder_id
+
+
+def invalidate_folder(folder_id):
+    """Da chiamare quando le card di una cartella cambiano."""
+    sessions.invalidate_folder(folder_id)
@@ -0,0 +1,206 @@
+# ============================================================
+# services/style_profile.py — Profilo di stile incrementale per cartella
+# ============================================================
+# Lo stile delle card esistenti (usato nel prompt della generazione AI)
+# non richiede di rileggere la cartella: è tenuto aggiornato a ogni
+# scrittura nella collezione styleProfiles (_id = folderId):
+#   counts       {categoria: card il cui front contiene una sua parola chiave}
+#   backLenSum   somma delle lunghezze dei back
+#   cardCount    numero di card
+#   sample       fino a SAMPLE_SIZE card (reservoir sampling)
+#   builtAt      data dell'ultima scansione completa
+# Lo stile è la prima categoria di STYLE_RULES con almeno una card.
+#
+# Il profilo si crea alla prima lettura con una scansione della cartella;
+# da lì in poi le scritture lo aggiornano con $inc, senza upsert. Una
+# scrittura concorrente alla scansione può essere contata due volte o
+# nessuna: alla lettura il profilo viene ricostruito se il suo cardCount
+# non coincide con quello della cartella (aggiornato insieme alla
+# versione, models/folder.py) o se è più vecchio di STYLE_PROFILE_MAX_AGE.
+#
+# Variabili d'ambiente (opzionali):
+#   STYLE_PROFILE_MAX_AGE   secondi dopo i quali il profilo viene ricalcolato
+# ============================================================
+import os
+import random
+from datetime import datetime, timedelta
+
+from db import db
+from models.folder import folder_counters
+
+SAMPLE_SIZE = 4
+MAX_AGE     = int(os.getenv("STYLE_PROFILE_MAX_AGE", 86400))
+
+DEFAULT_STYLE = "domanda diretta con risposta concisa"
+
+# (categoria, parole chiave, descrizione per il prompt) in ordine di priorità
+STYLE_RULES = [
+    ("definition", ["cos'è", "cosa si intende", "definisci", "definizione di"],
+     "definizione di concetti (Cos'è X? → risposta definitoria)"),
+    ("comparison", ["differenza tra", "confronta", " vs ", "versus"],
+     "confronto tra concetti (Differenza tra X e Y? → distinzione chiara)"),
+    ("exercise", ["calcola", "risolvi", "quanto vale", "formula", "equazione"],
+     "esercizio numerico o formula (es: Formula di X? → formula con breve spiegazione)"),
+    ("true_false", ["vero o falso", "true or false"],
+     "vero o falso (Affermazione → Vero/Falso + motivazione breve)"),
+    ("completion", ["completa", "___", "..."],
+     "completamento di frase (Frase incompleta → parola/frase mancante)"),
+    ("causal", ["perché", "spiega perché", "come funziona", "come mai"],
+     "spiegazione causale (Perché X? → spiegazione concisa)"),
+    ("enumeration", ["elenca", "quali sono", "nomina", "cita"],
+     "enumerazione (Quali sono X? → lista puntata breve)"),
+]
+
+
+def length_label(avg):
+    """Lunghezza attesa della risposta dalla lunghezza media dei back."""
+    if avg < 60:
+        return "molto breve (max 1 riga)"
+    if avg < 130:
+        return "breve (1-2 righe)"
+    return "medio (2-4 righe)"
+
+
+def categories(front):
+    # Spazi ai bordi: " vs " conta anche all'inizio o alla fine del front
+    text = f" {(front or '').lower()} "
+    return [cat for cat, keywords, _ in STYLE_RULES if any(k in text for k in keywords)]
+
+
+def _delta(cards, sign):
+    inc = {}
+    for card in cards:
+        for cat in categories(card.get("front")):
+            inc[f"counts.{cat}"] = inc.get(f"counts.{cat}", 0) + sign
+        inc["backLenSum"] = inc.get("backLenSum", 0) + sign * len(card.get("back") or "")
+        inc["cardCount"]  = inc.get("cardCount", 0) + sign
+    return inc
+
+
+def _sample_entry(card):
+    return {"_id": card["_id"], "front": card["front"], "back": card["back"]}
+
+
+# ── Aggiornamenti (services/folder_events.py) ───────────────
+def add_cards(folder_oid, cards):
+    if not cards:
+        return
+    profile = db.styleProfiles.find_one_and_update(
+        {"_id": folder_oid}, {"$inc": _delta(cards, 1)},
+        projection={"cardCount": 1, "sample": 1},
+    )
+    if profile is None:
+        return   # verrà costruito alla prima lettura
+
+    # Reservoir sampling: ogni card resta nel campione con probabilità k/n
+    sample, seen = list(profile.get("sample", [])), profile.get("cardCount", 0)
+    changed = False
+    for card in cards:
+        seen += 1
+        if len(sample) < SAMPLE_SIZE:
+            sample.append(_sample_entry(card))
+            changed = True
+        else:
+            j = random.randrange(seen)
+            if j < SAMPLE_SIZE:
+                sample[j] = _sample_entry(card)
+                changed = True
+    if changed:
+        db.styleProfiles.update_one({"_id": folder_oid}, {"$set": {"sample": sample}})
+
+
+def edit_cards(folder_oid, pairs):
+    """pairs: (card prima, card dopo) con _id, front e back."""
+    if not pairs:
+        return
+    inc = _delta([old for old, _ in pairs], -1)
+    for key, value in _delta([new for _, new in pairs], 1).items():
+        inc[key] = inc.get(key, 0) + value
+    inc = {k: v for k, v in inc.items() if v}
+    if inc:
+        profile = db.styleProfiles.find_one_and_update(
+            {"_id": folder_oid}, {"$inc": inc}, projection={"sample": 1},
+        )
+    else:
+        profile = db.styleProfiles.find_one({"_id": folder_oid}, {"sample": 1})
+    if profile is None:
+        return
+    edited = {new["_id"]: new for _, new in pairs}
+    sample = profile.get("sample", [])
+    if any(s["_id"] in edited for s in sample):
+        sample = [_sample_entry(edited[s["_id"]]) if s["_id"] in edited else s for s in sample]
+        db.styleProfiles.update_one({"_id": folder_oid}, {"$set": {"sample": sample}})
+
+
+def remove_cards(folder_oid, cards):
+    if not cards:
+        return
+    db.styleProfiles.update_one(
+        {"_id": folder_oid},
+        {"$inc": _delta(cards, -1),
+         "$pull": {"sample": {"_id": {"$in": [c["_id"] for c in cards]}}}},
+    )
+
+
+def drop_profile(folder_oid):
+    db.styleProfiles.delete_one({"_id": folder_oid})
+
+
+# ── Lettura ─────────────────────────────────────────────────
+def rebuild_profile(folder_oid):
+    """Ricostruisce il profilo con una scansione delle card della cartella."""
+    counts, back_sum, count, sample = {}, 0, 0, []
+    for card in db.flashcards.find({"folderId": folder_oid}, {"front": 1, "back": 1}):
+        for cat in categories(card.get("front")):
+            counts[cat] = counts.get(cat, 0) + 1
+        back_sum += len(card.get("back") or "")
+        count += 1
+        if len(sample) < SAMPLE_SIZE:
+            sample.append(_sample_entry(card))
+    profile = {"counts": counts, "backLenSum": back_sum, "cardCount": count,
+               "sample": sample, "builtAt": datetime.now()}
+    db.styleProfiles.replace_one({"_id": folder_oid}, profile, upsert=True)
+    return profile
+
+
+def _refill_sample(folder_oid, profile):
+    # Dopo delle cancellazioni il campione può scendere sotto SAMPLE_SIZE
+    missing = min(SAMPLE_SIZE, profile["cardCount"]) - len(profile["sample"])
+    if missing <= 0:
+        return profile["sample"]
+    have  = [s["_id"] for s in profile["sample"]]
+    extra = db.flashcards.find(
+        {"folderId": folder_oid, "_id": {"$nin": have}}, {"front": 1, "back": 1}
+    ).limit(missing)
+    sample = profile["sample"] + [_sample_entry(c) for c in extra]
+    db.styleProfiles.update_one({"_id": folder_oid}, {"$set": {"sample": sample}})
+    return sample
+
+
+def _stale(profile, card_count):
+    if profile is None or profile.get("cardCount") != card_count:
+        return True
+    built = profile.get("builtAt")
+    return built is None or built < datetime.now() - timedelta(seconds=MAX_AGE)
+
+
+def folder_style(folder_oid):
+    """Stile, lunghezza attesa ed esempi delle card della cartella, letti dal profilo."""
+    profile = db.styleProfiles.find_one({"_id": folder_oid})
+    _, card_count = folder_counters(folder_oid)
+    if _stale(profile, card_count):
+        profile = rebuild_profile(folder_oid)
+    if profile["cardCount"] <= 0:
+        return {"style": DEFAULT_STYLE, "length": "breve (1-2 righe)", "sample": []}
+
+    counts = profile.get("counts", {})
+    style  = next(
+        (description for cat, _, description in STYLE_RULES if counts.get(cat, 0) > 0),
+        DEFAULT_STYLE,
+    )
+    sample = _refill_sample(folder_oid, profile)
+    return {
+        "style":  style,
+        "length": length_label(profile["backLenSum"] / profile["cardCount"]),
+        "sample": [{"front": s["front"], "back": s["back"]} for s in sample],
+    }
@@ -0,0 +1,17 @@
+# ============================================================
+# conftest.py — Fixture condivise
+# ============================================================
+# mongo: database in memoria (mongomock) al posto del client del
+# processo; i test che lo usano vengono saltati se mongomock manca.
+# ============================================================
+import pytest
+
+import db as db_module
+
+
+@pytest.fixture
+def mongo(monkeypatch):
+    mongomock = pytest.importorskip("mongomock")
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(db_module, "get_client", lambda: client)
+    return client[db_module.DB_NAME]
@@ -0,0 +1,38 @@
+# ============================================================
+# test_ai_stream.py — Errori durante la generazione in streaming
+# ============================================================
+# Solo gli errori del client LLM diventano "Errore API Groq"; quelli
+# di chi consuma i pezzi (es. insert nel DB) devono arrivare intatti.
+# ============================================================
+import pytest
+from pymongo.errors import AutoReconnect
+
+from routes.ai import llm_chunks
+from services.ai_jobs import JobFailed
+
+
+class BrokenClient:
+    model = "broken"
+
+    def stream(self, messages, **opts):
+        yield "[{"
+        raise ConnectionError("timeout")
+
+
+class FixedClient:
+    model = "fixed"
+
+    def stream(self, messages, **opts):
+        yield '[{"front": "a", "back": "b"}]'
+
+
+def test_client_errors_become_job_failed():
+    with pytest.raises(JobFailed) as info:
+        list(llm_chunks(BrokenClient(), []))
+    assert info.value.message == "Errore API Groq: timeout"
+
+
+def test_consumer_errors_pass_through():
+    with pytest.raises(AutoReconnect):
+        for _ in llm_chunks(FixedClient(), []):
+            raise AutoReconnect("insert fallito")
@@ -0,0 +1,41 @@
+# ============================================================
+# test_flashcards_batch.py — /batch con card eliminate nel frattempo
+# ============================================================
+# Una card eliminata da un'altra richiesta tra la find e il bulk_write
+# non deve risultare aggiornata o eliminata da /batch.
+# ============================================================
+from bson import ObjectId
+
+from routes.flashcards import lost_since_find
+
+
+def batch_state(ops):
+    """(results, pending) come li costruisce /batch per update e delete."""
+    results = [{"status": status, "id": cid} for status, cid in ops]
+    pending = [(i, {}, None) for i in range(len(ops))]
+    return results, pending
+
+
+def test_counts_match(mongo):
+    folder = ObjectId()
+    cards  = [mongo.flashcards.insert_one({"folderId": folder}).inserted_id for _ in range(2)]
+    results, pending = batch_state([("updated", cards[0]), ("deleted", cards[1])])
+    lost_since_find(folder, results, pending, matched=1, removed=1)
+    assert [r["status"] for r in results] == ["updated", "deleted"]
+
+
+def test_update_of_deleted_card(mongo):
+    folder = ObjectId()
+    kept   = mongo.flashcards.insert_one({"folderId": folder}).inserted_id
+    gone   = ObjectId()
+    results, pending = batch_state([("updated", gone), ("updated", kept)])
+    lost_since_find(folder, results, pending, matched=1, removed=0)
+    assert [r["status"] for r in results] == ["not_found", "updated"]
+
+
+def test_delete_of_deleted_card(mongo):
+    folder = ObjectId()
+    results, pending = batch_state([("deleted", ObjectId()), ("deleted", ObjectId())])
+    lost_since_find(folder, results, pending, matched=0, removed=1)
+    assert [r["status"] for r in results].count("deleted") == 1
+    assert [r["status"] for r in results].count("not_found") == 1
@@ -0,0 +1,26 @@
+# ============================================================
+# test_folder_events.py — Scritture in cartelle eliminate
+# ============================================================
+# Un worker con la cartella ancora in cache può inserire card dopo che
+# un altro l'ha eliminata: cards_written deve accorgersene e rimuoverle.
+# ============================================================
+from bson import ObjectId
+
+from services.folder_events import cards_written
+
+
+def test_cards_written_in_deleted_folder(mongo):
+    folder = ObjectId()   # cartella già eliminata
+    card   = {"folderId": folder, "front": "Cos'è X?", "back": "Y"}
+    card["_id"] = mongo.flashcards.insert_one(card).inserted_id
+
+    assert cards_written(folder, added=[card]) is None
+    assert mongo.flashcards.count_documents({"folderId": folder}) == 0
+    assert mongo.cardSignatures.count_documents({"folderId": folder}) == 0
+    assert mongo.styleProfiles.count_documents({}) == 0
+
+
+def test_cards_written_bumps_version(mongo):
+    folder = mongo.folders.insert_one({"version": 3, "cardCount": 0}).inserted_id
+    assert cards_written(folder) == 4
+    assert mongo.folders.find_one({"_id": folder})["cardCount"] == 0
@@ -0,0 +1,70 @@
+# ============================================================
+# test_json_stream.py — ArrayStreamParser su output del modello
+# ============================================================
+# Il testo arriva dal modello: va letto qualunque sia il punto in cui
+# viene spezzato, con fence prima dell'array e stringhe che contengono
+# virgolette, graffe e parentesi.
+# ============================================================
+import json
+import random
+
+import pytest
+
+from services.json_stream import ArrayStreamParser
+
+CARDS = [
+    {"front": "Cos'è una \"closure\"?", "back": "Una funzione con il suo ambiente {x}."},
+    {"front": "Parentesi: [ ] { } e \\ backslash", "back": "Chiusa \\\" e ancora } ]"},
+    {"front": "Annidato", "back": "ok", "meta": {"tags": ["a", {"b": [1, 2]}], "n": None}},
+    {"front": "Unicode è ok ✓", "back": "è\n\t"},
+]
+TEXT = "```json\n" + json.dumps(CARDS, ensure_ascii=False, indent=2) + "\n```\nFine."
+
+
+def parse(chunks):
+    parser, items = ArrayStreamParser(), []
+    for chunk in chunks:
+        items += parser.feed(chunk)
+    return parser, items
+
+
+def test_whole_text_with_fences():
+    parser, items = parse([TEXT])
+    assert items == CARDS
+    assert parser.done
+
+
+def test_one_char_at_a_time():
+    _, items = parse(TEXT)
+    assert items == CARDS
+
+
+def test_random_splits():
+    rng = random.Random(7)
+    for _ in range(200):
+        cuts   = sorted(rng.sample(range(1, len(TEXT)), rng.randint(1, 40)))
+        chunks = [TEXT[a:b] for a, b in zip([0] + cuts, cuts + [len(TEXT)])]
+        assert parse(chunks)[1] == CARDS
+
+
+def test_items_arrive_before_the_end():
+    head, tail = TEXT.split('"Annidato"')
+    parser, items = parse([head])
+    assert items == CARDS[:2]
+    assert not parser.done
+    assert parser.feed('"Annidato"' + tail) == CARDS[2:]
+
+
+def test_text_after_array_ignored():
+    _, items = parse(['[{"front": "a", "back": "b"}] [{"front": "c", "back": "d"}]'])
+    assert items == [{"front": "a", "back": "b"}]
+
+
+def test_string_in_array_rejected():
+    with pytest.raises(ValueError):
+        parse(['["front", "back"]'])
+
+
+def test_invalid_object_rejected():
+    with pytest.raises(ValueError):
+        parse(['[{"front": "a" "back": "b"}]'])
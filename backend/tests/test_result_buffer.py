@@ -0,0 +1,77 @@
+# ============================================================
+# test_result_buffer.py — Scritture parziali dei risultati
+# ============================================================
+# Un BulkWriteError con ordered=False arriva dopo che le altre
+# operazioni sono state applicate: vanno riprovati solo i risultati
+# delle operazioni fallite.
+# ============================================================
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+from services import result_buffer, scheduler
+from services.result_buffer import ResultBuffer
+from services.scheduler import ResultsNotWritten, record_results
+
+NOW = datetime(2026, 3, 14, 15, 9, 26)
+
+
+def failing_bulk_write(failed, upserted):
+    def bulk_write(self, ops, ordered=True):
+        raise BulkWriteError({
+            "writeErrors": [{"index": i, "code": 11000, "errmsg": "E11000"} for i in failed],
+            "upserted": [{"index": i, "_id": ObjectId()} for i in upserted],
+        })
+    return bulk_write
+
+
+def test_record_results_reports_only_failed(mongo, monkeypatch):
+    user, folder = ObjectId(), ObjectId()
+    cards = [str(ObjectId()) for _ in range(3)]
+    results = [
+        (user, cards[0], "fail", NOW, folder),
+        (user, cards[1], "success", NOW, folder),
+        (user, cards[2], "fail", NOW, folder),
+        (user, cards[1], "fail", NOW, folder),
+    ]
+    counted = []
+    monkeypatch.setattr(scheduler, "add_seen",
+                        lambda seen, answers=None: counted.append((seen, answers)))
+    monkeypatch.setattr(type(mongo.flashcardStats), "bulk_write", failing_bulk_write([1], [0, 2]))
+
+    with pytest.raises(ResultsNotWritten) as info:
+        record_results(results)
+    # Entrambi i risultati della card fusa nell'operazione 1, nell'ordine
+    assert info.value.results == [results[1], results[3]]
+    # Le righe create dalle operazioni riuscite sono già contate
+    assert counted == [({(user, folder): 2}, {(user, folder): 2})]
+
+
+def test_flush_requeues_only_failed(monkeypatch):
+    results = [(ObjectId(), str(ObjectId()), "fail", NOW, None) for _ in range(3)]
+
+    def record(batch):
+        raise ResultsNotWritten(batch[1:2])
+
+    monkeypatch.setattr(result_buffer, "record_results", record)
+    buffer = ResultBuffer(flush_size=100, flush_interval=60)
+    buffer.pending = list(results)
+    with pytest.raises(ResultsNotWritten):
+        buffer.flush()
+    assert buffer.pending == [results[1]]
+
+
+def test_flush_requeues_batch_on_other_errors(monkeypatch):
+    results = [(ObjectId(), str(ObjectId()), "fail", NOW, None) for _ in range(3)]
+
+    def record(batch):
+        raise ConnectionError("DB non raggiungibile")
+
+    monkeypatch.setattr(result_buffer, "record_results", record)
+    buffer = ResultBuffer(flush_size=100, flush_interval=60)
+    buffer.pending = list(results)
+    with pytest.raises(ConnectionError):
+        buffer.flush()
+    assert buffer.pending == results
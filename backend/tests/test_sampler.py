@@ -0,0 +1,133 @@
+# ============================================================
+# test_sampler.py — WeightedSampler contro random.choices
+# ============================================================
+import random
+from collections import Counter
+
+import pytest
+
+from services.sampler import WeightedSampler
+
+WEIGHTS = [1.0, 2.0, 3.0, 0.0, 4.0, 10.0, 0.5]
+DRAWS   = 40000
+
+
+def frequencies(draw, n):
+    counts = Counter(draw() for _ in range(DRAWS))
+    return [counts[i] / DRAWS for i in range(n)]
+
+
+def expected(weights):
+    total = sum(weights)
+    return [w / total for w in weights]
+
+
+def sampler_freq(sampler, seed=1):
+    rng = random.Random(seed)
+    return frequencies(lambda: sampler.sample(rng), len(sampler))
+
+
+def choices_freq(weights, seed=2):
+    rng = random.Random(seed)
+    idx = list(range(len(weights)))
+    return frequencies(lambda: rng.choices(idx, weights=weights, k=1)[0], len(weights))
+
+
+def test_distribution_matches_random_choices():
+    got  = sampler_freq(WeightedSampler(WEIGHTS))
+    ref  = choices_freq(WEIGHTS)
+    want = expected(WEIGHTS)
+    assert got[3] == 0.0
+    for g, r, w in zip(got, ref, want):
+        assert g == pytest.approx(w, abs=0.01)
+        assert g == pytest.approx(r, abs=0.015)
+
+
+def test_update():
+    sampler = WeightedSampler(WEIGHTS)
+    sampler.update(5, 0.0)
+    sampler.update(3, 6.0)
+    weights = list(WEIGHTS)
+    weights[5], weights[3] = 0.0, 6.0
+    assert sampler.weight(3) == 6.0
+    got = sampler_freq(sampler)
+    assert got[5] == 0.0
+    for g, r in zip(got, choices_freq(weights)):
+        assert g == pytest.approx(r, abs=0.015)
+
+
+def test_many_updates_rebuild():
+    # Più di n aggiornamenti fanno ricostruire l'albero
+    sampler = WeightedSampler(WEIGHTS)
+    rng = random.Random(5)
+    weights = list(WEIGHTS)
+    for _ in range(10 * len(WEIGHTS)):
+        i = rng.randrange(len(weights))
+        weights[i] = rng.uniform(0.1, 5.0)
+        sampler.update(i, weights[i])
+    for g, w in zip(sampler_freq(sampler), expected(weights)):
+        assert g == pytest.approx(w, abs=0.01)
+
+
+def test_exclude_and_include():
+    sampler = WeightedSampler(WEIGHTS)
+    sampler.exclude(5)
+    sampler.exclude(2)
+    got = sampler_freq(sampler)
+    assert got[5] == 0.0 and got[2] == 0.0
+    weights = [0.0 if i in (2, 5) else w for i, w in enumerate(WEIGHTS)]
+    for g, w in zip(got, expected(weights)):
+        assert g == pytest.approx(w, abs=0.01)
+
+    # Un peso aggiornato mentre la card è esclusa vale al rientro
+    sampler.update(5, 1.0)
+    sampler.include(5)
+    sampler.include(2)
+    weights = list(WEIGHTS)
+    weights[5] = 1.0
+    for g, w in zip(sampler_freq(sampler), expected(weights)):
+        assert g == pytest.approx(w, abs=0.01)
+
+
+def test_adjusted_restores_weights():
+    sampler = WeightedSampler(WEIGHTS)
+    with sampler.adjusted({5: 0.0, 0: 20.0}):
+        got = sampler_freq(sampler)
+        assert got[5] == 0.0
+        weights = list(WEIGHTS)
+        weights[5], weights[0] = 0.0, 20.0
+        for g, w in zip(got, expected(weights)):
+            assert g == pytest.approx(w, abs=0.01)
+
+    assert sampler.weight(5) == WEIGHTS[5]
+    for g, w in zip(sampler_freq(sampler), expected(WEIGHTS)):
+        assert g == pytest.approx(w, abs=0.01)
+
+
+def test_adjusted_keeps_exclusions():
+    sampler = WeightedSampler(WEIGHTS)
+    sampler.exclude(5)
+    sampler_freq(sampler)            # la card 5 esce dall'albero
+    with sampler.adjusted({5: 50.0}):
+        assert sampler_freq(sampler)[5] == 0.0
+    assert sampler_freq(sampler)[5] == 0.0
+
+
+def test_empty():
+    sampler = WeightedSampler([])
+    assert len(sampler) == 0
+    assert sampler.sample(random.Random(0)) is None
+
+
+def test_all_zero():
+    assert WeightedSampler([0.0, 0.0]).sample(random.Random(0)) is None
+
+
+def test_all_excluded():
+    sampler = WeightedSampler(WEIGHTS)
+    for i in range(len(WEIGHTS)):
+        sampler.exclude(i)
+    assert sampler.sample(random.Random(0)) is None
+    sampler.include(4)
+    rng = random.Random(0)
+    assert {sampler.sample(rng) for _ in range(100)} == {4}
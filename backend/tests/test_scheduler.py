@@ -0,0 +1,200 @@
+# ============================================================
+# test_scheduler.py — compute_weights contro compute_weight
+# ============================================================
+# La versione vettoriale deve dare gli stessi pesi di quella scalare
+# a parità di "adesso": il tempo viene congelato sostituendo datetime
+# nel modulo scheduler.
+# ============================================================
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+from bson import ObjectId
+
+from services import scheduler
+from services.scheduler import (
+    DUE_TOP_K, MIN_HOURS_GAP, NO_REPEAT_WINDOW,
+    compute_weight, compute_weights, hours_since, next_due, penalize_recent,
+    pick_flashcards,
+)
+
+NOW  = datetime(2026, 3, 14, 15, 9, 26)
+USER = str(ObjectId())
+
+
+class FrozenDatetime(datetime):
+    @classmethod
+    def now(cls, tz=None):
+        return NOW
+
+
+@pytest.fixture(autouse=True)
+def frozen_now(monkeypatch):
+    monkeypatch.setattr(scheduler, "datetime", FrozenDatetime)
+
+
+def stats(last_seen=None, fails=0, successes=0):
+    return {"lastSeen": last_seen, "failCount": fails, "successCount": successes}
+
+
+def sample_deck():
+    rows = [
+        stats(),                                                    # mai vista
+        stats(),
+        stats(NOW - timedelta(hours=5)),
+        stats(NOW - timedelta(hours=30), fails=3),
+        stats(NOW - timedelta(hours=2), fails=1, successes=1),
+        stats(NOW - timedelta(minutes=1), successes=10),            # clamp a 0.5
+        stats(NOW - timedelta(minutes=3)),                          # < MIN_HOURS_GAP
+        stats(NOW + timedelta(hours=1)),                            # orologio avanti
+        {"lastSeen": NOW - timedelta(days=9)},                      # contatori assenti
+    ]
+    return rows, [str(ObjectId()) for _ in rows]
+
+
+def scalar_weights(rows, ids):
+    return np.array([compute_weight(s, cid, USER) for s, cid in zip(rows, ids)])
+
+
+def test_weights_match_scalar():
+    rows, ids = sample_deck()
+    weights, _ = compute_weights(rows, ids, USER, now=NOW)
+    np.testing.assert_allclose(weights, scalar_weights(rows, ids), rtol=1e-12)
+
+
+def test_default_now_matches_frozen_clock():
+    rows, ids = sample_deck()
+    np.testing.assert_allclose(
+        compute_weights(rows, ids, USER)[0], compute_weights(rows, ids, USER, now=NOW)[0]
+    )
+
+
+def test_unseen_rows():
+    rows, ids = sample_deck()
+    weights, hours = compute_weights(rows, ids, USER, now=NOW)
+    assert np.isnan(hours[:2]).all()
+    assert not np.isnan(hours[2:]).any()
+    # UNSEEN_BONUS con jitter in [0.85, 1.15]
+    assert ((weights[:2] >= 170) & (weights[:2] <= 230)).all()
+
+
+def test_clamp_lower_bound():
+    rows = [stats(NOW - timedelta(minutes=1), successes=s) for s in (1, 10, 100)]
+    ids  = [str(ObjectId()) for _ in rows]
+    weights, _ = compute_weights(rows, ids, USER, now=NOW)
+    np.testing.assert_allclose(weights, scalar_weights(rows, ids), rtol=1e-12)
+    assert (weights <= 0.5 * 1.15).all()
+    assert (weights >= 0.5 * 0.85).all()
+
+
+def test_hours_match_scalar():
+    rows, ids = sample_deck()
+    _, hours = compute_weights(rows, ids, USER, now=NOW)
+    expected = [hours_since(s.get("lastSeen")) for s in rows]
+    for got, want in zip(hours, expected):
+        if want is None:
+            assert np.isnan(got)
+        else:
+            assert got == pytest.approx(want)
+
+
+def test_min_hours_gap_filter():
+    rows, ids = sample_deck()
+    _, hours = compute_weights(rows, ids, USER, now=NOW)
+    too_recent = hours < MIN_HOURS_GAP        # NaN (mai viste) → False
+    expected = [
+        h is not None and h < MIN_HOURS_GAP
+        for h in (hours_since(s.get("lastSeen")) for s in rows)
+    ]
+    assert too_recent.tolist() == expected
+    assert too_recent[5] and too_recent[6] and too_recent[7]
+    assert not too_recent[:2].any()
+
+
+def test_penalize_recent():
+    rows, ids = sample_deck()
+    weights, _ = compute_weights(rows, ids, USER, now=NOW)
+    recent = [ids[0], ids[3]]
+
+    penalized = penalize_recent(weights, ids, recent, pool_size=len(ids))
+    expected = scalar_weights(rows, ids)
+    expected[[0, 3]] *= 0.05
+    np.testing.assert_allclose(penalized, expected, rtol=1e-12)
+    # L'array di partenza non viene modificato
+    np.testing.assert_allclose(weights, scalar_weights(rows, ids), rtol=1e-12)
+
+
+def test_penalize_recent_small_pool():
+    rows, ids = sample_deck()
+    weights, _ = compute_weights(rows, ids, USER, now=NOW)
+    same = penalize_recent(weights, ids, [ids[0]], pool_size=NO_REPEAT_WINDOW)
+    np.testing.assert_array_equal(same, weights)
+
+
+# ── Coda nextDue e campione di card mai viste (mongomock) ────
+def oid_at(when, i):
+    """ObjectId con il timestamp di `when`: card create nello stesso blocco."""
+    return ObjectId(int(when.timestamp()).to_bytes(4, "big") + i.to_bytes(8, "big"))
+
+
+def add_folder(mongo, card_ids):
+    folder = mongo.folders.insert_one({"version": 0, "cardCount": len(card_ids)}).inserted_id
+    mongo.flashcards.insert_many(
+        [{"_id": cid, "folderId": folder, "front": f"f{n}", "back": "b"}
+         for n, cid in enumerate(card_ids)]
+    )
+    return folder
+
+
+def add_seen_rows(mongo, user, folder, card_ids, last_seen, fails=0):
+    rows = []
+    for cid in card_ids:
+        row = {"userId": user, "flashcardId": cid, "folderId": folder,
+               "lastSeen": last_seen, "failCount": fails, "successCount": 0}
+        row["nextDue"] = next_due(row)
+        rows.append(row)
+    mongo.flashcardStats.insert_many(rows)
+    mongo.studyProgress.update_one(
+        {"userId": user, "folderId": folder}, {"$inc": {"seen": len(rows)}}, upsert=True
+    )
+
+
+def test_unseen_sample_with_clustered_ids(mongo):
+    # 3000 card importate insieme, 10 aggiunte un mese dopo; l'utente ha
+    # visto le ultime 10 e le prime 50: quasi tutto l'intervallo di _id
+    # è il vuoto tra i due blocchi
+    imported = [oid_at(NOW - timedelta(days=40), i) for i in range(3000)]
+    added    = [oid_at(NOW - timedelta(days=10), i) for i in range(10)]
+    user     = ObjectId()
+    folder   = add_folder(mongo, imported + added)
+    add_seen_rows(mongo, user, folder, added + imported[:50], NOW - timedelta(days=1))
+    seen = set(added + imported[:50])
+
+    for _ in range(50):
+        count, ids = scheduler._unseen_candidates(user, folder, 3010, set(), DUE_TOP_K)
+        assert count == 2950
+        assert ids
+        assert not seen & set(ids)
+
+
+def test_recent_cards_do_not_hide_older_ones(mongo):
+    # DUE_TOP_K card appena sbagliate più volte hanno nextDue più basso di
+    # quelle viste ieri: devono comunque essere scelte le card di ieri
+    cards  = [ObjectId() for _ in range(DUE_TOP_K + 5)]
+    user   = ObjectId()
+    folder = add_folder(mongo, cards)
+    recent, older = cards[:DUE_TOP_K], cards[DUE_TOP_K:]
+    add_seen_rows(mongo, user, folder, recent, NOW - timedelta(minutes=1), fails=10)
+    add_seen_rows(mongo, user, folder, older, NOW - timedelta(days=1))
+
+    for _ in range(20):
+        picked = pick_flashcards(user, str(folder), 3)
+        assert {c["_id"] for c in picked} <= set(older)
+
+
+def test_recent_cards_as_fallback(mongo):
+    cards  = [ObjectId() for _ in range(5)]
+    user   = ObjectId()
+    folder = add_folder(mongo, cards)
+    add_seen_rows(mongo, user, folder, cards, NOW - timedelta(minutes=1))
+    assert len(pick_flashcards(user, str(folder), 2)) == 2
@@ -0,0 +1,71 @@
+# ============================================================
+# test_study_session.py — Validità delle sessioni in cache
+# ============================================================
+# Due SessionCache sullo stesso DB fanno la parte di due worker: i
+# risultati registrati dall'altro worker (contatore answers di
+# studyProgress) devono far ricaricare la sessione, quelli registrati
+# in locale no.
+# ============================================================
+from datetime import datetime
+
+from bson import ObjectId
+
+from services.study_session import SessionCache
+
+
+def setup_folder(mongo, n=3):
+    cards  = [ObjectId() for _ in range(n)]
+    folder = mongo.folders.insert_one({"version": 0, "cardCount": n}).inserted_id
+    mongo.flashcards.insert_many(
+        [{"_id": cid, "folderId": folder, "front": "f", "back": "b"} for cid in cards]
+    )
+    return folder, cards
+
+
+def write_result(mongo, user, folder, card):
+    """La scrittura di un risultato come la farebbe record_results."""
+    mongo.flashcardStats.update_one(
+        {"userId": user, "flashcardId": card},
+        {"$set": {"folderId": folder, "lastSeen": datetime.now(), "nextDue": datetime.now()},
+         "$inc": {"failCount": 1}},
+        upsert=True,
+    )
+    mongo.studyProgress.update_one(
+        {"userId": user, "folderId": folder}, {"$inc": {"answers": 1}}, upsert=True
+    )
+
+
+def test_local_results_keep_session(mongo):
+    folder, cards = setup_folder(mongo)
+    user  = ObjectId()
+    cache = SessionCache()
+    session = cache.get(user, str(folder))
+
+    assert session.record(cards[0], "fail")
+    write_result(mongo, user, folder, cards[0])
+    assert cache.get(user, str(folder)) is session
+
+
+def test_results_from_other_worker_reload_session(mongo):
+    folder, cards = setup_folder(mongo)
+    user  = ObjectId()
+    cache = SessionCache()
+    session = cache.get(user, str(folder))
+    assert session.stats[str(cards[1])].get("failCount", 0) == 0
+
+    # Risultato registrato da un altro worker: questa sessione non lo conosce
+    write_result(mongo, user, folder, cards[1])
+    reloaded = cache.get(user, str(folder))
+    assert reloaded is not session
+    assert reloaded.stats[str(cards[1])]["failCount"] == 1
+    assert cache.get(user, str(folder)) is reloaded
+
+
+def test_pending_local_results_do_not_reload(mongo):
+    # Scrittura differita: il risultato locale non è ancora nel DB
+    folder, cards = setup_folder(mongo)
+    user  = ObjectId()
+    cache = SessionCache()
+    session = cache.get(user, str(folder))
+    assert session.record(cards[0], "success")
+    assert cache.get(user, str(folder)) is session
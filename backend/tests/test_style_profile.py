@@ -0,0 +1,65 @@
+# ============================================================
+# test_style_profile.py — Profilo incrementale contro una scansione
+# ============================================================
+# Dopo aggiunte, modifiche ed eliminazioni il profilo aggiornato con
+# $inc deve coincidere con quello ricostruito da zero.
+# ============================================================
+from datetime import datetime
+
+from bson import ObjectId
+
+from models.folder import touch_folder
+from services.style_profile import (
+    add_cards, edit_cards, folder_style, rebuild_profile, remove_cards,
+)
+
+FRONTS = [
+    "Cos'è la fotosintesi?", "Differenza tra mitosi e meiosi", "Calcola l'area del cerchio",
+    "Vero o falso: il sole è una stella", "Perché il cielo è blu?", "Elenca i pianeti",
+    "Capitale della Francia", "React vs Vue",
+]
+
+
+def card(folder, front, back="Risposta"):
+    return {"_id": ObjectId(), "folderId": folder, "front": front, "back": back,
+            "createdAt": datetime.now()}
+
+
+def profile_counts(profile):
+    return ({k: v for k, v in profile["counts"].items() if v},
+            profile["backLenSum"], profile["cardCount"])
+
+
+def test_incremental_profile_matches_rescan(mongo):
+    folder = mongo.folders.insert_one({"version": 0, "cardCount": 0}).inserted_id
+    cards  = [card(folder, f, "x" * (20 * i)) for i, f in enumerate(FRONTS[:4])]
+    mongo.flashcards.insert_many(cards)
+    touch_folder(folder, len(cards))
+    folder_style(folder)   # prima lettura: scansione completa
+
+    # Aggiunte
+    added = [card(folder, f, "y" * 200) for f in FRONTS[4:]]
+    mongo.flashcards.insert_many(added)
+    add_cards(folder, added)
+    touch_folder(folder, len(added))
+
+    # Modifiche: cambia la categoria del front e la lunghezza del back
+    old = cards[0]
+    new = {**old, "front": "Quali sono i numeri primi?", "back": "2, 3, 5, 7"}
+    mongo.flashcards.replace_one({"_id": old["_id"]}, new)
+    edit_cards(folder, [(old, new)])
+
+    # Eliminazioni
+    gone = [cards[1], added[0]]
+    mongo.flashcards.delete_many({"_id": {"$in": [c["_id"] for c in gone]}})
+    remove_cards(folder, gone)
+    touch_folder(folder, -len(gone))
+
+    incremental = mongo.styleProfiles.find_one({"_id": folder})
+    style       = folder_style(folder)
+    assert mongo.styleProfiles.find_one({"_id": folder})["builtAt"] == incremental["builtAt"]
+
+    rescan = rebuild_profile(folder)
+    assert profile_counts(incremental) == profile_counts(rescan)
+    assert folder_style(folder)["style"] == style["style"]
+    assert folder_style(folder)["length"] == style["length"]
@@ -32,10 +32,13 @@ export const deleteFolder  = (id)   => apiFetch(`/folders/${id}`, { method: "DEL
 export const joinFolder = (code) => apiFetch("/folders/join", { method: "POST", body: JSON.stringify({ code }) });
 
 // ── Flashcard ─────────────────────────────────────────────────
-export const getFlashcards    = (folderId)          => apiFetch(`/flashcards/${folderId}`);
+// fields: campi da restituire (es. ["_id"]), default documento intero
+export const getFlashcards    = (folderId, fields)  => apiFetch(`/flashcards/${folderId}${fields ? `?fields=${fields.join(",")}` : ""}`);
 export const createFlashcard  = (folderId, front, back) => apiFetch("/folders/flashcard", { method: "POST", body: JSON.stringify({ folder_id: folderId, front, back }) });
 export const updateFlashcard  = (cardId, front, back)   => apiFetch(`/flashcards/${cardId}`, { method: "PUT",  body: JSON.stringify({ front, back }) });
 export const deleteFlashcard  = (cardId)                => apiFetch(`/flashcards/${cardId}`, { method: "DELETE" });
+// operations: [{ op: "create"|"update"|"delete", id?, front?, back? }] → { results, summary }
+export const batchFlashcards  = (folderId, operations)  => apiFetch(`/flashcards/${folderId}/batch`, { method: "POST", body: JSON.stringify({ operations }) });
 
 // ── Studio ────────────────────────────────────────────────────
 export const fetchNextCard = (folderId, recentIds = [], learnedIds = []) =>
@@ -47,8 +50,52 @@ export const recordResult = (flashcardId, result) =>
 // ── AI Generation ─────────────────────────────────────────────
 // Genera flashcard automaticamente con Groq + Llama 3
 // count: numero di card da generare (default 5, max 10)
-export const generateFlashcards = (folderId, topic, count = 5) =>
-  apiFetch("/ai/generate", {
+// Il backend crea un job: si interroga /ai/jobs/<id> finché non termina
+const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+export async function generateFlashcards(folderId, topic, count = 5) {
+  const { job_id } = await apiFetch("/ai/generate", {
     method: "POST",
     body: JSON.stringify({ folder_id: folderId, topic, count }),
-  });
\ No newline at end of file
+  });
+  for (;;) {
+    await sleep(1000);
+    const job = await apiFetch(`/ai/jobs/${job_id}`);
+    if (job.status === "done")  return job;
+    if (job.status === "error") throw new Error(job.error);
+  }
+}
+
+// Variante in streaming: onCard(card) viene chiamata per ogni card appena
+// salvata; restituisce { generated, count, style_detected } come sopra
+export async function streamFlashcards(folderId, topic, count = 5, onCard = () => {}) {
+  const res = await fetch(`${BASE_URL}/ai/generate?stream=ndjson`, {
+    method: "POST",
+    headers: authHeaders(),
+    body: JSON.stringify({ folder_id: folderId, topic, count }),
+  });
+  if (!res.ok) {
+    const data = await res.json().catch(() => ({}));
+    throw new Error(data.error || "Errore sconosciuto");
+  }
+
+  const reader    = res.body.getReader();
+  const decoder   = new TextDecoder();
+  const generated = [];
+  let buffer = "";
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    const lines = buffer.split("\n");
+    buffer = lines.pop();
+    for (const line of lines) {
+      if (!line.trim()) continue;
+      const event = JSON.parse(line);
+      if (event.type === "card")  { generated.push(event.card); onCard(event.card); }
+      if (event.type === "error") throw new Error(event.error);
+      if (event.type === "done")  return { generated, count: event.count, style_detected: event.style_detected };
+    }
+  }
+  throw new Error("Generazione interrotta");
+}
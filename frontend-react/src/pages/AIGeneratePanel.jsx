@@ -1,8 +1,12 @@
 import { useState } from "react";
-import { generateFlashcards } from "../api";
+import { generateFlashcards, streamFlashcards } from "../api";
 
 const COUNT_OPTIONS = [3, 5, 8, 10];
 
+// Lo streaming occupa un thread del backend per tutta la generazione:
+// va attivato (VITE_AI_STREAMING=1) solo con worker gunicorn a thread
+const AI_STREAMING = import.meta.env.VITE_AI_STREAMING === "1";
+
 const progressCSS = `
 @keyframes progressPulse {
   0%   { transform: translateX(-100%); }
@@ -25,7 +29,11 @@ export default function AIGeneratePanel({ folderId, onSaved }) {
     if (!topic.trim()) return;
     setLoading(true); setError(""); setOk(""); setPreview([]);
     try {
-      const res = await generateFlashcards(folderId, topic.trim(), count);
+      // In streaming le card compaiono nell'anteprima man mano che vengono salvate
+      const res = AI_STREAMING
+        ? await streamFlashcards(folderId, topic.trim(), count,
+            (card) => setPreview((prev) => [...prev, card]))
+        : await generateFlashcards(folderId, topic.trim(), count);
       setPreview(res.generated ?? []);
       setStyle(res.style_detected ?? "");
       setOk(`✦ ${res.count} flashcard generate con stile "${res.style_detected}"`);
@@ -156,7 +164,7 @@ export default function AIGeneratePanel({ folderId, onSaved }) {
             )}
 
             {/* Preview */}
-            {preview.length > 0 && !loading && (
+            {preview.length > 0 && (
               <div className="fade-in">
                 <div style={{ fontSize: 13, fontWeight: 700, color: "var(--muted)", marginBottom: 12, marginTop: 8 }}>
                   {preview.length} flashcard generate — già salvate
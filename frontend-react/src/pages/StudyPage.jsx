@@ -25,7 +25,7 @@ export default function StudyPage() {
   async function initSession() {
     setLoading(true); setError("");
     try {
-      const data = await getFlashcards(id);
+      const data = await getFlashcards(id, ["_id"]);
       const list = Array.isArray(data) ? data : (data.flashcards ?? []);
       if (list.length === 0) { setError("Nessuna flashcard in questa cartella."); setLoading(false); return; }
       setTotalCards(list.length);